@@ -1,17 +1,38 @@
 from django.contrib import admin
 from django.utils.html import format_html
-from django.db.models import Sum, F
+from django.db.models import Count, F, Q, Sum
 from django.urls import path
 from django.http import JsonResponse
-from django.utils import timezone
-from datetime import timedelta
-from .models import Service, Patient, Invoice, InvoiceItem, StaffProfile
+from .models import Service, Patient, Invoice, InvoiceItem, StaffProfile, DuplicateSuggestion, SlowQuery, LINE_TOTAL_CENTAVOS
+from .money import format_centavos
+from . import kpis
+from .duplicates import merge_patients
+from .pagination import ApproximateCountPaginator
 from django.contrib.auth.models import User
 from django.contrib.auth.admin import UserAdmin as BaseUserAdmin
 
+class AllObjectsAdmin(admin.ModelAdmin):
+    """The default managers hide archived rows; the admin still manages them."""
+    def get_queryset(self, request):
+        qs = self.model.all_objects.get_queryset()
+        ordering = self.get_ordering(request)
+        if ordering:
+            qs = qs.order_by(*ordering)
+        return qs
+
+
+def _admin_object_id(request):
+    """The id in a change page's URL as an int; None on add pages."""
+    object_id = request.resolver_match.kwargs.get('object_id') if request.resolver_match else None
+    try:
+        return int(object_id)
+    except (TypeError, ValueError):
+        return None
+
+
 # --- Service Admin ---
 @admin.register(Service)
-class ServiceAdmin(admin.ModelAdmin):
+class ServiceAdmin(AllObjectsAdmin):
     list_display = ('category_display', 'name', 'price_display', 'active_status')
     list_filter = ('category', 'active', 'price')
     search_fields = ('name', 'category', 'description')
@@ -31,7 +52,7 @@ class ServiceAdmin(admin.ModelAdmin):
     category_display.short_description = 'Service Type'
     
     def price_display(self, obj):
-        return format_html('<strong>₱{:,.2f}</strong>', obj.price)
+        return format_html('<strong>₱{}</strong>', f'{obj.price:,.2f}')
     price_display.short_description = 'Price'
     
     def active_status(self, obj):
@@ -43,11 +64,15 @@ class ServiceAdmin(admin.ModelAdmin):
 
 # --- Patient Admin ---
 @admin.register(Patient)
-class PatientAdmin(admin.ModelAdmin):
+class PatientAdmin(AllObjectsAdmin):
     list_display = ('full_name', 'contact_number', 'email', 'total_invoices', 'total_spent', 'created_by', 'created_at')
     search_fields = ('first_name', 'last_name', 'email', 'contact_number')
     ordering = ('last_name', 'first_name')
     readonly_fields = ('created_info', 'invoice_history', 'created_by', 'created_at')
+    list_select_related = ('created_by',)
+    # Estimated counts on big tables; skip the second unfiltered COUNT(*)
+    paginator = ApproximateCountPaginator
+    show_full_result_count = False
     fieldsets = (
         ('Personal Information', {
             'fields': ('first_name', 'last_name', 'email', 'contact_number', 'created_by', 'created_at')
@@ -66,13 +91,18 @@ class PatientAdmin(admin.ModelAdmin):
     full_name.short_description = 'Patient Name'
     full_name.admin_order_field = 'last_name'
     
+    def get_queryset(self, request):
+        # invoices_count / total_spent are computed in SQL instead of per row
+        return super().get_queryset(request).with_invoice_stats()
+    
     def total_invoices(self, obj):
-        count = obj.invoices.count()
+        count = obj.invoices_count
         return format_html('<span style="color: blue; font-weight: bold;">{}</span>', count)
     total_invoices.short_description = 'Total Invoices'
+    total_invoices.admin_order_field = 'invoices_count'
     
     def total_spent(self, obj):
-        total = sum(inv.total_amount() for inv in obj.invoices.all())
+        total = obj.total_spent
         # Ensure numeric formatting is applied to a native Python number/string
         try:
             formatted = f"₱{float(total):,.2f}"
@@ -81,6 +111,7 @@ class PatientAdmin(admin.ModelAdmin):
             formatted = f"₱{total}"
         return format_html('<span style="color: darkgreen; font-weight: bold;">{}</span>', formatted)
     total_spent.short_description = 'Total Spent'
+    total_spent.admin_order_field = 'total_spent'
     
     def created_info(self, obj):
         invoices = obj.invoices.all()
@@ -91,7 +122,7 @@ class PatientAdmin(admin.ModelAdmin):
     created_info.short_description = 'First Service Date'
     
     def invoice_history(self, obj):
-        invoices = obj.invoices.all()[:5]
+        invoices = obj.invoices.with_totals()[:5]
         if not invoices:
             return "No invoices"
         html = '<table style="width: 100%; border-collapse: collapse;"><tr><th style="border: 1px solid #ddd; padding: 5px;">Date</th><th style="border: 1px solid #ddd; padding: 5px;">Amount</th><th style="border: 1px solid #ddd; padding: 5px;">Status</th></tr>'
@@ -110,6 +141,18 @@ class InvoiceItemInline(admin.TabularInline):
     fields = ('service', 'service_name_at_time', 'price_at_time', 'quantity', 'item_total')
     readonly_fields = ('service_name_at_time', 'price_at_time', 'item_total')
     
+    def formfield_for_foreignkey(self, db_field, request, **kwargs):
+        if db_field.name == 'service':
+            # Lines may point at services archived since the sale; keep those valid
+            kwargs['queryset'] = Service.objects.including(
+                InvoiceItem.objects.filter(invoice_id=_admin_object_id(request)).values('service_id')
+            )
+        field = super().formfield_for_foreignkey(db_field, request, **kwargs)
+        if db_field.name == 'service':
+            # Every row renders the same service dropdown; load the options once, not per row
+            field.choices = list(field.choices)
+        return field
+    
     def item_total(self, obj):
         if obj.pk:
             try:
@@ -124,12 +167,15 @@ class InvoiceItemInline(admin.TabularInline):
 
 # --- Invoice Admin ---
 @admin.register(Invoice)
-class InvoiceAdmin(admin.ModelAdmin):
+class InvoiceAdmin(AllObjectsAdmin):
     list_display = ('invoice_id', 'patient_name', 'date_display', 'payment_status', 'total_amount_display', 'action_buttons')
     list_filter = ('is_paid', 'date_created')
     search_fields = ('patient__first_name', 'patient__last_name', 'id')
     inlines = [InvoiceItemInline]
     date_hierarchy = 'date_created'
+    list_select_related = ('patient',)
+    paginator = ApproximateCountPaginator
+    show_full_result_count = False
     readonly_fields = ('date_created', 'invoice_summary')
     fieldsets = (
         ('Invoice Information', {
@@ -139,12 +185,26 @@ class InvoiceAdmin(admin.ModelAdmin):
             'fields': ('invoice_summary',)
         }),
     )
+
+    def formfield_for_foreignkey(self, db_field, request, **kwargs):
+        if db_field.name == 'patient':
+            # An invoice keeps its patient after the patient is archived
+            kwargs['queryset'] = Patient.objects.including(
+                Invoice.all_objects.filter(pk=_admin_object_id(request)).values('patient_id')
+            )
+        return super().formfield_for_foreignkey(db_field, request, **kwargs)
+    
+    def get_queryset(self, request):
+        # amount_total is summed in SQL instead of loading every invoice's items
+        return super().get_queryset(request).with_totals()
     
     def invoice_id(self, obj):
         return format_html('<strong>#{}</strong>', obj.id)
     invoice_id.short_description = 'Invoice #'
     
     def patient_name(self, obj):
+        if not obj.patient:
+            return "-"
         return f"{obj.patient.first_name} {obj.patient.last_name}"
     patient_name.short_description = 'Patient'
     patient_name.admin_order_field = 'patient__last_name'
@@ -162,13 +222,14 @@ class InvoiceAdmin(admin.ModelAdmin):
     payment_status.admin_order_field = 'is_paid'
     
     def total_amount_display(self, obj):
-        amount = obj.total_amount()
+        amount = obj.amount_total
         try:
             formatted = f"₱{float(amount):,.2f}"
         except Exception:
             formatted = f"₱{amount}"
         return format_html('<span style="color: darkgreen; font-weight: bold; font-size: 14px;">{}</span>', formatted)
     total_amount_display.short_description = 'Total Amount'
+    total_amount_display.admin_order_field = 'amount_total'
     
     def action_buttons(self, obj):
         if obj.is_paid:
@@ -206,6 +267,7 @@ class CustomUserAdmin(BaseUserAdmin):
     list_filter = ('is_active', 'is_staff', 'is_superuser', 'last_login')
     search_fields = ('username', 'first_name', 'last_name', 'email')
     ordering = ('-date_joined',)
+    list_select_related = ('staff_profile',)
     actions = ['approve_staff', 'reject_staff']
     
     def full_name(self, obj):
@@ -250,23 +312,26 @@ class CustomUserAdmin(BaseUserAdmin):
     def approve_staff(self, request, queryset):
         """Approve selected staff members"""
         updated = queryset.update(is_active=True)
+        kpis.refresh_staff_count()
         self.message_user(request, f'{updated} staff member(s) approved successfully.')
     approve_staff.short_description = "✓ Approve Selected Staff"
     
     def reject_staff(self, request, queryset):
         """Reject/Deactivate selected staff members"""
         updated = queryset.update(is_active=False)
+        kpis.refresh_staff_count()
         self.message_user(request, f'{updated} staff member(s) rejected/deactivated.')
     reject_staff.short_description = "✗ Reject/Deactivate Selected Staff"
 
 
 # --- StaffProfile Admin ---
 @admin.register(StaffProfile)
-class StaffProfileAdmin(admin.ModelAdmin):
+class StaffProfileAdmin(AllObjectsAdmin):
     list_display = ('username', 'full_name', 'position_display', 'patients_added', 'invoices_created', 'created_at')
     list_filter = ('position', 'created_at')
     search_fields = ('user__username', 'user__first_name', 'user__last_name')
     ordering = ('-created_at',)
+    list_select_related = ('user',)
     readonly_fields = ('user', 'created_at', 'activity_summary')
     fieldsets = (
         ('User Information', {
@@ -281,6 +346,9 @@ class StaffProfileAdmin(admin.ModelAdmin):
         }),
     )
     
+    def get_queryset(self, request):
+        return super().get_queryset(request).with_activity_counts()
+    
     def username(self, obj):
         return obj.user.username
     username.short_description = 'Username'
@@ -302,23 +370,23 @@ class StaffProfileAdmin(admin.ModelAdmin):
     
     def patients_added(self, obj):
         """Count patients added by this staff member"""
-        count = Patient.objects.filter(created_by=obj.user).count()
+        count = obj.patients_added
         return format_html(
             '<span style="background-color: #4CAF50; color: white; padding: 4px 8px; border-radius: 3px; font-weight: bold;">{}</span>',
             count
         )
     patients_added.short_description = 'Patients Added'
+    patients_added.admin_order_field = 'patients_added'
     
     def invoices_created(self, obj):
-        """Count invoices created by this staff member (via patients they added or directly)"""
-        # Get invoices for patients added by this staff member
-        patient_ids = Patient.objects.filter(created_by=obj.user).values_list('id', flat=True)
-        count = Invoice.objects.filter(patient_id__in=patient_ids).count()
+        """Count invoices created by this staff member (via patients they added)"""
+        count = obj.invoices_created
         return format_html(
             '<span style="background-color: #2196F3; color: white; padding: 4px 8px; border-radius: 3px; font-weight: bold;">{}</span>',
             count
         )
     invoices_created.short_description = 'Invoices (via patients)'
+    invoices_created.admin_order_field = 'invoices_created'
     
     def activity_summary(self, obj):
         """Show detailed activity for this staff member"""
@@ -330,10 +398,13 @@ class StaffProfileAdmin(admin.ModelAdmin):
         invoices = Invoice.objects.filter(patient_id__in=patient_ids).order_by('-date_created')
         
         # Calculate totals
-        total_invoices = invoices.count()
-        total_amount = invoices.aggregate(Sum('items__price_at_time'))['items__price_at_time__sum'] or 0
-        paid_invoices = invoices.filter(is_paid=True).count()
-        pending_invoices = invoices.filter(is_paid=False).count()
+        counts = invoices.aggregate(total=Count('id'), paid=Count('id', filter=Q(is_paid=True)))
+        total_invoices = counts['total']
+        total_amount = InvoiceItem.objects.filter(invoice__in=invoices).aggregate(
+            total=Sum(LINE_TOTAL_CENTAVOS)
+        )['total'] or 0
+        paid_invoices = counts['paid']
+        pending_invoices = total_invoices - paid_invoices
         
         html = '<div style="background-color: #f5f5f5; padding: 15px; border-radius: 5px;">'
         html += '<h3>Activity Summary</h3>'
@@ -345,7 +416,7 @@ class StaffProfileAdmin(admin.ModelAdmin):
         html += f'<td style="border: 1px solid #ddd; padding: 8px;"><strong>Total Invoices:</strong></td><td style="border: 1px solid #ddd; padding: 8px;">{total_invoices}</td>'
         html += '</tr>'
         html += '<tr>'
-        html += f'<td style="border: 1px solid #ddd; padding: 8px;"><strong>Total Revenue:</strong></td><td style="border: 1px solid #ddd; padding: 8px; color: green; font-weight: bold;">₱{float(total_amount):,.2f}</td>'
+        html += f'<td style="border: 1px solid #ddd; padding: 8px;"><strong>Total Revenue:</strong></td><td style="border: 1px solid #ddd; padding: 8px; color: green; font-weight: bold;">{format_centavos(total_amount)}</td>'
         html += f'<td style="border: 1px solid #ddd; padding: 8px;"><strong>Paid/Pending:</strong></td><td style="border: 1px solid #ddd; padding: 8px;"><span style="color: green;">✓ {paid_invoices}</span> / <span style="color: orange;">⏳ {pending_invoices}</span></td>'
         html += '</tr>'
         html += '</table>'
@@ -356,11 +427,10 @@ class StaffProfileAdmin(admin.ModelAdmin):
             html += '<table style="width: 100%; border-collapse: collapse; margin-bottom: 15px;">'
             html += '<tr style="background-color: #fff3e0;"><th style="border: 1px solid #ddd; padding: 8px;">Patient Name</th><th style="border: 1px solid #ddd; padding: 8px;">Added Date</th><th style="border: 1px solid #ddd; padding: 8px;">Invoices</th><th style="border: 1px solid #ddd; padding: 8px;">Total Spent</th></tr>'
             
-            for patient in patients[:10]:
-                patient_invoices = patient.invoices.all()
-                patient_total = sum(inv.total_amount() for inv in patient_invoices)
+            for patient in patients.with_invoice_stats()[:10]:
+                patient_total = patient.total_spent or 0
                 date_added = patient.created_at.strftime("%b %d, %Y")
-                html += f'<tr><td style="border: 1px solid #ddd; padding: 8px;">{patient.first_name} {patient.last_name}</td><td style="border: 1px solid #ddd; padding: 8px;">{date_added}</td><td style="border: 1px solid #ddd; padding: 8px;">{patient_invoices.count()}</td><td style="border: 1px solid #ddd; padding: 8px; color: darkgreen; font-weight: bold;">₱{float(patient_total):,.2f}</td></tr>'
+                html += f'<tr><td style="border: 1px solid #ddd; padding: 8px;">{patient.first_name} {patient.last_name}</td><td style="border: 1px solid #ddd; padding: 8px;">{date_added}</td><td style="border: 1px solid #ddd; padding: 8px;">{patient.invoices_count}</td><td style="border: 1px solid #ddd; padding: 8px; color: darkgreen; font-weight: bold;">₱{float(patient_total):,.2f}</td></tr>'
             
             html += '</table>'
         else:
@@ -372,11 +442,11 @@ class StaffProfileAdmin(admin.ModelAdmin):
             html += '<table style="width: 100%; border-collapse: collapse;">'
             html += '<tr style="background-color: #e8f5e9;"><th style="border: 1px solid #ddd; padding: 8px;">Invoice #</th><th style="border: 1px solid #ddd; padding: 8px;">Patient</th><th style="border: 1px solid #ddd; padding: 8px;">Date</th><th style="border: 1px solid #ddd; padding: 8px;">Amount</th><th style="border: 1px solid #ddd; padding: 8px;">Status</th></tr>'
             
-            for invoice in invoices[:10]:
-                amount = invoice.total_amount()
+            for invoice in invoices.select_related('patient').with_centavos()[:10]:
+                amount = invoice.amount_centavos
                 date_created = invoice.date_created.strftime("%b %d, %Y")
                 status = '<span style="color: green; font-weight: bold;">✓ PAID</span>' if invoice.is_paid else '<span style="color: orange; font-weight: bold;">⏳ PENDING</span>'
-                html += f'<tr><td style="border: 1px solid #ddd; padding: 8px;">#{invoice.id}</td><td style="border: 1px solid #ddd; padding: 8px;">{invoice.patient.first_name} {invoice.patient.last_name}</td><td style="border: 1px solid #ddd; padding: 8px;">{date_created}</td><td style="border: 1px solid #ddd; padding: 8px; font-weight: bold;">₱{float(amount):,.2f}</td><td style="border: 1px solid #ddd; padding: 8px;">{status}</td></tr>'
+                html += f'<tr><td style="border: 1px solid #ddd; padding: 8px;">#{invoice.id}</td><td style="border: 1px solid #ddd; padding: 8px;">{invoice.patient.first_name} {invoice.patient.last_name}</td><td style="border: 1px solid #ddd; padding: 8px;">{date_created}</td><td style="border: 1px solid #ddd; padding: 8px; font-weight: bold;">{format_centavos(amount)}</td><td style="border: 1px solid #ddd; padding: 8px;">{status}</td></tr>'
             
             html += '</table>'
         else:
@@ -387,6 +457,105 @@ class StaffProfileAdmin(admin.ModelAdmin):
     activity_summary.short_description = 'Staff Activity'
 
 
+# --- Duplicate Patient Report ---
+@admin.register(DuplicateSuggestion)
+class DuplicateSuggestionAdmin(admin.ModelAdmin):
+    """Merge suggestions produced by `manage.py find_duplicate_patients`"""
+    list_display = ('duplicate_display', 'primary_display', 'score_display', 'reasons', 'created_at')
+    list_filter = ('reasons',)
+    list_select_related = ('primary', 'duplicate')
+    search_fields = ('primary__first_name', 'primary__last_name', 'duplicate__first_name', 'duplicate__last_name')
+    actions = ['merge_into_primary']
+    
+    def has_add_permission(self, request):
+        return False
+    
+    def has_change_permission(self, request, obj=None):
+        return False
+    
+    def _patient_label(self, patient):
+        return f"#{patient.id} {patient.first_name} {patient.last_name} ({patient.contact_number or 'no phone'})"
+    
+    def duplicate_display(self, obj):
+        return self._patient_label(obj.duplicate)
+    duplicate_display.short_description = 'Duplicate'
+    
+    def primary_display(self, obj):
+        return self._patient_label(obj.primary)
+    primary_display.short_description = 'Keep'
+    
+    def score_display(self, obj):
+        color = 'green' if obj.score >= 0.9 else 'orange'
+        return format_html('<span style="color: {}; font-weight: bold;">{}</span>', color, f"{obj.score:.2f}")
+    score_display.short_description = 'Score'
+    score_display.admin_order_field = 'score'
+    
+    def merge_into_primary(self, request, queryset):
+        """Move invoices to the kept patient and archive the duplicate"""
+        merged = 0
+        for suggestion in list(queryset.select_related('primary', 'duplicate')):
+            # an earlier merge in this batch may already have removed this suggestion
+            if not DuplicateSuggestion.objects.filter(pk=suggestion.pk).exists():
+                continue
+            merge_patients(suggestion.primary, suggestion.duplicate)
+            merged += 1
+        self.message_user(request, f'{merged} duplicate patient(s) merged.')
+    merge_into_primary.short_description = "Merge selected duplicates into kept patient"
+
+
+# --- Slow Query Log ---
+@admin.register(SlowQuery)
+class SlowQueryAdmin(admin.ModelAdmin):
+    """Statements over SLOW_QUERY_MS, worst total time first (see clinic.slow_queries)"""
+    list_display = ('sql_display', 'occurrences', 'total_display', 'mean_display', 'max_display', 'view', 'last_seen')
+    list_filter = ('database',)
+    search_fields = ('normalized_sql', 'view', 'location')
+    ordering = ('-total_ms',)
+    fields = (
+        'normalized_sql', 'sql', 'params_shape', 'database', 'view', 'location', 'explain_display',
+        'occurrences', 'total_ms', 'max_ms', 'first_seen', 'last_seen',
+    )
+    readonly_fields = fields
+
+    # Raw SQL and plans are for superusers only; rows are only ever recorded, not edited
+    def has_module_permission(self, request):
+        return request.user.is_active and request.user.is_superuser
+
+    def has_view_permission(self, request, obj=None):
+        return self.has_module_permission(request)
+
+    def has_delete_permission(self, request, obj=None):
+        return self.has_module_permission(request)
+
+    def has_add_permission(self, request):
+        return False
+
+    def has_change_permission(self, request, obj=None):
+        return False
+
+    def sql_display(self, obj):
+        return format_html('<code>{}</code>', obj.normalized_sql[:150])
+    sql_display.short_description = 'Query'
+
+    def total_display(self, obj):
+        return f"{obj.total_ms:,.0f} ms"
+    total_display.short_description = 'Total'
+    total_display.admin_order_field = 'total_ms'
+
+    def mean_display(self, obj):
+        return f"{obj.mean_ms():,.0f} ms"
+    mean_display.short_description = 'Mean'
+
+    def max_display(self, obj):
+        return f"{obj.max_ms:,.0f} ms"
+    max_display.short_description = 'Max'
+    max_display.admin_order_field = 'max_ms'
+
+    def explain_display(self, obj):
+        return format_html('<pre style="white-space: pre-wrap;">{}</pre>', obj.explain or '-')
+    explain_display.short_description = 'Plan (first occurrence)'
+
+
 # Unregister default User admin and register custom
 admin.site.unregister(User)
 admin.site.register(User, CustomUserAdmin)
@@ -398,41 +567,9 @@ class SalesAdminSite(admin.AdminSite):
     index_title = "Dashboard"
     
     def index(self, request, extra_context=None):
-        """Override index to add sales data"""
-        now = timezone.now()
-        today = now.date()
-        
-        # Calculate sales totals
-        today_invoices = Invoice.objects.filter(date_created__date=today)
-        today_total = today_invoices.aggregate(Sum('items__price_at_time'))['items__price_at_time__sum'] or 0
-        
-        week_start = now - timedelta(days=7)
-        week_invoices = Invoice.objects.filter(date_created__gte=week_start)
-        week_total = week_invoices.aggregate(Sum('items__price_at_time'))['items__price_at_time__sum'] or 0
-        
-        month_invoices = Invoice.objects.filter(date_created__year=now.year, date_created__month=now.month)
-        month_total = month_invoices.aggregate(Sum('items__price_at_time'))['items__price_at_time__sum'] or 0
-        
-        year_invoices = Invoice.objects.filter(date_created__year=now.year)
-        year_total = year_invoices.aggregate(Sum('items__price_at_time'))['items__price_at_time__sum'] or 0
-        
-        # Count stats
-        total_patients = Patient.objects.count()
-        total_invoices = Invoice.objects.count()
-        pending_invoices = Invoice.objects.filter(is_paid=False).count()
-        paid_invoices = Invoice.objects.filter(is_paid=True).count()
-        
+        """Override index to add sales data (precomputed, see clinic.kpis)"""
         extra_context = extra_context or {}
-        extra_context.update({
-            'sales_today': float(today_total),
-            'sales_week': float(week_total),
-            'sales_month': float(month_total),
-            'sales_year': float(year_total),
-            'total_patients': total_patients,
-            'total_invoices': total_invoices,
-            'pending_invoices': pending_invoices,
-            'paid_invoices': paid_invoices,
-        })
+        extra_context.update(kpis.dashboard_kpis())
         
         return super().index(request, extra_context)
 
@@ -445,4 +582,6 @@ custom_admin_site.register(Service, ServiceAdmin)
 custom_admin_site.register(Patient, PatientAdmin)
 custom_admin_site.register(Invoice, InvoiceAdmin)
 custom_admin_site.register(StaffProfile, StaffProfileAdmin)
+custom_admin_site.register(DuplicateSuggestion, DuplicateSuggestionAdmin)
 custom_admin_site.register(User, CustomUserAdmin)
+custom_admin_site.register(SlowQuery, SlowQueryAdmin)
@@ -12,6 +12,11 @@ from .serializers import (
     InvoiceSerializer, InvoiceDetailSerializer
 )
 from .forms import StaffRegistrationForm
+from .phone import digits_only, MIN_SUFFIX_DIGITS
+from .pagination import ApproximateCountPagination
+from .catalog import service_catalog
+from .metrics import observe_render
+from .receipts import receipt_data, render_receipt_pdf
 
 
 # ===== AUTHENTICATION API =====
@@ -174,29 +179,56 @@ class AuthViewSet(viewsets.ViewSet):
 # ===== PATIENTS API =====
 class PatientViewSet(viewsets.ModelViewSet):
     """Patient management API"""
-    queryset = Patient.objects.filter(is_archived=False)
+    queryset = Patient.objects.all()
     serializer_class = PatientSerializer
     authentication_classes = [TokenAuthentication]
     permission_classes = [IsAuthenticated]
+    pagination_class = ApproximateCountPagination
     
     def get_queryset(self):
         """Filter by search term"""
-        queryset = Patient.objects.filter(is_archived=False)
+        queryset = Patient.objects.all()
         search = self.request.query_params.get('search', '')
         if search:
-            queryset = queryset.filter(
+            matches = queryset.filter(
                 first_name__icontains=search
             ) | queryset.filter(
                 last_name__icontains=search
             ) | queryset.filter(
                 contact_number__icontains=search
             )
+            # Also match the number however it was typed ("+63 917..." finds "0917...")
+            if len(digits_only(search)) >= MIN_SUFFIX_DIGITS:
+                matches = matches | queryset.by_phone(search, suffix=True)
+            queryset = matches
         return queryset.order_by('-created_at')
     
     def perform_create(self, serializer):
         """Create patient and set created_by"""
         serializer.save(created_by=self.request.user)
     
+    @action(detail=False, methods=['get'])
+    def lookup(self, request):
+        """Find patients by phone: ?phone=<number>&match=exact|suffix"""
+        phone = request.query_params.get('phone', '')
+        match = request.query_params.get('match', 'exact')
+        if match not in ('exact', 'suffix'):
+            return Response(
+                {'error': 'match must be "exact" or "suffix"'},
+                status=status.HTTP_400_BAD_REQUEST
+            )
+        if match == 'suffix' and len(digits_only(phone)) < MIN_SUFFIX_DIGITS:
+            return Response(
+                {'error': f'Suffix lookups need at least {MIN_SUFFIX_DIGITS} digits'},
+                status=status.HTTP_400_BAD_REQUEST
+            )
+        
+        patients = Patient.objects.by_phone(
+            phone, suffix=(match == 'suffix')
+        ).order_by('-created_at')[:20]
+        serializer = self.get_serializer(patients, many=True)
+        return Response({'count': len(serializer.data), 'results': serializer.data})
+    
     @action(detail=True, methods=['post'])
     def request_archive(self, request, pk=None):
         """Soft delete patient"""
@@ -209,18 +241,23 @@ class PatientViewSet(viewsets.ModelViewSet):
 # ===== SERVICES API =====
 class ServiceViewSet(viewsets.ReadOnlyModelViewSet):
     """Services listing API (read-only)"""
-    queryset = Service.objects.filter(is_archived=False, active=True)
+    queryset = Service.objects.filter(active=True)
     serializer_class = ServiceSerializer
     authentication_classes = [TokenAuthentication]
     permission_classes = [IsAuthenticated]
 
+    def list(self, request, *args, **kwargs):
+        # Same rows and order as the queryset, from the cached catalog
+        return Response(self.get_serializer(service_catalog.active(), many=True).data)
+
 
 # ===== INVOICES API =====
 class InvoiceViewSet(viewsets.ModelViewSet):
     """Invoice management API"""
-    queryset = Invoice.objects.filter(is_archived=False)
+    queryset = Invoice.objects.all()
     authentication_classes = [TokenAuthentication]
     permission_classes = [IsAuthenticated]
+    pagination_class = ApproximateCountPagination
     
     def get_serializer_class(self):
         if self.action == 'retrieve':
@@ -229,7 +266,8 @@ class InvoiceViewSet(viewsets.ModelViewSet):
     
     def get_queryset(self):
         """Filter by patient if provided"""
-        queryset = Invoice.objects.filter(is_archived=False)
+        # Serializers read each invoice's patient and items, and total_amount() sums the prefetched items
+        queryset = Invoice.objects.select_related('patient', 'created_by').prefetch_related('items')
         patient_id = self.request.query_params.get('patient')
         if patient_id:
             queryset = queryset.filter(patient_id=patient_id)
@@ -241,65 +279,32 @@ class InvoiceViewSet(viewsets.ModelViewSet):
         
         # Create invoice items from services data
         services = self.request.data.get('services', [])
-        for service_data in services:
-            service_id = service_data.get('service')
-            quantity = service_data.get('quantity', 1)
-            
-            try:
-                service = Service.objects.get(id=service_id)
-                InvoiceItem.objects.create(
-                    invoice=invoice,
-                    service=service,
-                    quantity=quantity,
-                    price_at_time=service.price,
-                    service_name_at_time=service.name
-                )
-            except Service.DoesNotExist:
-                pass
+        with service_catalog.confirming() as catalog:
+            for service_data in services:
+                service_id = service_data.get('service')
+                quantity = service_data.get('quantity', 1)
+
+                service = catalog.get(service_id)
+                if service is not None:
+                    InvoiceItem.objects.create(
+                        invoice=invoice,
+                        service_id=service.id,
+                        quantity=quantity,
+                        price_at_time=service.price,
+                        service_name_at_time=service.name
+                    )
     
     @action(detail=True, methods=['get'])
+    @observe_render('pdf')
     def receipt_pdf(self, request, pk=None):
         """Download invoice as PDF"""
         from django.http import FileResponse
-        from django.template.loader import render_to_string
-        from reportlab.pdfgen import canvas
-        from reportlab.lib.pagesizes import letter
         from io import BytesIO
         
         invoice = self.get_object()
         
         try:
-            # Simple PDF generation
-            buffer = BytesIO()
-            pdf = canvas.Canvas(buffer, pagesize=letter)
-            
-            # Add invoice details
-            pdf.setFont("Helvetica-Bold", 16)
-            pdf.drawString(50, 750, f"Invoice #{invoice.id}")
-            
-            pdf.setFont("Helvetica", 10)
-            pdf.drawString(50, 730, f"Patient: {invoice.patient}")
-            pdf.drawString(50, 710, f"Date: {invoice.date_created.strftime('%Y-%m-%d')}")
-            
-            # Add items
-            y = 680
-            pdf.drawString(50, y, "Item | Price | Qty | Total")
-            y -= 20
-            
-            for item in invoice.items.all():
-                total = item.total_price()
-                line = f"{item.service_name_at_time} | {item.price_at_time} | {item.quantity} | {total}"
-                pdf.drawString(50, y, line)
-                y -= 15
-            
-            # Add total
-            pdf.setFont("Helvetica-Bold", 12)
-            y -= 10
-            total_amount = invoice.total_amount()
-            pdf.drawString(50, y, f"Total: ₱{total_amount:.2f}")
-            
-            pdf.save()
-            buffer.seek(0)
+            buffer = BytesIO(render_receipt_pdf(receipt_data(invoice)))
             
             response = FileResponse(buffer, content_type='application/pdf')
             response['Content-Disposition'] = f'attachment; filename="invoice_{invoice.id}.pdf"'
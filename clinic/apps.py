@@ -4,3 +4,7 @@ from django.apps import AppConfig
 class ClinicConfig(AppConfig):
     default_auto_field = "django.db.models.BigAutoField"
     name = "clinic"
+
+    def ready(self):
+        # Register model signal handlers
+        from . import signals  # noqa: F401
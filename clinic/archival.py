@@ -0,0 +1,150 @@
+"""Chunked background cascades for patient and service archival.
+
+Archiving a patient or service also archives their invoices. Doing that as
+one ``UPDATE`` inside the request holds a long write lock for popular
+services, so the views only archive the patient/service row and record an
+``ArchivalJob``. After the request commits, the job runs in a background
+thread in batches of ``ARCHIVAL_BATCH_SIZE`` invoices (default 500), walking
+invoice ids upwards. Each batch is committed on its own, together with the
+job's resume point.
+
+If the process dies mid-job (a deploy, a worker timeout or a
+``max_requests`` recycle), the next worker to start picks up pending jobs
+and running jobs that have gone quiet: ``clinic.startup`` calls
+``resume_in_background``. ``manage.py run_archival_jobs`` does the same in
+the foreground, and can retry failed jobs. Re-running a batch is harmless
+because only still-active invoices are archived.
+"""
+import logging
+import threading
+from datetime import timedelta
+
+from django.conf import settings
+from django.db import connections, transaction
+from django.utils import timezone
+
+from . import kpis
+from .models import ArchivalJob, Invoice
+
+logger = logging.getLogger(__name__)
+
+
+def batch_size():
+    return getattr(settings, 'ARCHIVAL_BATCH_SIZE', 500)
+
+
+def stale_after():
+    return timedelta(seconds=getattr(settings, 'ARCHIVAL_JOB_STALE_SECONDS', 300))
+
+
+def invoices_for(job):
+    """Active invoices the job still has to archive, in id order."""
+    if job.kind == 'patient':
+        invoices = Invoice.objects.filter(patient_id=job.target_id)
+    else:
+        invoices = Invoice.objects.filter(items__service_id=job.target_id).distinct()
+    return invoices.order_by('pk')
+
+
+def start_cascade(kind, target, user=None):
+    """Record a cascade for ``target`` and run it in the background once the caller commits."""
+    job = ArchivalJob.objects.create(
+        kind=kind,
+        target_id=target.pk,
+        target_label=str(target)[:200],
+        created_by=user if user is not None and user.is_authenticated else None,
+    )
+    transaction.on_commit(lambda: run_in_background(job.pk))
+    return job
+
+
+def cancel_cascades(kind, target):
+    """Stop unfinished cascades for ``target`` (e.g. it was restored); archived invoices stay archived."""
+    return ArchivalJob.objects.filter(
+        kind=kind, target_id=target.pk, status__in=[ArchivalJob.PENDING, ArchivalJob.RUNNING],
+    ).update(status=ArchivalJob.CANCELLED, finished_at=timezone.now())
+
+
+def run_in_background(job_id):
+    thread = threading.Thread(target=_run_in_thread, args=(job_id,), name=f'archival-job-{job_id}', daemon=True)
+    thread.start()
+    return thread
+
+
+def _run_in_thread(job_id):
+    try:
+        run_job(job_id)
+    except Exception:
+        logger.exception('Archival job %s failed', job_id)
+    finally:
+        # Connections are per thread; don't leave this one open
+        connections.close_all()
+
+
+def _next_batch(job_id):
+    """Archive one batch. Returns False once the job has nothing left to do."""
+    with transaction.atomic():
+        job = ArchivalJob.objects.select_for_update().get(pk=job_id)
+        if not job.is_active():
+            return False
+        ids = list(
+            invoices_for(job).filter(pk__gt=job.last_pk).values_list('pk', flat=True)[:batch_size()]
+        )
+        if ids:
+            job.processed += kpis.archive_invoices(Invoice.objects.filter(pk__in=ids))
+            job.last_pk = ids[-1]
+            job.status = ArchivalJob.RUNNING
+        else:
+            job.status = ArchivalJob.DONE
+            job.finished_at = timezone.now()
+        job.save()
+        return bool(ids)
+
+
+def run_job(job_id):
+    """Run a job to completion, one committed batch at a time."""
+    job = ArchivalJob.objects.get(pk=job_id)
+    if not job.is_active():
+        return job
+    if job.total is None:
+        # Counted outside any write transaction, only to show progress
+        total = job.processed + invoices_for(job).filter(pk__gt=job.last_pk).count()
+        ArchivalJob.objects.filter(pk=job_id).update(total=total)
+    try:
+        while _next_batch(job_id):
+            pass
+    except Exception as exc:
+        ArchivalJob.objects.filter(pk=job_id).update(
+            status=ArchivalJob.FAILED, error=str(exc)[:2000], updated_at=timezone.now(),
+        )
+        raise
+    return ArchivalJob.objects.get(pk=job_id)
+
+
+def resumable_jobs(include_failed=False):
+    """Jobs a restarted process should pick up: pending, stalled, and optionally failed."""
+    statuses = [ArchivalJob.PENDING]
+    if include_failed:
+        statuses.append(ArchivalJob.FAILED)
+    stalled = ArchivalJob.objects.filter(
+        status=ArchivalJob.RUNNING, updated_at__lt=timezone.now() - stale_after(),
+    )
+    return (ArchivalJob.objects.filter(status__in=statuses) | stalled).order_by('created_at')
+
+
+def resume_in_background():
+    """Claim the jobs ``resumable_jobs()`` returns and run each in a background thread.
+
+    A job is claimed by marking it running only if nobody has touched it
+    since it was read, so workers starting together (on any host) don't
+    both run it. Returns the ids of the jobs started.
+    """
+    started = []
+    for job in resumable_jobs():
+        claimed = ArchivalJob.objects.filter(
+            pk=job.pk, status=job.status, updated_at=job.updated_at,
+        ).update(status=ArchivalJob.RUNNING, updated_at=timezone.now())
+        if claimed:
+            run_in_background(job.pk)
+            started.append(job.pk)
+    return started
@@ -0,0 +1,238 @@
+"""Async versions of the read-heavy API endpoints, for ASGI deployments.
+
+Under gunicorn's sync workers each request holds a whole worker until it is
+done, so one slow receipt or report stalls everyone queued behind it. Run
+``dental_clinic.asgi:application`` under an ASGI server instead (see
+``dental_clinic/asgi.py``) and these views, mounted at ``/api/async/``,
+await the database with Django's async ORM and leave the event loop free
+for other requests in the meantime:
+
+* ``services/`` and ``services/<pk>/``: the active service catalog;
+* ``invoices/`` and ``invoices/<pk>/``: same filters, pagination
+  (``?page=``) and JSON as ``/api/invoices/``;
+* ``invoices/<pk>/receipt_pdf/``: the receipt PDF, drawn in the render pool;
+* ``sales/summary/``: invoice count, paid/unpaid and sales total, with
+  optional ``?start=`` and ``?end=`` (YYYY-MM-DD).
+
+They accept the same ``Authorization: Token <key>`` header or session as
+the DRF views and answer with the same JSON. Serializers only run on rows
+that are already loaded, so they never query.
+
+Drawing a PDF is CPU work that would block the event loop, so it runs in a
+bounded pool of ``ASYNC_RENDER_WORKERS`` (default 4) threads, or processes
+with ``ASYNC_RENDER_POOL = 'process'``. Requests beyond that wait for a free
+worker without holding up anything else.
+
+The project's middleware is sync. Under ASGI Django runs it in a thread
+of each request's own, so requests don't wait for each other there;
+taking it out of the stack made no measurable difference in
+``run_load_test``.
+
+Under WSGI the same URLs work too; Django runs each view in its own event
+loop, which costs a little per request and gains nothing.
+"""
+import asyncio
+import functools
+from concurrent.futures import ProcessPoolExecutor, ThreadPoolExecutor
+from datetime import date
+
+from asgiref.sync import sync_to_async
+from django.conf import settings
+from django.core.paginator import InvalidPage
+from django.db.models import Count, Q, Sum
+from django.http import HttpResponse
+from rest_framework.authtoken.models import Token
+from rest_framework.renderers import JSONRenderer
+from rest_framework.utils.urls import remove_query_param, replace_query_param
+
+from .metrics import observe_render
+from .models import Invoice, InvoiceItem, LINE_TOTAL_CENTAVOS, Service
+from .money import Money
+from .pagination import ApproximateCountPagination, ApproximateCountPaginator
+from .receipts import receipt_data, render_receipt_pdf
+from .serializers import InvoiceDetailSerializer, InvoiceSerializer, ServiceSerializer
+
+_pool = None
+
+
+def render_workers():
+    return getattr(settings, 'ASYNC_RENDER_WORKERS', 4)
+
+
+def render_pool():
+    """The shared executor for CPU-bound rendering, created on first use."""
+    global _pool
+    if _pool is None:
+        if getattr(settings, 'ASYNC_RENDER_POOL', 'thread') == 'process':
+            _pool = ProcessPoolExecutor(max_workers=render_workers())
+        else:
+            _pool = ThreadPoolExecutor(max_workers=render_workers(), thread_name_prefix='render')
+    return _pool
+
+
+async def run_in_render_pool(func, *args):
+    return await asyncio.get_running_loop().run_in_executor(render_pool(), func, *args)
+
+
+def _json(data, status=200):
+    # DRF's renderer, so the bytes match the sync API (e.g. Decimal totals as numbers)
+    return HttpResponse(JSONRenderer().render(data), status=status, content_type='application/json')
+
+
+def _error(detail, status):
+    return _json({'detail': detail}, status)
+
+
+async def authenticate(request):
+    """The user for a ``Token`` header or session, like the DRF views; None when anonymous.
+
+    Raises ``PermissionError`` with DRF's message for a bad token.
+    """
+    header = request.headers.get('Authorization', '').split()
+    if header and header[0].lower() == 'token':
+        if len(header) != 2:
+            raise PermissionError('Invalid token header. No credentials provided.')
+        token = await Token.objects.select_related('user').filter(key=header[1]).afirst()
+        if token is None:
+            raise PermissionError('Invalid token.')
+        if not token.user.is_active:
+            raise PermissionError('User inactive or deleted.')
+        return token.user
+    user = await request.auser()
+    return user if user.is_authenticated else None
+
+
+def api_login_required(view_func):
+    """GET-only async view for authenticated users; sets ``request.user``."""
+    @functools.wraps(view_func)
+    async def _wrapped(request, *args, **kwargs):
+        if request.method not in ('GET', 'HEAD'):
+            return _error(f'Method "{request.method}" not allowed.', 405)
+        try:
+            user = await authenticate(request)
+        except PermissionError as exc:
+            return _error(str(exc), 401)
+        if user is None:
+            return _error('Authentication credentials were not provided.', 401)
+        request.user = user
+        return await view_func(request, *args, **kwargs)
+    return _wrapped
+
+
+async def _paginated(request, queryset, serializer_class):
+    """``ApproximateCountPagination`` for async views: a plain list unless ``?page=`` is sent."""
+    pagination = ApproximateCountPagination
+    if pagination.page_query_param not in request.GET:
+        rows = [row async for row in queryset]
+        return _json(serializer_class(rows, many=True).data)
+
+    try:
+        page_size = min(int(request.GET[pagination.page_size_query_param]), pagination.max_page_size)
+    except (KeyError, ValueError):
+        page_size = pagination.page_size
+    if page_size <= 0:
+        page_size = pagination.page_size
+    paginator = ApproximateCountPaginator(queryset, page_size)
+    try:
+        # count may EXPLAIN on PostgreSQL; validate_number needs it too
+        page = await sync_to_async(paginator.page)(request.GET.get(pagination.page_query_param))
+    except InvalidPage:
+        return _error('Invalid page.', 404)
+    rows = [row async for row in page.object_list]
+
+    url = request.build_absolute_uri()
+    param = pagination.page_query_param
+    next_link = replace_query_param(url, param, page.next_page_number()) if page.has_next() else None
+    previous_link = None
+    if page.has_previous():
+        number = page.previous_page_number()
+        previous_link = remove_query_param(url, param) if number == 1 else replace_query_param(url, param, number)
+    return _json({
+        'count': paginator.count,
+        'count_is_approximate': paginator.is_approximate,
+        'next': next_link,
+        'previous': previous_link,
+        'results': serializer_class(rows, many=True).data,
+    })
+
+
+@api_login_required
+async def services_list(request):
+    services = [service async for service in Service.objects.filter(active=True)]
+    return _json(ServiceSerializer(services, many=True).data)
+
+
+@api_login_required
+async def service_detail(request, pk):
+    service = await Service.objects.filter(active=True, pk=pk).afirst()
+    if service is None:
+        return _error('No Service matches the given query.', 404)
+    return _json(ServiceSerializer(service).data)
+
+
+def _invoices():
+    # Serializers read each invoice's patient and items, and total_amount() sums the prefetched items
+    return Invoice.objects.select_related('patient', 'created_by').prefetch_related('items')
+
+
+@api_login_required
+async def invoices_list(request):
+    invoices = _invoices()
+    patient_id = request.GET.get('patient')
+    if patient_id:
+        invoices = invoices.filter(patient_id=patient_id)
+    return await _paginated(request, invoices.order_by('-date_created'), InvoiceSerializer)
+
+
+async def _invoice_or_none(pk):
+    return await _invoices().filter(pk=pk).afirst()
+
+
+@api_login_required
+async def invoice_detail(request, pk):
+    invoice = await _invoice_or_none(pk)
+    if invoice is None:
+        return _error('No Invoice matches the given query.', 404)
+    return _json(InvoiceDetailSerializer(invoice).data)
+
+
+@api_login_required
+@observe_render('pdf')
+async def receipt_pdf(request, pk):
+    invoice = await _invoice_or_none(pk)
+    if invoice is None:
+        return _error('No Invoice matches the given query.', 404)
+    content = await run_in_render_pool(render_receipt_pdf, receipt_data(invoice))
+    response = HttpResponse(content, content_type='application/pdf')
+    response['Content-Disposition'] = f'attachment; filename="invoice_{invoice.id}.pdf"'
+    return response
+
+
+@api_login_required
+async def sales_summary(request):
+    """Totals of the (not archived) invoices in ``?start=``..``?end=``, both optional."""
+    invoices = Invoice.objects.all()
+    try:
+        if request.GET.get('start'):
+            invoices = invoices.filter(date_created__date__gte=date.fromisoformat(request.GET['start']))
+        if request.GET.get('end'):
+            invoices = invoices.filter(date_created__date__lte=date.fromisoformat(request.GET['end']))
+    except ValueError:
+        return _error('start and end must be YYYY-MM-DD dates.', 400)
+
+    counts = await invoices.aaggregate(
+        invoices=Count('id'),
+        paid=Count('id', filter=Q(is_paid=True)),
+    )
+    sales = await InvoiceItem.objects.filter(invoice__in=invoices.values('pk')).aaggregate(
+        centavos=Sum(LINE_TOTAL_CENTAVOS),
+    )
+    total = Money(sales['centavos'] or 0)
+    return _json({
+        'start': request.GET.get('start') or None,
+        'end': request.GET.get('end') or None,
+        'total_invoices': counts['invoices'],
+        'paid_invoices': counts['paid'],
+        'unpaid_invoices': counts['invoices'] - counts['paid'],
+        'total_sales': str(total.as_decimal()),
+    })
@@ -0,0 +1,335 @@
+"""Latency and query-count benchmarks for the heavy endpoints.
+
+``manage.py run_benchmarks`` builds a throwaway test database for each
+dataset size, fills it with ``generate_clinic_data`` and requests every
+endpoint in ``ENDPOINTS`` through the Django test client. For each
+endpoint it records:
+
+* p50/p95/max latency over ``repeat`` timed requests, after one warm-up
+  request;
+* the SQL query count of one request;
+* the peak Python memory of one request, measured with ``tracemalloc``
+  on a separate request because tracing slows everything down.
+
+Results are plain JSON. ``compare`` checks a run against a saved baseline
+and lists the endpoints that got slower or started issuing more queries.
+
+``run_benchmarks --checkout`` also times the staff POS checkout against
+catalogs of ``CHECKOUT_CATALOG_SIZES`` active services, posting
+``CHECKOUT_LINES`` quantities like the POS page does (it leaves out the
+services left at zero).
+
+``manage.py run_load_test`` compares one sync worker with one ASGI worker
+(see ``clinic.async_api``). The sync worker serves ``requests`` requests
+one after another, like a gunicorn sync worker. The ASGI worker gets the
+same requests from ``concurrency`` clients at once, through Django's
+``ASGIHandler`` on one event loop. Each SQL query is delayed by
+``db_latency_ms`` to stand in for the network round trip to PostgreSQL;
+an in-process SQLite database has none, and waiting on I/O is exactly what
+async serving overlaps.
+"""
+import asyncio
+import os
+import statistics
+import time
+import tracemalloc
+from contextlib import contextmanager
+
+from django.contrib.auth.models import User
+from django.core.cache import cache
+from django.core.handlers.asgi import ASGIHandler
+from django.core.management import call_command
+from django.db import connection, connections
+from django.db.backends.signals import connection_created
+from django.test import Client
+from django.test.utils import CaptureQueriesContext
+from django.urls import reverse
+from rest_framework.authtoken.models import Token
+
+from .catalog import service_catalog
+from .models import Invoice, Patient, Service, StaffProfile
+
+DATASETS = {
+    'small': {'staff': 5, 'patients': 500, 'invoices': 2_000},
+    'medium': {'staff': 20, 'patients': 5_000, 'invoices': 50_000},
+    'large': {'staff': 50, 'patients': 50_000, 'invoices': 500_000},
+}
+
+# name -> (url name, kwargs from a sample invoice, query string)
+ENDPOINTS = {
+    'dashboard': ('clinic:dashboard', None, ''),
+    'admin_index': ('admin:index', None, ''),
+    'sales_analytics': ('clinic:sales_analytics', None, ''),
+    'staff_list': ('clinic:staff_list', None, ''),
+    'invoice_api_list': ('api:invoices-list', None, '?page=1'),
+    'invoice_api_detail': ('api:invoices-detail', lambda inv: {'pk': inv.pk}, ''),
+    'sales_summary_csv': ('clinic:sales_summary_csv', None, ''),
+    'sales_summary_xlsx': ('clinic:sales_summary_xlsx', None, ''),
+    'sales_summary_pdf': ('clinic:sales_summary_pdf', None, ''),
+    'receipt_pdf': ('clinic:invoice_pdf', lambda inv: {'pk': inv.pk}, ''),
+}
+
+
+def _percentile(samples, pct):
+    ordered = sorted(samples)
+    index = max(0, min(len(ordered) - 1, round(pct / 100 * len(ordered)) - 1))
+    return ordered[index]
+
+
+def _url(endpoint, invoice):
+    name, kwargs, query = ENDPOINTS[endpoint]
+    return reverse(name, kwargs=kwargs(invoice) if kwargs else None) + query
+
+
+def seed(dataset, seed=0):
+    with open(os.devnull, 'w') as devnull:
+        call_command('generate_clinic_data', seed=seed, stdout=devnull, **DATASETS[dataset])
+
+
+def measure(client, url, repeat):
+    client.get(url)  # warm-up: template loading, first-use caches
+    timings = []
+    for _ in range(repeat):
+        started = time.perf_counter()
+        response = client.get(url)
+        timings.append((time.perf_counter() - started) * 1000)
+    with CaptureQueriesContext(connection) as queries:
+        client.get(url)
+    # Read now: the next request resets the connection's query log
+    query_count = len(queries)
+    tracemalloc.start()
+    try:
+        client.get(url)
+        _, peak = tracemalloc.get_traced_memory()
+    finally:
+        tracemalloc.stop()
+    return {
+        'status': response.status_code,
+        'p50_ms': round(statistics.median(timings), 2),
+        'p95_ms': round(_percentile(timings, 95), 2),
+        'max_ms': round(max(timings), 2),
+        'queries': query_count,
+        'peak_kib': round(peak / 1024, 1),
+    }
+
+
+def run_dataset(dataset, endpoints, repeat, seed_value=0):
+    """Benchmark ``endpoints`` against the current (test) database seeded with ``dataset``."""
+    cache.clear()
+    seed(dataset, seed_value)
+    admin = User.objects.create_superuser('benchmark-admin', 'benchmark@example.com', None)
+    # Session for the clinic pages, token for the API viewsets
+    client = Client(headers={'Authorization': f'Token {Token.objects.create(user=admin).key}'})
+    client.force_login(admin)
+    invoice = Invoice.objects.order_by('-pk').first()
+    return {endpoint: measure(client, _url(endpoint, invoice), repeat) for endpoint in endpoints}
+
+
+CHECKOUT_CATALOG_SIZES = (30, 300, 3000)
+CHECKOUT_LINES = 3
+
+
+def run_checkout(repeat, catalog_sizes=CHECKOUT_CATALOG_SIZES):
+    """POS checkout latency and query count per catalog size, on the current (test) database."""
+    cache.clear()
+    staff = User.objects.create_user('benchmark-pos', is_staff=True)
+    StaffProfile.objects.create(user=staff, position='dentist', approved=True)
+    client = Client()
+    client.force_login(staff)
+    patient = Patient.objects.create(first_name='Bench', last_name='Mark', created_by=staff)
+    url = reverse('clinic:staff_pos')
+
+    results = {}
+    for size in sorted(catalog_sizes):
+        missing = size - Service.objects.filter(active=True).count()
+        Service.objects.bulk_create(
+            Service(category='CLEANING', name=f'Benchmark service {n}', price=100 + n % 50)
+            for n in range(missing)
+        )
+        service_catalog.changed()
+        # Spread the picked lines over the catalog
+        ids = list(Service.objects.filter(active=True).values_list('pk', flat=True))
+        form = {f'service_{pk}': '1' for pk in ids[::len(ids) // CHECKOUT_LINES][:CHECKOUT_LINES]}
+        form['patient_id'] = patient.pk
+
+        client.post(url, form)  # warm-up
+        timings = []
+        for _ in range(repeat):
+            started = time.perf_counter()
+            response = client.post(url, form)
+            timings.append((time.perf_counter() - started) * 1000)
+        with CaptureQueriesContext(connection) as queries:
+            client.post(url, form)
+        results[str(size)] = {
+            'status': response.status_code,
+            'p50_ms': round(statistics.median(timings), 2),
+            'p95_ms': round(_percentile(timings, 95), 2),
+            'queries': len(queries),
+        }
+    return results
+
+
+def compare(results, baseline, tolerance=0.2, min_ms=10.0):
+    """Regressions of ``results`` against ``baseline``, as readable strings.
+
+    Latency counts as a regression when p95 grew by more than ``tolerance``
+    and by at least ``min_ms`` (tiny timings are mostly noise). Any growth
+    in query count counts.
+    """
+    regressions = []
+    for dataset, endpoints in results.items():
+        for endpoint, now in endpoints.items():
+            before = baseline.get(dataset, {}).get(endpoint)
+            if before is None:
+                continue
+            if now['p95_ms'] > before['p95_ms'] * (1 + tolerance) and now['p95_ms'] - before['p95_ms'] >= min_ms:
+                regressions.append(
+                    f"{dataset}/{endpoint}: p95 {before['p95_ms']}ms -> {now['p95_ms']}ms"
+                )
+            if now['queries'] > before['queries']:
+                regressions.append(
+                    f"{dataset}/{endpoint}: queries {before['queries']} -> {now['queries']}"
+                )
+    return regressions
+
+
+# --- sync worker vs ASGI worker --------------------------------------------
+
+# name -> (sync URL name, async URL name, kwargs from a sample invoice, query string)
+LOAD_ENDPOINTS = {
+    'services': ('api:services-list', 'async_api:services', None, ''),
+    'invoice_list': ('api:invoices-list', 'async_api:invoices', None, '?page=1'),
+    'invoice_detail': ('api:invoices-detail', 'async_api:invoice_detail', lambda inv: {'pk': inv.pk}, ''),
+    'receipt_pdf': ('api:invoices-receipt-pdf', 'async_api:receipt_pdf', lambda inv: {'pk': inv.pk}, ''),
+    # No sync API for this one: the sync worker serves the async view one request at a time
+    'sales_summary': ('async_api:sales_summary', 'async_api:sales_summary', None, ''),
+}
+
+
+@contextmanager
+def db_latency(ms):
+    """Sleep ``ms`` before every SQL query, on every connection, in every thread."""
+    if not ms:
+        yield
+        return
+
+    def delay(execute, sql, params, many, context):
+        time.sleep(ms / 1000)
+        return execute(sql, params, many, context)
+
+    def add(connection, **kwargs):
+        if delay not in connection.execute_wrappers:
+            connection.execute_wrappers.append(delay)
+
+    # ASGI requests run their queries in threads of their own, with new connections
+    connection_created.connect(add, weak=False)
+    for alias in connections:
+        add(connections[alias])
+    try:
+        yield
+    finally:
+        connection_created.disconnect(add)
+        for alias in connections:
+            if delay in connections[alias].execute_wrappers:
+                connections[alias].execute_wrappers.remove(delay)
+
+
+async def asgi_get(app, url, headers):
+    """GET ``url`` from the ASGI ``app``; returns the status code."""
+    path, _, query = url.partition('?')
+    scope = {
+        'type': 'http', 'asgi': {'version': '3.0'}, 'http_version': '1.1',
+        'method': 'GET', 'scheme': 'http', 'path': path, 'raw_path': path.encode(),
+        'query_string': query.encode(), 'root_path': '',
+        'headers': [(b'host', b'testserver')] + [(k.lower().encode(), v.encode()) for k, v in headers.items()],
+        'server': ('testserver', 80), 'client': ('127.0.0.1', 50000),
+    }
+    body_sent = False
+    status = None
+
+    async def receive():
+        nonlocal body_sent
+        if not body_sent:
+            body_sent = True
+            return {'type': 'http.request', 'body': b'', 'more_body': False}
+        await asyncio.Event().wait()  # the client never disconnects early
+
+    async def send(message):
+        nonlocal status
+        if message['type'] == 'http.response.start':
+            status = message['status']
+
+    await app(scope, receive, send)
+    return status
+
+
+def _summary(timings, elapsed, statuses):
+    return {
+        'status': sorted(set(statuses)),
+        'requests_per_s': round(len(timings) / elapsed, 1),
+        'p50_ms': round(statistics.median(timings), 2),
+        'p95_ms': round(_percentile(timings, 95), 2),
+    }
+
+
+def sync_worker(client, url, requests):
+    client.get(url)  # warm-up
+    timings, statuses = [], []
+    started = time.perf_counter()
+    for _ in range(requests):
+        began = time.perf_counter()
+        statuses.append(client.get(url).status_code)
+        timings.append((time.perf_counter() - began) * 1000)
+    return _summary(timings, time.perf_counter() - started, statuses)
+
+
+async def asgi_worker(app, url, headers, requests, concurrency):
+    await asgi_get(app, url, headers)  # warm-up
+    slots = asyncio.Semaphore(concurrency)
+    timings, statuses = [], []
+    in_flight = peak = 0
+
+    async def one():
+        nonlocal in_flight, peak
+        async with slots:
+            in_flight += 1
+            peak = max(peak, in_flight)
+            began = time.perf_counter()
+            try:
+                statuses.append(await asgi_get(app, url, headers))
+            finally:
+                timings.append((time.perf_counter() - began) * 1000)
+                in_flight -= 1
+
+    started = time.perf_counter()
+    await asyncio.gather(*(one() for _ in range(requests)))
+    result = _summary(timings, time.perf_counter() - started, statuses)
+    result['peak_in_flight'] = peak
+    return result
+
+
+def run_load_test(dataset, endpoints, requests, concurrency, db_latency_ms, seed_value=0):
+    """Requests per second of a sync worker and an ASGI worker on the current (test) database."""
+    cache.clear()
+    seed(dataset, seed_value)
+    admin = User.objects.create_superuser('load-test-admin', 'load-test@example.com', None)
+    headers = {'Authorization': f'Token {Token.objects.create(user=admin).key}'}
+    client = Client(headers=headers)
+    invoice = Invoice.objects.order_by('-pk').first()
+    app = ASGIHandler()
+
+    results = {}
+    with db_latency(db_latency_ms):
+        for endpoint in endpoints:
+            sync_name, async_name, kwargs, query = LOAD_ENDPOINTS[endpoint]
+            kwargs = kwargs(invoice) if kwargs else None
+            sync = sync_worker(client, reverse(sync_name, kwargs=kwargs) + query, requests)
+            asgi = asyncio.run(asgi_worker(
+                app, reverse(async_name, kwargs=kwargs) + query, headers, requests, concurrency,
+            ))
+            results[endpoint] = {
+                'sync': sync,
+                'asgi': asgi,
+                'speedup': round(asgi['requests_per_s'] / sync['requests_per_s'], 2),
+            }
+    return results
@@ -0,0 +1,165 @@
+"""Process-wide cache of the service catalog.
+
+The catalog is a few dozen rows that change a few times a month, but the
+POS page and checkout, ``select_services``, the services API and every
+``InvoiceItem`` price snapshot used to query it. ``service_catalog`` keeps
+the services that are not archived as immutable ``CatalogService`` records
+in each worker process.
+
+The copy is tagged with the catalog version in the ``CatalogVersion`` row.
+The Service signals in ``clinic.signals`` write a new version when a
+service is saved (edited, archived, restored) or deleted; being in the
+database, it reaches the other workers when the transaction commits,
+whatever cache they use.
+
+* Pages and read APIs (``active()``, ``get()``) use the copy without a
+  query. Once it is ``SERVICE_CATALOG_MAX_AGE`` seconds (default 60) old
+  they read the version and reload if it changed, so another worker's
+  edit shows up within that time; this worker's own edits show at once.
+* Anything that snapshots prices into an invoice runs inside
+  ``service_catalog.confirming()``, which reads the version first (one
+  query) and reloads on a change, so a sale never uses a stale price or
+  a service archived or deactivated on another worker. ``InvoiceItem.save``
+  reuses the confirmed copy, or confirms on its own outside the block.
+
+``QuerySet.update()`` and ``bulk_create()`` send no signals: call
+``service_catalog.changed()`` after using them on services.
+"""
+import threading
+import time
+import uuid
+from contextlib import contextmanager
+from contextvars import ContextVar
+from decimal import Decimal
+from typing import NamedTuple, Optional
+
+from django.conf import settings
+from django.db import IntegrityError, transaction
+
+_confirmed = ContextVar('service_catalog_confirmed', default=None)
+
+
+class CatalogService(NamedTuple):
+    """One service as the catalog holds it; the attributes match ``Service``'s."""
+    id: int
+    category: str
+    name: Optional[str]
+    description: Optional[str]
+    price: Optional[Decimal]
+    active: bool
+
+
+class Catalog:
+    """The not archived services at one catalog version."""
+    __slots__ = ('version', 'checked_at', '_services', '_active')
+
+    def __init__(self, version, services):
+        self.version = version
+        self.checked_at = time.monotonic()
+        self._services = services
+        self._active = tuple(service for service in services.values() if service.active)
+
+    def active(self):
+        """The active services, in id order (what ``Service.objects.filter(active=True)`` returns)."""
+        return self._active
+
+    def get(self, pk):
+        """The service with id ``pk``, active or not; None if there is none or it is archived."""
+        try:
+            pk = int(pk)
+        except (TypeError, ValueError):
+            return None
+        return self._services.get(pk)
+
+    def get_active(self, pk):
+        service = self.get(pk)
+        return service if service is not None and service.active else None
+
+
+class ServiceCatalog:
+    """The not archived services of this process, reloaded when the catalog version changes."""
+
+    def __init__(self, max_age=None):
+        self._lock = threading.Lock()
+        self._max_age = max_age
+        self._catalog = None
+
+    @property
+    def max_age(self):
+        if self._max_age is not None:
+            return self._max_age
+        return getattr(settings, 'SERVICE_CATALOG_MAX_AGE', 60)
+
+    def version(self):
+        """The catalog version in the database ('' before the first change)."""
+        from .models import CatalogVersion
+
+        return CatalogVersion.objects.filter(pk=1).values_list('version', flat=True).first() or ''
+
+    def changed(self):
+        """Write a new catalog version, which other processes see once this transaction commits."""
+        from .models import CatalogVersion
+
+        version = uuid.uuid4().hex
+        if not CatalogVersion.objects.filter(pk=1).update(version=version):
+            try:
+                with transaction.atomic():
+                    CatalogVersion.objects.create(pk=1, version=version)
+            except IntegrityError:
+                CatalogVersion.objects.filter(pk=1).update(version=version)
+        # This process needn't wait for max_age: its own lookups reload now and after commit
+        _confirmed.set(None)
+        self.invalidate()
+        transaction.on_commit(self.invalidate)
+
+    def invalidate(self):
+        """Drop this process's copy; the next lookup reloads it."""
+        with self._lock:
+            self._catalog = None
+
+    def load(self, version):
+        from .models import Service
+
+        rows = Service.objects.order_by('pk').values_list(*CatalogService._fields)
+        catalog = Catalog(version, {row[0]: CatalogService(*row) for row in rows})
+        with self._lock:
+            self._catalog = catalog
+        return catalog
+
+    def _current(self, confirm=False):
+        with self._lock:
+            catalog = self._catalog
+        if catalog is not None and not confirm and time.monotonic() - catalog.checked_at <= self.max_age:
+            return catalog
+        # Read the version before loading: a change committed meanwhile writes
+        # a newer one, and the next check loads again
+        version = self.version()
+        if catalog is not None and catalog.version == version:
+            catalog.checked_at = time.monotonic()
+            return catalog
+        return self.load(version)
+
+    def confirmed(self):
+        """The catalog checked against the database version: the one ``confirming()`` holds, else checked now."""
+        return _confirmed.get() or self._current(confirm=True)
+
+    @contextmanager
+    def confirming(self):
+        """Check the version once and use that catalog for every price snapshot in the block."""
+        token = _confirmed.set(self._current(confirm=True))
+        try:
+            yield _confirmed.get()
+        finally:
+            _confirmed.reset(token)
+
+    def active(self):
+        return self._current().active()
+
+    def get(self, pk):
+        return self._current().get(pk)
+
+    def get_active(self, pk):
+        return self._current().get_active(pk)
+
+
+service_catalog = ServiceCatalog()
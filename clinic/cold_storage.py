@@ -0,0 +1,135 @@
+"""Cold storage for invoices that have been archived for a long time.
+
+Archived invoices stay in the hot ``clinic_invoice``/``clinic_invoiceitem``
+tables while they might still be restored. Once they have been archived
+for ``INVOICE_COLD_STORAGE_DAYS`` (default 90) the ``move_archived_invoices``
+command copies them into ``ArchivedInvoice``/``ArchivedInvoiceItem`` and
+deletes the originals, so queries over live invoices no longer scan them.
+
+The archive page lists both kinds, and ``restore_invoice`` thaws a cold
+invoice back into the hot tables, under its original id, before restoring it.
+"""
+from datetime import timedelta
+
+from django.conf import settings
+from django.db import connection, transaction
+from django.db.models import Q
+from django.utils import timezone
+
+from .models import ArchivedInvoice, ArchivedInvoiceItem, Invoice, InvoiceItem
+
+
+def cold_storage_age():
+    return timedelta(days=getattr(settings, 'INVOICE_COLD_STORAGE_DAYS', 90))
+
+
+def eligible_invoices(age=None):
+    """Archived invoices old enough to move; ones archived before archived_at existed go by date."""
+    cutoff = timezone.now() - (cold_storage_age() if age is None else age)
+    return Invoice.all_objects.filter(is_archived=True).filter(
+        Q(archived_at__lte=cutoff) | Q(archived_at__isnull=True, date_created__lte=cutoff)
+    )
+
+
+def _patient_name(patient):
+    if patient is None:
+        return ''
+    return f"{patient.first_name or ''} {patient.last_name or ''}".strip()
+
+
+def _delete_where_in(model, column, ids):
+    """``DELETE FROM <model's table> WHERE <column> IN (ids)``, with no collector or signals."""
+    quote = connection.ops.quote_name
+    placeholders = ', '.join(['%s'] * len(ids))
+    with connection.cursor() as cursor:
+        cursor.execute(
+            f'DELETE FROM {quote(model._meta.db_table)} WHERE {quote(column)} IN ({placeholders})', ids,
+        )
+
+
+def freeze_invoices(ids):
+    """Move the given archived invoices into cold storage. Returns how many moved."""
+    with transaction.atomic():
+        invoices = list(
+            Invoice.all_objects.filter(pk__in=ids, is_archived=True)
+            .select_for_update(of=('self',))
+            .select_related('patient')
+            .with_totals()
+        )
+        if not invoices:
+            return 0
+        moved = [inv.pk for inv in invoices]
+        ArchivedInvoice.objects.bulk_create([
+            ArchivedInvoice(
+                id=inv.pk,
+                patient_id=inv.patient_id,
+                patient_name=_patient_name(inv.patient),
+                date_created=inv.date_created,
+                is_paid=inv.is_paid,
+                created_by_id=inv.created_by_id,
+                archived_at=inv.archived_at,
+                total=inv.amount_total,
+            )
+            for inv in invoices
+        ])
+        items = InvoiceItem.objects.filter(invoice_id__in=moved)
+        ArchivedInvoiceItem.objects.bulk_create([
+            ArchivedInvoiceItem(
+                id=item.pk,
+                invoice_id=item.invoice_id,
+                service_id=item.service_id,
+                service_name_at_time=item.service_name_at_time,
+                price_at_time=item.price_at_time,
+                quantity=item.quantity,
+            )
+            for item in items
+        ])
+        # Plain DELETEs: QuerySet.delete() would load every item and send its
+        # post_delete, whose KPI receiver fetches the item's invoice (a query
+        # per item) only to find it archived, which counts for nothing.
+        _delete_where_in(InvoiceItem, InvoiceItem._meta.get_field('invoice').column, moved)
+        _delete_where_in(Invoice, Invoice._meta.pk.column, moved)
+    return len(moved)
+
+
+def move_archived_invoices(age=None, batch_size=500):
+    """Freeze eligible invoices in batches, yielding the running total after each."""
+    total = 0
+    while True:
+        ids = list(eligible_invoices(age).order_by('pk').values_list('pk', flat=True)[:batch_size])
+        if not ids:
+            return
+        total += freeze_invoices(ids)
+        yield total
+
+
+def thaw_invoice(pk):
+    """Move a cold invoice back into the hot tables, still archived. Returns the Invoice."""
+    with transaction.atomic():
+        archived = ArchivedInvoice.objects.select_for_update().get(pk=pk)
+        Invoice.all_objects.bulk_create([
+            Invoice(
+                id=archived.pk,
+                patient_id=archived.patient_id,
+                is_paid=archived.is_paid,
+                created_by_id=archived.created_by_id,
+                is_archived=True,
+                archived_at=archived.archived_at,
+            )
+        ])
+        # date_created is auto_now_add, so the insert stamped it with now
+        Invoice.all_objects.filter(pk=archived.pk).update(date_created=archived.date_created)
+        # bulk_create skips InvoiceItem.save(), which would re-price items from the service
+        InvoiceItem.objects.bulk_create([
+            InvoiceItem(
+                id=item.pk,
+                invoice_id=archived.pk,
+                service_id=item.service_id,
+                service_name_at_time=item.service_name_at_time,
+                price_at_time=item.price_at_time,
+                quantity=item.quantity,
+            )
+            for item in archived.items.all()
+        ])
+        archived.delete()
+    return Invoice.all_objects.get(pk=pk)
@@ -0,0 +1,205 @@
+"""Duplicate patient detection using blocking keys.
+
+Comparing every pair of patients is quadratic, so candidates are first
+grouped into blocks that share a cheap key (normalized phone, email, or a
+phonetic code of the name). Pairs are only scored inside a block. Blocks
+are independent, which lets the scoring run in worker processes.
+"""
+from collections import defaultdict, namedtuple
+from concurrent.futures import ProcessPoolExecutor
+from difflib import SequenceMatcher
+
+from django.db import transaction
+from django.db.models import Q
+
+# Names the POS uses when a patient is created without details
+PLACEHOLDER_NAMES = {('unknown', 'patient'), ('', '')}
+# Blocks larger than this are shared keys (e.g. the clinic's own phone), not people
+MAX_BLOCK_SIZE = 500
+DEFAULT_THRESHOLD = 0.6
+
+PatientRecord = namedtuple('PatientRecord', 'id first_name last_name phone email created_at')
+
+_SOUNDEX_CODES = {
+    **dict.fromkeys('bfpv', '1'),
+    **dict.fromkeys('cgjkqsxz', '2'),
+    **dict.fromkeys('dt', '3'),
+    'l': '4',
+    **dict.fromkeys('mn', '5'),
+    'r': '6',
+}
+
+
+def soundex(name):
+    """American Soundex code ('Robert' -> 'R163'); '' for names without letters."""
+    letters = [ch for ch in (name or '').lower() if ch.isalpha()]
+    if not letters:
+        return ''
+    code = letters[0].upper()
+    last = _SOUNDEX_CODES.get(letters[0], '')
+    for ch in letters[1:]:
+        digit = _SOUNDEX_CODES.get(ch, '')
+        if digit and digit != last:
+            code += digit
+            if len(code) == 4:
+                break
+        # h and w do not separate letters with the same code; vowels do
+        if ch not in 'hw':
+            last = digit
+    return code.ljust(4, '0')
+
+
+def is_placeholder(record):
+    return (record.first_name.lower(), record.last_name.lower()) in PLACEHOLDER_NAMES
+
+
+def blocking_keys(record):
+    keys = []
+    if record.phone:
+        keys.append(f'phone:{record.phone}')
+    if record.email:
+        keys.append(f'email:{record.email}')
+    if not is_placeholder(record):
+        keys.append(f'name:{soundex(record.last_name)}{soundex(record.first_name)}')
+    return keys
+
+
+def score_pair(a, b):
+    """Return ``(score, reasons)`` for two records; higher means more likely the same person."""
+    score = 0.0
+    reasons = []
+    if a.phone and b.phone:
+        if a.phone == b.phone:
+            score += 0.6
+            reasons.append('phone')
+        else:
+            score -= 0.3
+    if a.email and a.email == b.email:
+        score += 0.6
+        reasons.append('email')
+    if not (is_placeholder(a) or is_placeholder(b)):
+        first = _similarity(a.first_name, b.first_name)
+        last = _similarity(a.last_name, b.last_name)
+        if first >= 0.8 and last >= 0.8:
+            score += 0.25 * (first + last)
+            reasons.append('name')
+        elif first < 0.5:
+            # Family members often share a surname, phone or email
+            score -= 0.3
+    return min(score, 1.0), reasons
+
+
+def _similarity(a, b):
+    a = a.lower().replace(' ', '')
+    b = b.lower().replace(' ', '')
+    if not a or not b:
+        return 0.0
+    return SequenceMatcher(None, a, b).ratio()
+
+
+def _score_blocks(blocks, threshold=DEFAULT_THRESHOLD):
+    """Score every pair inside each block. Runs in worker processes."""
+    found = {}
+    for block in blocks:
+        for i, a in enumerate(block):
+            for b in block[i + 1:]:
+                pair = (a.id, b.id) if a.id < b.id else (b.id, a.id)
+                if pair in found:
+                    continue
+                score, reasons = score_pair(a, b)
+                if score >= threshold:
+                    found[pair] = (score, reasons)
+    return found
+
+
+def build_blocks(records):
+    """Group records by blocking key, dropping singleton and oversize blocks."""
+    blocks = defaultdict(list)
+    for record in records:
+        for key in blocking_keys(record):
+            blocks[key].append(record)
+    kept = []
+    skipped = 0
+    for members in blocks.values():
+        if len(members) < 2:
+            continue
+        if len(members) > MAX_BLOCK_SIZE:
+            skipped += 1
+            continue
+        kept.append(members)
+    return kept, skipped
+
+
+def find_duplicates(records, threshold=DEFAULT_THRESHOLD, workers=1):
+    """Return ``(suggestions, stats)`` for an iterable of PatientRecord.
+
+    Each suggestion is ``(primary, duplicate, score, reasons)`` where the
+    primary is the older record.
+    """
+    records = list(records)
+    by_id = {r.id: r for r in records}
+    blocks, skipped = build_blocks(records)
+    comparisons = sum(len(b) * (len(b) - 1) // 2 for b in blocks)
+
+    found = {}
+    if workers > 1 and len(blocks) > 1:
+        chunks = [blocks[i::workers] for i in range(workers)]
+        with ProcessPoolExecutor(max_workers=workers) as pool:
+            for partial in pool.map(_score_blocks, chunks, [threshold] * len(chunks)):
+                for pair, result in partial.items():
+                    if pair not in found or result[0] > found[pair][0]:
+                        found[pair] = result
+    else:
+        found = _score_blocks(blocks, threshold)
+
+    suggestions = []
+    for (a_id, b_id), (score, reasons) in found.items():
+        a, b = by_id[a_id], by_id[b_id]
+        primary, duplicate = (a, b) if (a.created_at, a.id) <= (b.created_at, b.id) else (b, a)
+        suggestions.append((primary, duplicate, score, reasons))
+    suggestions.sort(key=lambda s: (-s[2], s[0].id, s[1].id))
+
+    stats = {
+        'patients': len(records),
+        'blocks': len(blocks),
+        'skipped_blocks': skipped,
+        'comparisons': comparisons,
+        'suggestions': len(suggestions),
+    }
+    return suggestions, stats
+
+
+def load_records():
+    """Active patients as lightweight records for the detection job."""
+    from .models import Patient
+
+    rows = Patient.objects.values_list(
+        'id', 'first_name', 'last_name', 'contact_key', 'email', 'created_at'
+    )
+    for pk, first_name, last_name, phone, email, created_at in rows.iterator(chunk_size=5000):
+        yield PatientRecord(
+            pk,
+            (first_name or '').strip(),
+            (last_name or '').strip(),
+            phone or '',
+            (email or '').strip().lower(),
+            created_at,
+        )
+
+
+def merge_patients(primary, duplicate):
+    """Move the duplicate's invoices to the primary, fill blanks, and archive the duplicate."""
+    from .models import Invoice, DuplicateSuggestion
+
+    with transaction.atomic():
+        Invoice.all_objects.filter(patient=duplicate).update(patient=primary)
+        changed = False
+        for field in ('contact_number', 'email', 'address'):
+            if not getattr(primary, field) and getattr(duplicate, field):
+                setattr(primary, field, getattr(duplicate, field))
+                changed = True
+        if changed:
+            primary.save()
+        duplicate.is_archived = True
+        duplicate.save()
+        DuplicateSuggestion.objects.filter(Q(primary=duplicate) | Q(duplicate=duplicate)).delete()
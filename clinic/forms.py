@@ -106,3 +106,9 @@ class InvoiceForm(forms.ModelForm):
             'is_paid': forms.CheckboxInput(attrs={'class': 'form-check-input'}),
         }
 
+    def __init__(self, *args, **kwargs):
+        super().__init__(*args, **kwargs)
+        # An invoice keeps its patient after the patient is archived
+        patient_ids = [self.instance.patient_id] if self.instance.patient_id else []
+        self.fields['patient'].queryset = Patient.objects.including(patient_ids)
+
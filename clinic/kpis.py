@@ -0,0 +1,322 @@
+"""Precomputed dashboard KPIs.
+
+The admin home page and the clinic dashboard read their figures from the
+``KpiCounter`` table instead of counting and summing the big tables on
+every hit. Counters are adjusted by the save/delete signals in
+``clinic.signals`` inside the same transaction as the row change, so they
+never see half a write. Sales are kept in one bucket per local day;
+today/week/month/year totals add up the buckets.
+
+Anything that bypasses model signals (``QuerySet.update()``, raw SQL,
+fixtures) goes through a helper here or is repaired by the
+``reconcile_kpis`` management command.
+"""
+from collections import Counter
+from datetime import timedelta
+from decimal import Decimal
+
+from django.conf import settings
+from django.contrib.auth.models import User
+from django.core.cache import cache
+from django.db import IntegrityError, transaction
+from django.db.models import Count, F, Q, Sum
+from django.db.models.functions import TruncDate
+from django.utils import timezone
+
+from . import metrics
+from .models import Invoice, InvoiceItem, KpiCounter, LINE_TOTAL, Patient, Service
+from .money import Money, to_centavos
+
+COUNT_KEYS = ('patients', 'services', 'invoices', 'paid_invoices', 'pending_invoices', 'staff')
+SALES_PREFIX = 'sales:'
+CACHE_KEY = 'clinic:kpis'
+
+
+def cache_timeout():
+    return getattr(settings, 'KPI_CACHE_TIMEOUT', 60)
+
+
+def sales_key(moment):
+    return SALES_PREFIX + timezone.localdate(moment).isoformat()
+
+
+def _invalidate_cache():
+    cache.delete(f'{CACHE_KEY}:{timezone.localdate().isoformat()}')
+
+
+def apply_deltas(deltas):
+    """Add ``deltas`` (key -> amount) to the counters in the current transaction."""
+    deltas = {key: delta for key, delta in deltas.items() if delta}
+    if not deltas:
+        return
+    for key, delta in deltas.items():
+        if KpiCounter.objects.filter(key=key).update(value=F('value') + delta):
+            continue
+        # Named counts only exist once reconcile() has built them; it will count this change too.
+        if not key.startswith(SALES_PREFIX):
+            continue
+        try:
+            with transaction.atomic():
+                KpiCounter.objects.create(key=key, value=delta)
+        except IntegrityError:
+            KpiCounter.objects.filter(key=key).update(value=F('value') + delta)
+    transaction.on_commit(_invalidate_cache)
+
+
+# --- per-model contributions ---------------------------------------------
+
+def _active_count(key):
+    def contribution(values):
+        return {} if values.get('is_archived') else {key: 1}
+    return contribution
+
+
+def _invoice_counts(values):
+    if values.get('is_archived'):
+        return {}
+    return {'invoices': 1, 'paid_invoices' if values.get('is_paid') else 'pending_invoices': 1}
+
+
+COUNT_CONTRIBUTIONS = {
+    Patient: _active_count('patients'),
+    Service: _active_count('services'),
+    Invoice: _invoice_counts,
+}
+
+
+def _invoice_total(invoice_id):
+    total = InvoiceItem.objects.filter(invoice_id=invoice_id).aggregate(total=Sum(LINE_TOTAL))['total']
+    return total or Decimal('0')
+
+
+def _item_sales(item, values):
+    """The sales bucket an item with ``values`` counts towards."""
+    invoice_id = values.get('invoice_id')
+    if invoice_id is None:
+        return {}
+    if invoice_id == item.invoice_id:
+        invoice = item.invoice
+    else:
+        invoice = Invoice.all_objects.filter(pk=invoice_id).only('is_archived', 'date_created').first()
+    if invoice is None or invoice.is_archived:
+        return {}
+    line = (values.get('price_at_time') or Decimal('0')) * (values.get('quantity') or 0)
+    return {sales_key(invoice.date_created): line}
+
+
+def _current_values(instance):
+    return {name: getattr(instance, name) for name in instance.kpi_fields}
+
+
+def _difference(old, new):
+    deltas = Counter()
+    for key, value in new.items():
+        deltas[key] += value
+    for key, value in old.items():
+        deltas[key] -= value
+    return deltas
+
+
+def record_save(instance, created):
+    """post_save hook: apply the change between the loaded and the saved row."""
+    old = {} if created else getattr(instance, '_kpi_loaded', None)
+    new = _current_values(instance)
+    instance._kpi_loaded = new
+    if old is None:
+        # Saved without being loaded from the database; the change is unknown
+        return
+
+    if isinstance(instance, InvoiceItem):
+        deltas = _difference(_item_sales(instance, old) if old else {}, _item_sales(instance, new))
+    else:
+        contribution = COUNT_CONTRIBUTIONS[type(instance)]
+        deltas = _difference(contribution(old) if old else {}, contribution(new))
+        if isinstance(instance, Invoice) and old:
+            deltas.update(_invoice_sales_move(instance, old, new))
+    apply_deltas(deltas)
+
+
+def _invoice_sales_move(invoice, old, new):
+    """Move an invoice's sales when it is archived, restored or re-dated."""
+    was = None if old.get('is_archived') else sales_key(old['date_created'])
+    now = None if new.get('is_archived') else sales_key(new['date_created'])
+    if was == now:
+        return {}
+    total = _invoice_total(invoice.pk)
+    deltas = Counter()
+    if was:
+        deltas[was] -= total
+    if now:
+        deltas[now] += total
+    return deltas
+
+
+def record_delete(instance):
+    """post_delete hook. Invoice items are deleted (and subtracted) before their invoice."""
+    values = _current_values(instance)
+    if isinstance(instance, InvoiceItem):
+        old = _item_sales(instance, values)
+    else:
+        old = COUNT_CONTRIBUTIONS[type(instance)](values)
+    apply_deltas(_difference(old, {}))
+
+
+def archive_invoices(queryset):
+    """``queryset.update(is_archived=True)`` that keeps the counters in step.
+
+    Returns the number of invoices archived.
+    """
+    with transaction.atomic():
+        active = queryset.filter(is_archived=False)
+        ids = list(active.values_list('pk', flat=True))
+        if not ids:
+            return 0
+        invoices = Invoice.objects.filter(pk__in=ids)
+        counts = invoices.aggregate(total=Count('id'), paid=Count('id', filter=Q(is_paid=True)))
+        sales = (
+            InvoiceItem.objects.filter(invoice__in=ids)
+            .annotate(day=TruncDate('invoice__date_created'))
+            .values('day').annotate(total=Sum(LINE_TOTAL)).order_by()
+        )
+        deltas = Counter({
+            'invoices': -counts['total'],
+            'paid_invoices': -counts['paid'],
+            'pending_invoices': -(counts['total'] - counts['paid']),
+        })
+        for row in sales:
+            deltas[SALES_PREFIX + row['day'].isoformat()] -= row['total'] or Decimal('0')
+        archived = invoices.update(is_archived=True, archived_at=timezone.now())
+        apply_deltas(deltas)
+    return archived
+
+
+def create_invoice_items(invoice, items):
+    """``InvoiceItem.objects.bulk_create(items)`` for one invoice that keeps the counters in step.
+
+    The items need their ``price_at_time`` and ``service_name_at_time`` set;
+    ``bulk_create`` skips ``InvoiceItem.save()`` and its post_save signal.
+    One INSERT and one sales counter update, however many lines.
+    """
+    with transaction.atomic():
+        created = InvoiceItem.objects.bulk_create(items)
+        for item in created:
+            item._kpi_loaded = _current_values(item)
+        if not invoice.is_archived:
+            total = sum((item.total_price() for item in created), Decimal('0'))
+            apply_deltas({sales_key(invoice.date_created): total})
+    return created
+
+
+def refresh_staff_count():
+    """Recount active staff; the users table is small and changes rarely."""
+    count = User.objects.filter(is_staff=True, is_active=True).count()
+    if KpiCounter.objects.filter(key='staff').update(value=count):
+        transaction.on_commit(_invalidate_cache)
+
+
+# --- reading and reconciliation ------------------------------------------
+
+def compute_counters():
+    """Recompute every counter from the source tables."""
+    invoices = Invoice.objects.aggregate(
+        total=Count('id'), paid=Count('id', filter=Q(is_paid=True)),
+    )
+    counters = {
+        'patients': Patient.objects.count(),
+        'services': Service.objects.count(),
+        'invoices': invoices['total'],
+        'paid_invoices': invoices['paid'],
+        'pending_invoices': invoices['total'] - invoices['paid'],
+        'staff': User.objects.filter(is_staff=True, is_active=True).count(),
+    }
+    sales = (
+        InvoiceItem.objects.filter(invoice__is_archived=False)
+        .annotate(day=TruncDate('invoice__date_created'))
+        .values('day').annotate(total=Sum(LINE_TOTAL)).order_by()
+    )
+    for row in sales:
+        if row['total']:
+            counters[SALES_PREFIX + row['day'].isoformat()] = row['total']
+    return {key: Decimal(value) for key, value in counters.items()}
+
+
+def reconcile(dry_run=False):
+    """Compare the stored counters with the source tables and repair drift.
+
+    Returns a list of ``(key, stored, actual)`` for every counter that was off.
+    """
+    with transaction.atomic():
+        # Lock the counters first so writers block on their update instead of
+        # committing between our recount and our write.
+        stored = dict(KpiCounter.objects.select_for_update().values_list('key', 'value'))
+        # A day whose sales were all archived again is the same as no bucket
+        stored = {key: value for key, value in stored.items() if value or not key.startswith(SALES_PREFIX)}
+        actual = compute_counters()
+        drift = [
+            (key, stored.get(key), actual.get(key))
+            for key in sorted(set(stored) | set(actual))
+            if stored.get(key) != actual.get(key)
+        ]
+        if dry_run or not drift:
+            return drift
+        for key, _, value in drift:
+            if value is None:
+                KpiCounter.objects.filter(key=key).delete()
+            else:
+                KpiCounter.objects.update_or_create(key=key, defaults={'value': value})
+        transaction.on_commit(_invalidate_cache)
+    return drift
+
+
+def dashboard_kpis():
+    """Figures for both dashboards: one query, then cached for ``KPI_CACHE_TIMEOUT`` seconds."""
+    today = timezone.localdate()
+    cache_key = f'{CACHE_KEY}:{today.isoformat()}'
+    kpis = cache.get(cache_key)
+    metrics.cache_lookup('kpis', kpis is not None)
+    if kpis is not None:
+        return kpis
+
+    week_start = today - timedelta(days=6)
+    first_day = min(today.replace(month=1, day=1), week_start)
+    rows = dict(
+        KpiCounter.objects.filter(
+            Q(key__in=COUNT_KEYS)
+            | Q(key__gte=SALES_PREFIX + first_day.isoformat(), key__lte=SALES_PREFIX + today.isoformat())
+        ).values_list('key', 'value')
+    )
+    if not all(key in rows for key in COUNT_KEYS):
+        # First use (or the table was emptied): build the counters once
+        reconcile()
+        return dashboard_kpis()
+
+    # Buckets are added up as integer centavos
+    sales = {'today': 0, 'week': 0, 'month': 0, 'year': 0}
+    for key, value in rows.items():
+        if not key.startswith(SALES_PREFIX):
+            continue
+        value = to_centavos(value)
+        day = key[len(SALES_PREFIX):]
+        if day == today.isoformat():
+            sales['today'] += value
+        if day >= week_start.isoformat():
+            sales['week'] += value
+        if day[:7] == today.isoformat()[:7]:
+            sales['month'] += value
+        if day[:4] == today.isoformat()[:4]:
+            sales['year'] += value
+
+    kpis = {
+        'total_patients': int(rows['patients']),
+        'total_services': int(rows['services']),
+        'total_invoices': int(rows['invoices']),
+        'paid_invoices': int(rows['paid_invoices']),
+        'pending_invoices': int(rows['pending_invoices']),
+        'total_staff': int(rows['staff']),
+        'sales_today': Money(sales['today']).as_float(),
+        'sales_week': Money(sales['week']).as_float(),
+        'sales_month': Money(sales['month']).as_float(),
+        'sales_year': Money(sales['year']).as_float(),
+    }
+    cache.set(cache_key, kpis, cache_timeout())
+    return kpis
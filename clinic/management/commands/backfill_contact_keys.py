@@ -0,0 +1,32 @@
+from django.core.management.base import BaseCommand
+from clinic.models import Patient
+from clinic.phone import phone_key
+
+
+class Command(BaseCommand):
+    help = 'Populate Patient.contact_key from contact_number for existing patients'
+
+    def add_arguments(self, parser):
+        parser.add_argument('--batch-size', type=int, default=1000, help='Rows written per UPDATE batch')
+
+    def handle(self, *args, **options):
+        batch_size = options['batch_size']
+        patients = Patient.all_objects.only('id', 'contact_number', 'contact_key').order_by('pk')
+
+        pending = []
+        updated = 0
+        for patient in patients.iterator(chunk_size=batch_size):
+            key = phone_key(patient.contact_number)
+            if key == patient.contact_key:
+                continue
+            patient.contact_key = key
+            pending.append(patient)
+            if len(pending) >= batch_size:
+                Patient.all_objects.bulk_update(pending, ['contact_key'])
+                updated += len(pending)
+                pending = []
+        if pending:
+            Patient.all_objects.bulk_update(pending, ['contact_key'])
+            updated += len(pending)
+
+        self.stdout.write(self.style.SUCCESS(f'Done. Updated contact keys: {updated}'))
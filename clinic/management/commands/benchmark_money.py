@@ -0,0 +1,48 @@
+import random
+import time
+from decimal import Decimal
+
+from django.core.management.base import BaseCommand
+from clinic.money import Money, to_centavos
+
+
+class Command(BaseCommand):
+    help = 'Time adding up invoice lines as Decimal, float and integer centavos'
+
+    def add_arguments(self, parser):
+        parser.add_argument('--lines', type=int, default=1_000_000, help='Number of invoice lines to add up')
+        parser.add_argument('--repeat', type=int, default=3, help='Runs per representation; the best one counts')
+        parser.add_argument('--seed', type=int, default=0)
+
+    def handle(self, *args, **options):
+        rng = random.Random(options['seed'])
+        # Prices like the service catalogue's: pesos with two decimal places
+        lines = [
+            (Decimal(rng.randrange(5_000, 2_500_000)).scaleb(-2), rng.randint(1, 4))
+            for _ in range(options['lines'])
+        ]
+        as_decimal = [price * qty for price, qty in lines]
+        as_float = [float(price) * qty for price, qty in lines]
+        as_centavos = [to_centavos(price) * qty for price, qty in lines]
+
+        results = {}
+        for name, values in (('decimal', as_decimal), ('float', as_float), ('centavos', as_centavos)):
+            best = None
+            for _ in range(options['repeat']):
+                started = time.perf_counter()
+                total = sum(values)
+                elapsed = time.perf_counter() - started
+                best = elapsed if best is None else min(best, elapsed)
+            results[name] = (best, total)
+
+        exact = results['decimal'][1]
+        for name, (elapsed, total) in results.items():
+            shown = Money(total) if name == 'centavos' else total
+            value = shown.as_decimal() if name == 'centavos' else Decimal(str(total))
+            drift = '' if name == 'decimal' else f'  drift={value - exact}'
+            self.stdout.write(f'{name:>9}: {elapsed * 1000:8.1f} ms  total={shown}{drift}')
+
+        speedup = results['decimal'][0] / results['centavos'][0]
+        self.stdout.write(self.style.SUCCESS(
+            f"Done. {options['lines']:,} lines: centavos are {speedup:.1f}x faster than Decimal."
+        ))
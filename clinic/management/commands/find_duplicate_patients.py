@@ -0,0 +1,49 @@
+from django.core.management.base import BaseCommand
+from django.db import transaction
+from clinic.duplicates import find_duplicates, load_records, DEFAULT_THRESHOLD
+from clinic.models import DuplicateSuggestion
+
+
+class Command(BaseCommand):
+    help = 'Find likely duplicate patients by blocking key and store merge suggestions for the admin'
+
+    def add_arguments(self, parser):
+        parser.add_argument('--threshold', type=float, default=DEFAULT_THRESHOLD, help='Minimum score (0-1) to suggest a merge')
+        parser.add_argument('--workers', type=int, default=1, help='Worker processes used to score blocks')
+        parser.add_argument('--dry-run', action='store_true', help='Print suggestions without saving them')
+
+    def handle(self, *args, **options):
+        suggestions, stats = find_duplicates(
+            load_records(),
+            threshold=options['threshold'],
+            workers=max(1, options['workers']),
+        )
+        self.stdout.write(
+            f"[duplicates] {stats['patients']} patients, {stats['blocks']} blocks "
+            f"({stats['skipped_blocks']} oversize skipped), {stats['comparisons']} comparisons"
+        )
+
+        if options['dry_run']:
+            for primary, duplicate, score, reasons in suggestions:
+                self.stdout.write(
+                    f"  #{duplicate.id} {duplicate.first_name} {duplicate.last_name} -> "
+                    f"#{primary.id} {primary.first_name} {primary.last_name} "
+                    f"score={score:.2f} ({','.join(reasons)})"
+                )
+        else:
+            with transaction.atomic():
+                DuplicateSuggestion.objects.all().delete()
+                DuplicateSuggestion.objects.bulk_create(
+                    [
+                        DuplicateSuggestion(
+                            primary_id=primary.id,
+                            duplicate_id=duplicate.id,
+                            score=round(score, 3),
+                            reasons=','.join(reasons),
+                        )
+                        for primary, duplicate, score, reasons in suggestions
+                    ],
+                    batch_size=1000,
+                )
+
+        self.stdout.write(self.style.SUCCESS(f"Done. Suggestions: {stats['suggestions']}"))
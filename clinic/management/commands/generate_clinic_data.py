@@ -0,0 +1,210 @@
+import random
+from itertools import count
+import time
+from datetime import datetime, time as clock, timedelta
+from decimal import Decimal
+
+from django.contrib.auth.hashers import make_password
+from django.contrib.auth.models import User
+from django.core.management.base import BaseCommand, CommandError
+from django.core.management.color import no_style
+from django.db import connection, transaction
+from django.db.models import Max
+from django.utils import timezone
+from clinic import kpis
+from clinic.catalog import service_catalog
+from clinic.models import (
+    ArchivedInvoice, ArchivedInvoiceItem, Invoice, InvoiceItem, Patient, Service, StaffProfile,
+)
+from clinic.phone import phone_key
+
+FIRST_NAMES = [
+    'Maria', 'Jose', 'Juan', 'Ana', 'Mark', 'Angelica', 'John', 'Kristine', 'Paolo', 'Jasmine',
+    'Miguel', 'Camille', 'Carlo', 'Patricia', 'Rafael', 'Nicole', 'Gabriel', 'Andrea', 'Joshua', 'Bea',
+]
+LAST_NAMES = [
+    'Santos', 'Reyes', 'Cruz', 'Bautista', 'Ocampo', 'Garcia', 'Mendoza', 'Torres', 'Tomas', 'Andrada',
+    'Castillo', 'Flores', 'Villanueva', 'Ramos', 'Castro', 'Rivera', 'Aquino', 'Navarro', 'Salazar', 'Dela Cruz',
+]
+CITIES = ['Quezon City', 'Manila', 'Makati', 'Pasig', 'Taguig', 'Cebu City', 'Davao City', 'Caloocan']
+# Most visits bill one service once; a few bill several
+ITEMS_PER_INVOICE = ([1, 2, 3, 4], [70, 20, 7, 3])
+QUANTITIES = ([1, 2, 3, 4], [80, 12, 5, 3])
+# Cold storage keeps the original ids, which thaw_invoice puts back in the hot table
+COLD_TABLES = {Invoice: ArchivedInvoice, InvoiceItem: ArchivedInvoiceItem}
+
+
+class Command(BaseCommand):
+    help = (
+        'Bulk-create synthetic staff, patients, invoices and items for benchmarking. '
+        'Run it while nothing else writes: rows are inserted with precomputed ids.'
+    )
+
+    def add_arguments(self, parser):
+        parser.add_argument('--staff', type=int, default=20)
+        parser.add_argument('--patients', type=int, default=10_000)
+        parser.add_argument('--invoices', type=int, default=100_000)
+        parser.add_argument('--days', type=int, default=730, help='Spread invoices over this many past days')
+        parser.add_argument('--paid-fraction', type=float, default=0.85)
+        parser.add_argument('--archived-fraction', type=float, default=0.03)
+        parser.add_argument('--batch-size', type=int, default=5000, help='Rows per bulk insert and transaction')
+        parser.add_argument('--seed', type=int, default=0, help='Same seed and day, same data')
+
+    def handle(self, *args, **options):
+        self.rng = random.Random(options['seed'])
+        self.batch_size = options['batch_size']
+        self.today = timezone.localdate()
+        self.days = max(options['days'], 1)
+        prefix = f"gen{options['seed']}-"
+        if User.objects.filter(username__startswith=prefix).exists():
+            raise CommandError(f'Data for seed {options["seed"]} already exists; pick another --seed.')
+
+        started = time.perf_counter()
+        services = self._services()
+        staff_ids = self._staff(prefix, options['staff'])
+        patient_ids = self._patients(options['patients'], staff_ids)
+        invoices, items = self._invoices(options, patient_ids, staff_ids, services)
+
+        self.stdout.write('Rebuilding dashboard counters...')
+        kpis.reconcile()
+        elapsed = time.perf_counter() - started
+        rows = len(staff_ids) * 2 + len(patient_ids) + invoices + items
+        self.stdout.write(self.style.SUCCESS(
+            f'Done. {len(staff_ids)} staff, {len(patient_ids)} patients, {invoices} invoices, '
+            f'{items} items in {elapsed:.1f}s ({rows / elapsed:,.0f} rows/s)'
+        ))
+
+    # --- helpers -------------------------------------------------------------
+
+    def _moment(self, max_days_ago):
+        """A weekday-hours timestamp, weighted towards recent days like a growing clinic."""
+        days_ago = int(self.rng.triangular(0, max_days_ago, 0))
+        day = self.today - timedelta(days=days_ago)
+        at = clock(self.rng.randint(8, 17), self.rng.randrange(60), self.rng.randrange(60))
+        return timezone.make_aware(datetime.combine(day, at))
+
+    def _insert(self, model, objs):
+        with transaction.atomic():
+            return model.objects.bulk_create(objs, batch_size=self.batch_size)
+
+    def _services(self):
+        """The DEFAULT_PRICES catalogue, creating any category that is missing."""
+        labels = dict(Service.DENTAL_CATEGORIES)
+        existing = {s.category: s for s in Service.objects.filter(category__in=Service.DEFAULT_PRICES)}
+        missing = [
+            Service(category=key, name=labels.get(key, key.title()), price=Decimal(price), active=True)
+            for key, price in Service.DEFAULT_PRICES.items() if key not in existing
+        ]
+        for service in self._insert(Service, missing):
+            existing[service.category] = service
+        if missing:
+            service_catalog.changed()  # bulk_create sends no signals
+        services = sorted(existing.values(), key=lambda s: s.category)
+        self.stdout.write(f'Services: {len(services)} ({len(missing)} created)')
+        return services
+
+    def _staff(self, prefix, count):
+        # One unusable password hash shared by every generated account
+        password = make_password(None)
+        users = self._insert(User, [
+            User(username=f'{prefix}staff{n}', first_name=self.rng.choice(FIRST_NAMES),
+                 last_name=self.rng.choice(LAST_NAMES), is_staff=True, password=password)
+            for n in range(count)
+        ])
+        positions = [key for key, _ in StaffProfile.POSITIONS]
+        self._insert(StaffProfile, [
+            StaffProfile(user=user, position=self.rng.choice(positions), approved=True,
+                         created_at=self._moment(self.days))
+            for user in users
+        ])
+        self.stdout.write(f'Staff: {len(users)}')
+        return [user.pk for user in users]
+
+    def _copy(self, model, columns, rows):
+        """INSERT ``rows`` with ``executemany``, skipping per-object ORM overhead.
+
+        Rows carry explicit ids (see ``_next_ids``) so items can point at
+        invoices without reading ids back.
+        """
+        table = connection.ops.quote_name(model._meta.db_table)
+        names = ', '.join(connection.ops.quote_name(model._meta.get_field(c).column) for c in columns)
+        placeholders = ', '.join(['%s'] * len(columns))
+        with connection.cursor() as cursor:
+            cursor.executemany(f'INSERT INTO {table} ({names}) VALUES ({placeholders})', rows)
+
+    def _next_ids(self, model, count):
+        """``count`` ids past every id in use, including the model's cold storage table."""
+        managers = [model.all_objects if hasattr(model, 'all_objects') else model.objects]
+        if model in COLD_TABLES:
+            managers.append(COLD_TABLES[model].objects)
+        first = max(manager.aggregate(top=Max('pk'))['top'] or 0 for manager in managers)
+        return range(first + 1, first + 1 + count)
+
+    def _reset_sequences(self, *models):
+        """Move Postgres id sequences past the explicit ids (a no-op on SQLite)."""
+        with connection.cursor() as cursor:
+            for sql in connection.ops.sequence_reset_sql(no_style(), models):
+                cursor.execute(sql)
+
+    def _patients(self, count, staff_ids):
+        ids = self._next_ids(Patient, count)
+        when = connection.ops.adapt_datetimefield_value
+        columns = ['id', 'first_name', 'last_name', 'contact_number', 'contact_key', 'email',
+                   'address', 'created_by', 'created_at', 'is_archived']
+        for start in range(0, count, self.batch_size):
+            rows = []
+            for pk in ids[start:start + self.batch_size]:
+                first, last = self.rng.choice(FIRST_NAMES), self.rng.choice(LAST_NAMES)
+                number = f'09{self.rng.randrange(10 ** 9):09d}'
+                rows.append((
+                    pk, first, last, number, phone_key(number),
+                    f'{first}.{last}{pk}@example.com'.lower().replace(' ', ''),
+                    self.rng.choice(CITIES),
+                    self.rng.choice(staff_ids) if staff_ids else None,
+                    when(self._moment(self.days)), False,
+                ))
+            with transaction.atomic():
+                self._copy(Patient, columns, rows)
+            self.stdout.write(f'Patients: {min(start + self.batch_size, count)}')
+        self._reset_sequences(Patient)
+        return list(ids)
+
+    def _invoices(self, options, patient_ids, staff_ids, services):
+        if not patient_ids or not services:
+            return 0, 0
+        # Cheap services are booked far more often than implants and braces
+        weights = [1 / float(s.price or 1) ** 0.5 for s in services]
+        price_field = InvoiceItem._meta.get_field('price_at_time')
+        lines_for = [
+            (s.pk, s.name, connection.ops.adapt_decimalfield_value(s.price, price_field.max_digits, price_field.decimal_places))
+            for s in services
+        ]
+        when = connection.ops.adapt_datetimefield_value
+        archived_at = when(timezone.now())
+        total = options['invoices']
+        invoice_ids = self._next_ids(Invoice, total)
+        item_ids = count(self._next_ids(InvoiceItem, 1)[0])
+        invoice_columns = ['id', 'patient', 'created_by', 'date_created', 'is_paid', 'is_archived', 'archived_at']
+        item_columns = ['id', 'invoice', 'service', 'service_name_at_time', 'price_at_time', 'quantity']
+        items_done = 0
+        for start in range(0, total, self.batch_size):
+            invoices, items = [], []
+            for pk in invoice_ids[start:start + self.batch_size]:
+                archived = self.rng.random() < options['archived_fraction']
+                invoices.append((
+                    pk, self.rng.choice(patient_ids),
+                    self.rng.choice(staff_ids) if staff_ids else None,
+                    when(self._moment(self.days)),
+                    self.rng.random() < options['paid_fraction'],
+                    archived, archived_at if archived else None,
+                ))
+                lines = self.rng.choices(*ITEMS_PER_INVOICE)[0]
+                for service_id, name, price in self.rng.choices(lines_for, weights, k=lines):
+                    items.append((next(item_ids), pk, service_id, name, price, self.rng.choices(*QUANTITIES)[0]))
+            with transaction.atomic():
+                self._copy(Invoice, invoice_columns, invoices)
+                self._copy(InvoiceItem, item_columns, items)
+            items_done += len(items)
+            self.stdout.write(f'Invoices: {min(start + self.batch_size, total)}/{total} ({items_done} items)')
+        self._reset_sequences(Invoice, InvoiceItem)
+        return total, items_done
@@ -0,0 +1,26 @@
+from datetime import timedelta
+
+from django.core.management.base import BaseCommand
+from clinic.cold_storage import cold_storage_age, eligible_invoices, move_archived_invoices
+
+
+class Command(BaseCommand):
+    help = 'Move invoices archived longer than INVOICE_COLD_STORAGE_DAYS into the cold-storage tables'
+
+    def add_arguments(self, parser):
+        parser.add_argument('--days', type=int, default=None, help='Override INVOICE_COLD_STORAGE_DAYS')
+        parser.add_argument('--batch-size', type=int, default=500, help='Invoices moved per transaction')
+        parser.add_argument('--dry-run', action='store_true', help='Only report how many invoices would move')
+
+    def handle(self, *args, **options):
+        age = timedelta(days=options['days']) if options['days'] is not None else cold_storage_age()
+
+        if options['dry_run']:
+            count = eligible_invoices(age).count()
+            self.stdout.write(self.style.SUCCESS(f'Dry run. Invoices to move: {count}'))
+            return
+
+        moved = 0
+        for moved in move_archived_invoices(age, batch_size=options['batch_size']):
+            self.stdout.write(f'Moved {moved} invoices...')
+        self.stdout.write(self.style.SUCCESS(f'Done. Invoices moved to cold storage: {moved}'))
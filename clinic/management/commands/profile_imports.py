@@ -0,0 +1,80 @@
+import json
+import os
+import subprocess
+import sys
+
+from django.conf import settings
+from django.core.management.base import BaseCommand, CommandError
+
+# What a fresh worker imports before it can answer its first request: the WSGI
+# application (settings, apps, middleware) and the URLconf with all views.
+COLD_START = '''
+import json, sys, time
+started = time.perf_counter()
+import dental_clinic.wsgi
+from django.urls import get_resolver
+get_resolver().url_patterns
+elapsed_ms = (time.perf_counter() - started) * 1000
+print(json.dumps({"elapsed_ms": elapsed_ms, "modules": sorted(sys.modules)}))
+'''
+
+# Loaded by the views that render reports, never at startup
+LAZY_MODULES = ('reportlab', 'openpyxl')
+
+
+def parse_importtime(stderr):
+    """``-X importtime`` lines as (module, self_us, cumulative_us, depth)."""
+    rows = []
+    for line in stderr.splitlines():
+        if not line.startswith('import time:') or 'self [us]' in line:
+            continue
+        self_us, cumulative_us, name = line[len('import time:'):].split('|')
+        depth = (len(name) - len(name.lstrip())) // 2
+        rows.append((name.strip(), int(self_us), int(cumulative_us), depth))
+    return rows
+
+
+class Command(BaseCommand):
+    help = 'Import the app the way a new worker does and report import time per module; fail over budget'
+
+    def add_arguments(self, parser):
+        parser.add_argument(
+            '--budget-ms', type=float, default=getattr(settings, 'IMPORT_TIME_BUDGET_MS', 1000),
+            help='Fail when a cold start takes longer than this (default: IMPORT_TIME_BUDGET_MS)',
+        )
+        parser.add_argument('--top', type=int, default=25, help='Show this many slowest modules')
+        parser.add_argument(
+            '--top-level', action='store_true',
+            help='Only list modules imported directly, not what they import in turn',
+        )
+
+    def handle(self, *args, **options):
+        env = {**os.environ, 'RUN_STARTUP_TASKS': 'False', 'PYTHONDONTWRITEBYTECODE': '1'}
+        result = subprocess.run(
+            [sys.executable, '-X', 'importtime', '-c', COLD_START],
+            cwd=settings.BASE_DIR, env=env, capture_output=True, text=True,
+        )
+        if result.returncode:
+            raise CommandError(f'Cold start failed:\n{result.stderr[-2000:]}')
+        report = json.loads(result.stdout.strip().splitlines()[-1])
+        rows = parse_importtime(result.stderr)
+
+        if options['top_level']:
+            rows = [row for row in rows if row[3] == 0]
+        rows.sort(key=lambda row: row[2], reverse=True)
+        self.stdout.write(f'{"cumulative ms":>14} {"self ms":>9}  module')
+        for name, self_us, cumulative_us, depth in rows[:options['top']]:
+            self.stdout.write(f'{cumulative_us / 1000:14.1f} {self_us / 1000:9.1f}  {"  " * depth}{name}')
+
+        elapsed_ms = report['elapsed_ms']
+        self.stdout.write(f'Cold start: {elapsed_ms:.0f} ms (budget {options["budget_ms"]:.0f} ms)')
+
+        problems = []
+        eager = [name for name in LAZY_MODULES if name in report['modules']]
+        if eager:
+            problems.append(f'imported at startup but should be lazy: {", ".join(eager)}')
+        if elapsed_ms > options['budget_ms']:
+            problems.append(f'cold start {elapsed_ms:.0f} ms is over the {options["budget_ms"]:.0f} ms budget')
+        if problems:
+            raise CommandError('; '.join(problems))
+        self.stdout.write(self.style.SUCCESS('Done. Cold start is within budget.'))
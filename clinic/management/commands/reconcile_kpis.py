@@ -0,0 +1,21 @@
+from django.core.management.base import BaseCommand
+from clinic.kpis import reconcile
+
+
+class Command(BaseCommand):
+    help = 'Recompute the dashboard KPI counters from the source tables and repair any drift'
+
+    def add_arguments(self, parser):
+        parser.add_argument('--dry-run', action='store_true', help='Report drift without writing')
+
+    def handle(self, *args, **options):
+        drift = reconcile(dry_run=options['dry_run'])
+        for key, stored, actual in drift:
+            self.stdout.write(f'{key}: stored={stored} actual={actual}')
+
+        if not drift:
+            self.stdout.write(self.style.SUCCESS('Done. Counters are in step.'))
+        elif options['dry_run']:
+            self.stdout.write(self.style.WARNING(f'Dry run. Counters off: {len(drift)}'))
+        else:
+            self.stdout.write(self.style.SUCCESS(f'Done. Counters repaired: {len(drift)}'))
@@ -0,0 +1,27 @@
+from django.core.management.base import BaseCommand
+from clinic.archival import resumable_jobs, run_job
+from clinic.models import ArchivalJob
+
+
+class Command(BaseCommand):
+    help = 'Resume invoice archival cascades that are pending or were interrupted'
+
+    def add_arguments(self, parser):
+        parser.add_argument('--include-failed', action='store_true', help='Also retry jobs that failed')
+
+    def handle(self, *args, **options):
+        jobs = list(resumable_jobs(include_failed=options['include_failed']))
+        finished = 0
+        for job in jobs:
+            if job.status == ArchivalJob.FAILED:
+                ArchivalJob.objects.filter(pk=job.pk).update(status=ArchivalJob.PENDING, error='')
+            self.stdout.write(f'Running: {job}')
+            try:
+                job = run_job(job.pk)
+            except Exception as exc:
+                self.stdout.write(self.style.ERROR(f'Failed: {exc}'))
+                continue
+            self.stdout.write(f'  archived {job.processed} invoice(s), status {job.status}')
+            finished += 1
+
+        self.stdout.write(self.style.SUCCESS(f'Done. Jobs run: {finished} of {len(jobs)}'))
@@ -0,0 +1,79 @@
+import json
+import platform
+
+from django.core.management.base import BaseCommand, CommandError
+from django.db import connection
+from django.test.utils import setup_databases, setup_test_environment, teardown_databases, teardown_test_environment
+from django.utils import timezone
+from clinic import benchmarks
+
+
+class Command(BaseCommand):
+    help = 'Benchmark the heavy endpoints on throwaway databases and report latency, queries and memory as JSON'
+
+    def add_arguments(self, parser):
+        parser.add_argument('--datasets', nargs='+', choices=list(benchmarks.DATASETS), default=['small', 'medium'])
+        parser.add_argument('--endpoints', nargs='+', choices=list(benchmarks.ENDPOINTS), default=list(benchmarks.ENDPOINTS))
+        parser.add_argument('--repeat', type=int, default=10, help='Timed requests per endpoint')
+        parser.add_argument('--seed', type=int, default=0)
+        parser.add_argument('--output', help='Write the JSON report to this file (e.g. to keep as a baseline)')
+        parser.add_argument('--baseline', help='Compare against a report saved with --output')
+        parser.add_argument('--tolerance', type=float, default=0.2, help='Allowed p95 growth, 0.2 = 20%%')
+        parser.add_argument('--checkout', action='store_true', help='Also time the POS checkout per catalog size')
+        parser.add_argument('--min-ms', type=float, default=10.0, help='Ignore p95 changes smaller than this')
+
+    def handle(self, *args, **options):
+        baseline = None
+        if options['baseline']:
+            try:
+                with open(options['baseline']) as fh:
+                    baseline = json.load(fh)['results']
+            except (OSError, ValueError, KeyError) as exc:
+                raise CommandError(f'Cannot read baseline {options["baseline"]}: {exc}')
+
+        report = {
+            'meta': {
+                'created_at': timezone.now().isoformat(),
+                'database': connection.vendor,
+                'python': platform.python_version(),
+                'repeat': options['repeat'],
+            },
+            'results': {},
+        }
+        setup_test_environment()
+        try:
+            for dataset in options['datasets']:
+                self.stderr.write(f'Seeding and benchmarking {dataset}...')
+                old_config = setup_databases(verbosity=0, interactive=False)
+                try:
+                    report['results'][dataset] = benchmarks.run_dataset(
+                        dataset, options['endpoints'], options['repeat'], options['seed'],
+                    )
+                finally:
+                    teardown_databases(old_config, verbosity=0)
+            if options['checkout']:
+                self.stderr.write('Benchmarking POS checkout...')
+                old_config = setup_databases(verbosity=0, interactive=False)
+                try:
+                    report['checkout'] = benchmarks.run_checkout(options['repeat'])
+                finally:
+                    teardown_databases(old_config, verbosity=0)
+        finally:
+            teardown_test_environment()
+
+        output = json.dumps(report, indent=2)
+        if options['output']:
+            with open(options['output'], 'w') as fh:
+                fh.write(output + '\n')
+        self.stdout.write(output)
+
+        if baseline is None:
+            return
+        regressions = benchmarks.compare(
+            report['results'], baseline, tolerance=options['tolerance'], min_ms=options['min_ms'],
+        )
+        if regressions:
+            for line in regressions:
+                self.stderr.write(self.style.ERROR(line))
+            raise CommandError(f'{len(regressions)} regression(s) against {options["baseline"]}.')
+        self.stderr.write(self.style.SUCCESS('Done. No regressions against the baseline.'))
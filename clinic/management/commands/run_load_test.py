@@ -0,0 +1,69 @@
+import json
+import platform
+
+from django.core.management.base import BaseCommand, CommandError
+from django.db import connection
+from django.test.utils import setup_databases, setup_test_environment, teardown_databases, teardown_test_environment
+from django.utils import timezone
+from clinic import benchmarks
+
+
+class Command(BaseCommand):
+    help = 'Compare the throughput of one sync worker and one ASGI worker on a throwaway database, as JSON'
+
+    def add_arguments(self, parser):
+        parser.add_argument('--dataset', choices=list(benchmarks.DATASETS), default='small')
+        parser.add_argument(
+            '--endpoints', nargs='+', choices=list(benchmarks.LOAD_ENDPOINTS), default=list(benchmarks.LOAD_ENDPOINTS),
+        )
+        parser.add_argument('--requests', type=int, default=50, help='Requests per endpoint and worker')
+        parser.add_argument('--concurrency', type=int, default=10, help='Clients hitting the ASGI worker at once')
+        parser.add_argument('--db-latency-ms', type=float, default=5.0, help='Simulated round trip per SQL query')
+        parser.add_argument('--seed', type=int, default=0)
+        parser.add_argument('--output', help='Also write the JSON report to this file')
+        parser.add_argument(
+            '--min-speedup', type=float, default=0.0,
+            help='Fail when the ASGI worker is not this many times faster on every endpoint',
+        )
+
+    def handle(self, *args, **options):
+        report = {
+            'meta': {
+                'created_at': timezone.now().isoformat(),
+                'database': connection.vendor,
+                'python': platform.python_version(),
+                'dataset': options['dataset'],
+                'requests': options['requests'],
+                'concurrency': options['concurrency'],
+                'db_latency_ms': options['db_latency_ms'],
+            },
+        }
+        setup_test_environment()
+        try:
+            self.stderr.write(f'Seeding {options["dataset"]} and load testing...')
+            old_config = setup_databases(verbosity=0, interactive=False)
+            try:
+                report['results'] = benchmarks.run_load_test(
+                    options['dataset'], options['endpoints'], options['requests'],
+                    options['concurrency'], options['db_latency_ms'], options['seed'],
+                )
+            finally:
+                teardown_databases(old_config, verbosity=0)
+        finally:
+            teardown_test_environment()
+
+        output = json.dumps(report, indent=2)
+        if options['output']:
+            with open(options['output'], 'w') as fh:
+                fh.write(output + '\n')
+        self.stdout.write(output)
+
+        failed = []
+        for endpoint, result in report['results'].items():
+            if result['sync']['status'] != [200] or result['asgi']['status'] != [200]:
+                failed.append(f'{endpoint}: status sync {result["sync"]["status"]}, asgi {result["asgi"]["status"]}')
+            elif result['speedup'] < options['min_speedup']:
+                failed.append(f'{endpoint}: ASGI speedup {result["speedup"]}x < {options["min_speedup"]}x')
+        if failed:
+            raise CommandError('Load test failed:\n' + '\n'.join(failed))
+        self.stdout.write(self.style.SUCCESS('Done. Load test finished.'))
@@ -11,8 +11,9 @@ class Command(BaseCommand):
         updated = 0
         for key, price in Service.DEFAULT_PRICES.items():
             name = cat_map.get(key, key.replace('_', ' ').title())
-            # Use get_or_create by category and name to avoid duplicates
-            obj, was_created = Service.objects.get_or_create(
+            # Use get_or_create by category to avoid duplicates; archived services
+            # count, so a default an admin archived stays archived and is not recreated
+            obj, was_created = Service.all_objects.get_or_create(
                 category=key,
                 defaults={
                     'name': name,
@@ -23,6 +24,8 @@ class Command(BaseCommand):
             if was_created:
                 created += 1
                 self.stdout.write(self.style.SUCCESS(f'Created service: {obj.name} ({key}) - ₱{price:.2f}'))
+            elif obj.is_archived:
+                self.stdout.write(f'Left archived: {obj.name} ({key})')
             else:
                 # If exists but price differs, update price
                 if float(obj.price) != float(price):
@@ -0,0 +1,72 @@
+import multiprocessing
+import time
+import uuid
+from decimal import Decimal
+
+from django.contrib.auth.models import User
+from django.core.management.base import BaseCommand, CommandError
+from django.db import connection, connections
+from clinic.models import Invoice, InvoiceItem, Patient, Service
+from clinic.sqlite import retry_on_lock
+
+
+@retry_on_lock
+def _checkout(user_id, patient_id, service):
+    invoice = Invoice.objects.create(patient_id=patient_id, created_by_id=user_id)
+    InvoiceItem.objects.create(invoice=invoice, service=service, quantity=1)
+
+
+def _worker(args):
+    user_id, patient_id, service_id, count = args
+    # Forked workers must not share the parent's SQLite handle
+    connections.close_all()
+    service = Service.all_objects.get(pk=service_id)
+    errors = []
+    for _ in range(count):
+        try:
+            _checkout(user_id, patient_id, service)
+        except Exception as exc:
+            errors.append(f'{type(exc).__name__}: {exc}')
+    connections.close_all()
+    return errors
+
+
+class Command(BaseCommand):
+    help = 'Insert invoices from several processes at once to check the SQLite lock handling'
+
+    def add_arguments(self, parser):
+        parser.add_argument('--workers', type=int, default=4)
+        parser.add_argument('--invoices', type=int, default=50, help='Invoices per worker')
+        parser.add_argument('--keep', action='store_true', help='Keep the test rows instead of deleting them')
+
+    def handle(self, *args, **options):
+        if connection.vendor != 'sqlite' or connection.is_in_memory_db():
+            raise CommandError('This check needs a file-backed SQLite database.')
+
+        tag = uuid.uuid4().hex[:8]
+        user = User.objects.create_user(f'stress-{tag}', is_active=False)
+        patient = Patient.objects.create(first_name='Stress', last_name=tag, created_by=user)
+        service = Service.objects.create(name=f'Stress {tag}', price=Decimal('100.00'))
+        connections.close_all()
+
+        jobs = [(user.pk, patient.pk, service.pk, options['invoices'])] * options['workers']
+        started = time.perf_counter()
+        with multiprocessing.get_context('fork').Pool(options['workers']) as pool:
+            errors = [error for result in pool.map(_worker, jobs) for error in result]
+        elapsed = time.perf_counter() - started
+
+        created = Invoice.objects.filter(created_by=user).count()
+        self.stdout.write(f'invoices: {created} in {elapsed:.2f}s ({created / elapsed:.0f}/s)')
+        self.stdout.write(f'errors: {len(errors)}')
+        for error in sorted(set(errors)):
+            self.stdout.write(f'  {error}')
+
+        if not options['keep']:
+            Invoice.all_objects.filter(created_by=user).delete()
+            patient.delete()
+            service.delete()
+            user.delete()
+
+        if errors:
+            raise CommandError(f'{len(errors)} of {len(jobs) * options["invoices"]} writes failed.')
+        self.stdout.write(self.style.SUCCESS('Done. Every concurrent write went through.'))
@@ -0,0 +1,308 @@
+"""Process metrics in the Prometheus text format, served at ``/metrics``.
+
+``MetricsMiddleware`` records every request. Histograms use the default
+Prometheus buckets:
+
+* ``clinic_http_request_duration_seconds`` by URL name, method and status;
+* ``clinic_db_query_duration_seconds``, one observation per SQL query,
+  by database alias;
+* ``clinic_render_duration_seconds`` for the PDF, XLSX and CSV views
+  (see ``observe_render``), by format.
+
+``clinic_cache_requests_total`` counts cache hits and misses by cache.
+``clinic_archival_jobs`` (pending and running background archival jobs)
+is read from the database at scrape time.
+
+Each gunicorn worker keeps its own numbers. With ``METRICS_DIR`` set,
+every worker writes a snapshot to ``METRICS_DIR/metrics-<pid>.json`` at
+most every ``METRICS_FLUSH_SECONDS`` (default 1) and on exit. A scrape
+adds up all the snapshots, so any worker can answer for all of them.
+Snapshots of dead workers are kept so counters never go backwards. Clear
+the directory when the app is deployed. Without ``METRICS_DIR`` a scrape
+shows only the worker that served it.
+
+``/metrics`` is open to staff users and to requests that send
+``Authorization: Bearer <METRICS_TOKEN>``.
+"""
+import atexit
+import copy
+import functools
+import json
+import os
+import threading
+import time
+from bisect import bisect_left
+from contextlib import ExitStack, contextmanager
+from pathlib import Path
+
+from asgiref.sync import iscoroutinefunction
+from django.conf import settings
+from django.db import connections
+from django.http import HttpResponse, HttpResponseForbidden
+from django.utils.crypto import constant_time_compare
+
+BUCKETS = (0.005, 0.01, 0.025, 0.05, 0.075, 0.1, 0.25, 0.5, 0.75, 1.0, 2.5, 5.0, 7.5, 10.0)
+CONTENT_TYPE = 'text/plain; version=0.0.4; charset=utf-8'
+
+REGISTRY = {}
+_lock = threading.Lock()
+_last_flush = 0.0
+
+
+def enabled():
+    return getattr(settings, 'METRICS_ENABLED', True)
+
+
+def metrics_dir():
+    directory = getattr(settings, 'METRICS_DIR', None)
+    return Path(directory) if directory else None
+
+
+def flush_seconds():
+    return getattr(settings, 'METRICS_FLUSH_SECONDS', 1.0)
+
+
+class Counter:
+    kind = 'counter'
+
+    def __init__(self, name, documentation, labelnames=()):
+        self.name = name
+        self.documentation = documentation
+        self.labelnames = tuple(labelnames)
+        self.values = {}
+        REGISTRY[name] = self
+
+    def _key(self, labels):
+        return tuple(str(labels[name]) for name in self.labelnames)
+
+    def inc(self, amount=1, **labels):
+        key = self._key(labels)
+        with _lock:
+            self.values[key] = self.values.get(key, 0) + amount
+
+    @staticmethod
+    def merge(a, b):
+        return a + b
+
+    def lines(self, values):
+        for key, value in sorted(values.items()):
+            yield f'{self.name}_total{_labels(self.labelnames, key)} {_number(value)}'
+
+
+class Histogram(Counter):
+    kind = 'histogram'
+
+    def observe(self, seconds, **labels):
+        key = self._key(labels)
+        with _lock:
+            # [count per bucket (non-cumulative, last is +Inf), sum, count]
+            state = self.values.setdefault(key, [[0] * (len(BUCKETS) + 1), 0.0, 0])
+            state[0][bisect_left(BUCKETS, seconds)] += 1
+            state[1] += seconds
+            state[2] += 1
+
+    @contextmanager
+    def time(self, **labels):
+        started = time.perf_counter()
+        try:
+            yield
+        finally:
+            self.observe(time.perf_counter() - started, **labels)
+
+    @staticmethod
+    def merge(a, b):
+        return [[x + y for x, y in zip(a[0], b[0])], a[1] + b[1], a[2] + b[2]]
+
+    def lines(self, values):
+        for key, (buckets, total, count) in sorted(values.items()):
+            cumulative = 0
+            for bound, hits in zip(BUCKETS + (float('inf'),), buckets):
+                cumulative += hits
+                le = '+Inf' if bound == float('inf') else repr(bound)
+                yield f'{self.name}_bucket{_labels(self.labelnames + ("le",), key + (le,))} {cumulative}'
+            yield f'{self.name}_sum{_labels(self.labelnames, key)} {_number(total)}'
+            yield f'{self.name}_count{_labels(self.labelnames, key)} {count}'
+
+
+REQUEST_SECONDS = Histogram(
+    'clinic_http_request_duration_seconds', 'Request latency by URL name', ('view', 'method', 'status'),
+)
+DB_QUERY_SECONDS = Histogram(
+    'clinic_db_query_duration_seconds', 'SQL query latency', ('database',),
+)
+RENDER_SECONDS = Histogram(
+    'clinic_render_duration_seconds', 'Time to build a PDF, XLSX or CSV response', ('format',),
+)
+CACHE_REQUESTS = Counter(
+    'clinic_cache_requests', 'Cache lookups by cache and result (hit or miss)', ('cache', 'result'),
+)
+
+
+def _escape(value):
+    return value.replace('\\', '\\\\').replace('\n', '\\n').replace('"', '\\"')
+
+
+def _labels(names, values):
+    if not names:
+        return ''
+    return '{' + ','.join(f'{n}="{_escape(v)}"' for n, v in zip(names, values)) + '}'
+
+
+def _number(value):
+    return repr(float(value)) if isinstance(value, float) else str(value)
+
+
+def cache_lookup(cache_name, hit):
+    CACHE_REQUESTS.inc(cache=cache_name, result='hit' if hit else 'miss')
+
+
+def observe_render(file_format):
+    """Record how long the decorated view takes to build its ``file_format`` response."""
+    def decorator(view_func):
+        if iscoroutinefunction(view_func):
+            @functools.wraps(view_func)
+            async def _wrapped(*args, **kwargs):
+                with RENDER_SECONDS.time(format=file_format):
+                    return await view_func(*args, **kwargs)
+        else:
+            @functools.wraps(view_func)
+            def _wrapped(*args, **kwargs):
+                with RENDER_SECONDS.time(format=file_format):
+                    return view_func(*args, **kwargs)
+        return _wrapped
+    return decorator
+
+
+# --- multiprocess snapshots -------------------------------------------------
+
+def snapshot():
+    """This process's values as JSON-friendly data."""
+    with _lock:
+        return {
+            name: [[list(key), copy.deepcopy(value)] for key, value in metric.values.items()]
+            for name, metric in REGISTRY.items()
+        }
+
+
+def flush(force=False):
+    """Write this process's snapshot to ``METRICS_DIR``, at most every ``METRICS_FLUSH_SECONDS``."""
+    global _last_flush
+    directory = metrics_dir()
+    if directory is None:
+        return
+    now = time.monotonic()
+    if not force and now - _last_flush < flush_seconds():
+        return
+    _last_flush = now
+    directory.mkdir(parents=True, exist_ok=True)
+    path = directory / f'metrics-{os.getpid()}.json'
+    temporary = path.with_suffix('.tmp')
+    temporary.write_text(json.dumps(snapshot()))
+    os.replace(temporary, path)
+
+
+atexit.register(lambda: flush(force=True) if enabled() else None)
+
+
+def collect():
+    """Values of every metric, added up across all workers' snapshots."""
+    directory = metrics_dir()
+    if directory is None:
+        snapshots = [snapshot()]
+    else:
+        flush(force=True)
+        snapshots = []
+        for path in directory.glob('metrics-*.json'):
+            try:
+                snapshots.append(json.loads(path.read_text()))
+            except (OSError, ValueError):
+                continue  # being replaced right now, or a worker died mid-write
+    merged = {name: {} for name in REGISTRY}
+    for data in snapshots:
+        for name, samples in data.items():
+            metric = REGISTRY.get(name)
+            if metric is None:
+                continue
+            values = merged[name]
+            for key, value in samples:
+                key = tuple(key)
+                values[key] = metric.merge(values[key], value) if key in values else value
+    return merged
+
+
+def _archival_job_lines():
+    from django.db.models import Count
+    from .models import ArchivalJob
+
+    counts = dict.fromkeys((ArchivalJob.PENDING, ArchivalJob.RUNNING), 0)
+    rows = ArchivalJob.objects.filter(status__in=counts).order_by().values('status').annotate(n=Count('id'))
+    counts.update((row['status'], row['n']) for row in rows)
+    yield '# HELP clinic_archival_jobs Background archival jobs waiting or running'
+    yield '# TYPE clinic_archival_jobs gauge'
+    for status, count in counts.items():
+        yield f'clinic_archival_jobs{{status="{status}"}} {count}'
+
+
+def render():
+    lines = []
+    for name, values in collect().items():
+        metric = REGISTRY[name]
+        lines.append(f'# HELP {name} {metric.documentation}')
+        lines.append(f'# TYPE {name} {metric.kind}')
+        lines.extend(metric.lines(values))
+    lines.extend(_archival_job_lines())
+    return '\n'.join(lines) + '\n'
+
+
+# --- request hooks ----------------------------------------------------------
+
+def _time_queries(alias):
+    def wrapper(execute, sql, params, many, context):
+        started = time.perf_counter()
+        try:
+            return execute(sql, params, many, context)
+        finally:
+            DB_QUERY_SECONDS.observe(time.perf_counter() - started, database=alias)
+
+    return wrapper
+
+
+class MetricsMiddleware:
+    """Record request latency and SQL time for every request."""
+
+    def __init__(self, get_response):
+        self.get_response = get_response
+
+    def __call__(self, request):
+        if not enabled():
+            return self.get_response(request)
+        started = time.perf_counter()
+        status = 500
+        try:
+            with ExitStack() as stack:
+                for alias in connections:
+                    stack.enter_context(connections[alias].execute_wrapper(_time_queries(alias)))
+                response = self.get_response(request)
+            status = response.status_code
+            return response
+        finally:
+            match = getattr(request, 'resolver_match', None)
+            REQUEST_SECONDS.observe(
+                time.perf_counter() - started,
+                view=match.view_name if match else 'unmatched',
+                method=request.method,
+                status=status,
+            )
+            flush()
+
+
+def metrics_view(request):
+    token = getattr(settings, 'METRICS_TOKEN', '')
+    header = request.META.get('HTTP_AUTHORIZATION', '')
+    authorized = (
+        (token and constant_time_compare(header, f'Bearer {token}'))
+        or (request.user.is_authenticated and request.user.is_staff)
+    )
+    if not authorized:
+        return HttpResponseForbidden('Metrics are for staff or METRICS_TOKEN holders.')
+    return HttpResponse(render(), content_type=CONTENT_TYPE)
@@ -0,0 +1,20 @@
+# Generated by Django 5.2.8 on 2026-10-18 22:51
+
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ("clinic", "0009_alter_invoice_patient_and_more"),
+    ]
+
+    operations = [
+        migrations.AddField(
+            model_name="patient",
+            name="contact_key",
+            field=models.CharField(
+                blank=True, db_index=True, default="", editable=False, max_length=15
+            ),
+        ),
+    ]
@@ -0,0 +1,18 @@
+# Generated by Django 5.2.8 on 2026-10-18 22:57
+
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ("clinic", "0011_duplicatesuggestion"),
+    ]
+
+    operations = [
+        migrations.AlterField(
+            model_name="invoice",
+            name="date_created",
+            field=models.DateTimeField(auto_now_add=True, db_index=True),
+        ),
+    ]
@@ -0,0 +1,35 @@
+# Generated by Django 5.2.8 on 2026-10-18 23:01
+
+from decimal import Decimal
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ("clinic", "0012_invoice_date_created_index"),
+    ]
+
+    operations = [
+        migrations.CreateModel(
+            name="KpiCounter",
+            fields=[
+                (
+                    "id",
+                    models.BigAutoField(
+                        auto_created=True,
+                        primary_key=True,
+                        serialize=False,
+                        verbose_name="ID",
+                    ),
+                ),
+                ("key", models.CharField(max_length=40, unique=True)),
+                (
+                    "value",
+                    models.DecimalField(
+                        decimal_places=2, default=Decimal("0"), max_digits=16
+                    ),
+                ),
+            ],
+        ),
+    ]
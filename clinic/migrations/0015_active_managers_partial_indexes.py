@@ -0,0 +1,63 @@
+# Generated by Django 5.2.8 on 2026-10-18 23:06
+
+from django.conf import settings
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ("clinic", "0014_invoice_cold_storage"),
+        migrations.swappable_dependency(settings.AUTH_USER_MODEL),
+    ]
+
+    operations = [
+        migrations.AddIndex(
+            model_name="invoice",
+            index=models.Index(
+                condition=models.Q(("is_archived", False)),
+                fields=["-date_created"],
+                name="invoice_active_date_idx",
+            ),
+        ),
+        migrations.AddIndex(
+            model_name="invoice",
+            index=models.Index(
+                condition=models.Q(("is_archived", False)),
+                fields=["created_by", "-date_created"],
+                name="invoice_active_creator_idx",
+            ),
+        ),
+        migrations.AddIndex(
+            model_name="patient",
+            index=models.Index(
+                condition=models.Q(("is_archived", False)),
+                fields=["last_name", "first_name"],
+                name="patient_active_name_idx",
+            ),
+        ),
+        migrations.AddIndex(
+            model_name="patient",
+            index=models.Index(
+                condition=models.Q(("is_archived", False)),
+                fields=["created_by", "-created_at"],
+                name="patient_active_creator_idx",
+            ),
+        ),
+        migrations.AddIndex(
+            model_name="service",
+            index=models.Index(
+                condition=models.Q(("is_archived", False)),
+                fields=["category", "name"],
+                name="service_active_catalog_idx",
+            ),
+        ),
+        migrations.AddIndex(
+            model_name="staffprofile",
+            index=models.Index(
+                condition=models.Q(("is_archived", False)),
+                fields=["-created_at"],
+                name="staffprofile_active_idx",
+            ),
+        ),
+    ]
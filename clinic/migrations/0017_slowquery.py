@@ -0,0 +1,55 @@
+# Generated by Django 5.2.8 on 2026-10-18 23:44
+
+import django.utils.timezone
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ("clinic", "0016_archivaljob"),
+    ]
+
+    operations = [
+        migrations.CreateModel(
+            name="SlowQuery",
+            fields=[
+                (
+                    "id",
+                    models.BigAutoField(
+                        auto_created=True,
+                        primary_key=True,
+                        serialize=False,
+                        verbose_name="ID",
+                    ),
+                ),
+                ("fingerprint", models.CharField(max_length=40, unique=True)),
+                ("normalized_sql", models.TextField()),
+                (
+                    "sql",
+                    models.TextField(help_text="First occurrence, with placeholders"),
+                ),
+                ("params_shape", models.CharField(blank=True, max_length=200)),
+                ("database", models.CharField(default="default", max_length=40)),
+                ("view", models.CharField(blank=True, max_length=200)),
+                (
+                    "location",
+                    models.CharField(
+                        blank=True,
+                        help_text="Innermost project frame that ran it",
+                        max_length=300,
+                    ),
+                ),
+                ("explain", models.TextField(blank=True)),
+                ("occurrences", models.PositiveIntegerField(default=0)),
+                ("total_ms", models.FloatField(default=0)),
+                ("max_ms", models.FloatField(default=0)),
+                ("first_seen", models.DateTimeField(default=django.utils.timezone.now)),
+                ("last_seen", models.DateTimeField(default=django.utils.timezone.now)),
+            ],
+            options={
+                "verbose_name_plural": "slow queries",
+                "ordering": ["-total_ms"],
+            },
+        ),
+    ]
@@ -0,0 +1,30 @@
+# Generated by Django 5.2.8 on 2026-10-19 00:26
+
+from django.conf import settings
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ("clinic", "0017_slowquery"),
+        migrations.swappable_dependency(settings.AUTH_USER_MODEL),
+    ]
+
+    operations = [
+        migrations.AlterField(
+            model_name="patient",
+            name="contact_key",
+            field=models.CharField(
+                blank=True, default="", editable=False, max_length=15
+            ),
+        ),
+        migrations.AddIndex(
+            model_name="patient",
+            index=models.Index(
+                fields=["contact_key"],
+                name="patient_contact_key_idx",
+                opclasses=["varchar_pattern_ops"],
+            ),
+        ),
+    ]
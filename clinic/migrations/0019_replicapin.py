@@ -0,0 +1,32 @@
+# Generated by Django 5.2.8 on 2026-10-19 00:32
+
+import django.db.models.deletion
+from django.conf import settings
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ("auth", "0012_alter_user_first_name_max_length"),
+        ("clinic", "0018_patient_contact_key_pattern_index"),
+    ]
+
+    operations = [
+        migrations.CreateModel(
+            name="ReplicaPin",
+            fields=[
+                (
+                    "user",
+                    models.OneToOneField(
+                        on_delete=django.db.models.deletion.CASCADE,
+                        primary_key=True,
+                        related_name="+",
+                        serialize=False,
+                        to=settings.AUTH_USER_MODEL,
+                    ),
+                ),
+                ("pinned_until", models.DateTimeField()),
+            ],
+        ),
+    ]
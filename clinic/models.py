@@ -1,8 +1,112 @@
 # clinic/models.py
-from django.db import models
+from django.db import models, router, transaction
+from django.db.models import (
+    BigIntegerField, Count, DecimalField, ExpressionWrapper, F, OuterRef, Subquery, Sum, Value,
+)
+from django.db.models.functions import Cast, Coalesce, Round
 from django.contrib.auth.models import User
 from django.utils import timezone
 from decimal import Decimal
+from .phone import key_upper_bound, phone_key, suffix_key
+
+# SQL equivalent of InvoiceItem.total_price(), for aggregates over items
+LINE_TOTAL = ExpressionWrapper(
+    F('price_at_time') * F('quantity'),
+    output_field=DecimalField(max_digits=14, decimal_places=2),
+)
+
+# The same line total in integer centavos (see clinic.money). Rounded before
+# the cast because SQLite multiplies prices as floats (19.99 * 100 = 1998.99...).
+# bigint: a line over 21,474,836.47 pesos overflows PostgreSQL's integer.
+LINE_TOTAL_CENTAVOS = ExpressionWrapper(
+    Cast(Round(F('price_at_time') * 100), BigIntegerField()) * F('quantity'),
+    output_field=BigIntegerField(),
+)
+
+
+def _money_subquery(queryset):
+    """Coalesced scalar subquery for a queryset that yields a single Decimal column."""
+    return Coalesce(
+        Subquery(queryset, output_field=DecimalField(max_digits=14, decimal_places=2)),
+        Value(Decimal('0')),
+        output_field=DecimalField(max_digits=14, decimal_places=2),
+    )
+
+
+def _count_subquery(queryset):
+    return Coalesce(Subquery(queryset), Value(0))
+
+
+class ActiveManager(models.Manager):
+    """Default manager for soft-deletable models: hides archived rows.
+
+    Each model also has an ``all_objects`` manager for the archive pages,
+    restores and maintenance jobs that need archived rows too.
+
+    ``dumpdata`` reads the default manager, so backups must pass ``--all``
+    (``manage.py dumpdata --all clinic``) or they leave archived rows out.
+    """
+    def get_queryset(self):
+        return super().get_queryset().filter(is_archived=False)
+
+    def including(self, pks):
+        """The active rows plus ``pks`` (ids or an id queryset), archived or not.
+
+        For foreign key choices: forms validate against their queryset, so
+        an invoice whose patient or service was archived since needs that
+        row among the choices to be saved again.
+        """
+        return self.model.all_objects.filter(models.Q(is_archived=False) | models.Q(pk__in=pks))
+
+
+def active_index(*fields, name):
+    """Partial index over active rows, which is all the default managers query."""
+    return models.Index(fields=list(fields), condition=models.Q(is_archived=False), name=name)
+
+
+class KpiTrackedModel(models.Model):
+    """Base for models whose writes feed the dashboard counters in ``clinic.kpis``.
+
+    ``kpi_fields`` are remembered as loaded from the database so the
+    post_save handler can apply the difference, and saves are atomic so a
+    row and its counter changes commit together.
+    """
+    kpi_fields = ()
+
+    class Meta:
+        abstract = True
+
+    @classmethod
+    def from_db(cls, db, field_names, values):
+        instance = super().from_db(db, field_names, values)
+        instance._kpi_loaded = {
+            name: value for name, value in zip(field_names, values) if name in cls.kpi_fields
+        }
+        return instance
+
+    def refresh_from_db(self, using=None, fields=None, **kwargs):
+        super().refresh_from_db(using=using, fields=fields, **kwargs)
+        loaded = getattr(self, '_kpi_loaded', {})
+        for name in self.kpi_fields:
+            if fields is None or name in fields:
+                loaded[name] = getattr(self, name)
+        self._kpi_loaded = loaded
+
+    def save(self, *args, **kwargs):
+        using = kwargs.get('using') or router.db_for_write(type(self), instance=self)
+        with transaction.atomic(using=using):
+            super().save(*args, **kwargs)
+
+class StaffProfileQuerySet(models.QuerySet):
+    def with_activity_counts(self):
+        """Annotate ``patients_added`` and ``invoices_created`` (invoices of those patients)."""
+        patients = Patient.objects.filter(created_by=OuterRef('user')).order_by().values('created_by')
+        invoices = Invoice.objects.filter(patient__created_by=OuterRef('user')).order_by().values('patient__created_by')
+        return self.annotate(
+            patients_added=_count_subquery(patients.annotate(n=Count('id')).values('n')),
+            invoices_created=_count_subquery(invoices.annotate(n=Count('id')).values('n')),
+        )
+
 
 class StaffProfile(models.Model):
     """Extended profile for staff users with position/role information"""
@@ -23,26 +127,89 @@ class StaffProfile(models.Model):
     approved = models.BooleanField(default=False)
     is_archived = models.BooleanField(default=False)
 
+    objects = ActiveManager.from_queryset(StaffProfileQuerySet)()
+    all_objects = StaffProfileQuerySet.as_manager()
+
+    class Meta:
+        indexes = [active_index('-created_at', name='staffprofile_active_idx')]
+
     def __str__(self):
         return f"{self.user.username} - {self.get_position_display()}"
 
 
-class Patient(models.Model):
+class PatientQuerySet(models.QuerySet):
+    def by_phone(self, number, suffix=False):
+        """Match patients by phone number through the ``contact_key`` index.
+
+        With ``suffix=True`` any number ending in ``number`` matches. Because the
+        key is stored reversed this is a prefix match on the same index.
+        """
+        if suffix:
+            key = suffix_key(number)
+            if not key:
+                return self.none()
+            matches = self.filter(contact_key__startswith=key)
+            # SQLite can't use an index for LIKE; the digit range lets it (and
+            # is collation-safe, unlike comparing against punctuation)
+            upper = key_upper_bound(key)
+            matches = matches.filter(contact_key__gte=key)
+            return matches.filter(contact_key__lt=upper) if upper else matches
+        key = phone_key(number)
+        if not key:
+            return self.none()
+        return self.filter(contact_key=key)
+
+    def with_invoice_stats(self):
+        """Annotate ``invoices_count`` and ``total_spent`` without joining invoice rows."""
+        invoices = Invoice.objects.filter(patient=OuterRef('pk')).order_by().values('patient')
+        items = (
+            InvoiceItem.objects.filter(invoice__patient=OuterRef('pk'), invoice__is_archived=False)
+            .order_by().values('invoice__patient')
+        )
+        return self.annotate(
+            invoices_count=_count_subquery(invoices.annotate(n=Count('id')).values('n')),
+            total_spent=_money_subquery(items.annotate(total=Sum(LINE_TOTAL)).values('total')),
+        )
+
+
+class Patient(KpiTrackedModel):
     # Allow blank/null to let staff POS create minimal patient records
     first_name = models.CharField(max_length=100, blank=True, null=True)
     last_name = models.CharField(max_length=100, blank=True, null=True)
     contact_number = models.CharField(max_length=15, blank=True, null=True)
+    # Normalized, reversed digits of contact_number (see clinic.phone); kept in sync on save
+    contact_key = models.CharField(max_length=15, blank=True, default='', editable=False)
     email = models.EmailField(blank=True, null=True)
     address = models.TextField(blank=True, null=True)
     created_by = models.ForeignKey(User, null=True, blank=True, on_delete=models.SET_NULL, related_name='created_patients')
     created_at = models.DateTimeField(default=timezone.now)
     is_archived = models.BooleanField(default=False)
 
+    objects = ActiveManager.from_queryset(PatientQuerySet)()
+    all_objects = PatientQuerySet.as_manager()
+    kpi_fields = ('is_archived',)
+
+    class Meta:
+        indexes = [
+            active_index('last_name', 'first_name', name='patient_active_name_idx'),
+            active_index('created_by', '-created_at', name='patient_active_creator_idx'),
+            # Pattern ops so PostgreSQL can serve LIKE 'key%' (suffix lookups)
+            # under any collation; other databases ignore opclasses
+            models.Index(fields=['contact_key'], name='patient_contact_key_idx', opclasses=['varchar_pattern_ops']),
+        ]
+
+    def save(self, *args, **kwargs):
+        self.contact_key = phone_key(self.contact_number)
+        update_fields = kwargs.get('update_fields')
+        if update_fields is not None and 'contact_number' in update_fields:
+            kwargs['update_fields'] = set(update_fields) | {'contact_key'}
+        super().save(*args, **kwargs)
+
     def __str__(self):
         return f"{self.first_name} {self.last_name}"
 
 
-class Service(models.Model):
+class Service(KpiTrackedModel):
     DENTAL_CATEGORIES = [
         ("CHECKUP", "Dental Check-up / Consultation"),
         ("CLEANING", "Oral Prophylaxis / Cleaning"),
@@ -93,6 +260,13 @@ class Service(models.Model):
     active = models.BooleanField(default=True)
     is_archived = models.BooleanField(default=False)
 
+    objects = ActiveManager()
+    all_objects = models.Manager()
+    kpi_fields = ('is_archived',)
+
+    class Meta:
+        indexes = [active_index('category', 'name', name='service_active_catalog_idx')]
+
     def save(self, *args, **kwargs):
         # If price is missing or zero, try to set default based on category
         if self.price is None or Decimal(self.price) == Decimal('0'):
@@ -107,17 +281,61 @@ class Service(models.Model):
         return f"{self.name} — ₱{self.price:,.2f}"
 
 
-class Invoice(models.Model):
+class InvoiceQuerySet(models.QuerySet):
+    def with_totals(self):
+        """Annotate ``amount_total`` and ``items_count`` so listing invoices needs no per-row queries."""
+        items = InvoiceItem.objects.filter(invoice=OuterRef('pk')).order_by().values('invoice')
+        return self.annotate(
+            amount_total=_money_subquery(items.annotate(total=Sum(LINE_TOTAL)).values('total')),
+            items_count=_count_subquery(items.annotate(n=Count('id')).values('n')),
+        )
+
+    def with_centavos(self):
+        """Annotate ``amount_centavos``, the invoice total as an int, for report code."""
+        items = InvoiceItem.objects.filter(invoice=OuterRef('pk')).order_by().values('invoice')
+        return self.annotate(
+            amount_centavos=_count_subquery(items.annotate(total=Sum(LINE_TOTAL_CENTAVOS)).values('total')),
+        )
+
+
+class Invoice(KpiTrackedModel):
     # Make patient optional so staff can create quick invoices without a linked patient
     patient = models.ForeignKey(Patient, on_delete=models.SET_NULL, null=True, blank=True, related_name="invoices")
-    date_created = models.DateTimeField(auto_now_add=True)
+    # Indexed for date-range reports and the admin date hierarchy
+    date_created = models.DateTimeField(auto_now_add=True, db_index=True)
     is_paid = models.BooleanField(default=False)
     # Track which staff user created the invoice (nullable for legacy data)
     created_by = models.ForeignKey(User, null=True, blank=True, on_delete=models.SET_NULL, related_name='created_invoices')
     # Soft-delete flag for archiving invoices instead of hard delete
     is_archived = models.BooleanField(default=False)
+    # When it was archived; old archived invoices move to cold storage (clinic.cold_storage)
+    archived_at = models.DateTimeField(null=True, blank=True)
+
+    objects = ActiveManager.from_queryset(InvoiceQuerySet)()
+    all_objects = InvoiceQuerySet.as_manager()
+    kpi_fields = ('is_archived', 'is_paid', 'date_created')
+
+    class Meta:
+        indexes = [
+            active_index('-date_created', name='invoice_active_date_idx'),
+            active_index('created_by', '-date_created', name='invoice_active_creator_idx'),
+        ]
+
+    def save(self, *args, **kwargs):
+        if self.is_archived and self.archived_at is None:
+            self.archived_at = timezone.now()
+        elif not self.is_archived:
+            self.archived_at = None
+        update_fields = kwargs.get('update_fields')
+        if update_fields is not None and 'is_archived' in update_fields:
+            kwargs['update_fields'] = set(update_fields) | {'archived_at'}
+        super().save(*args, **kwargs)
 
     def total_amount(self):
+        # Invoices loaded through with_totals() already carry the sum
+        annotated = getattr(self, 'amount_total', None)
+        if annotated is not None:
+            return Decimal(annotated).quantize(Decimal('0.01'))
         return sum(item.total_price() for item in self.items.all())
 
     def __str__(self):
@@ -126,7 +344,7 @@ class Invoice(models.Model):
         return f"Invoice #{self.id}"
 
 
-class InvoiceItem(models.Model):
+class InvoiceItem(KpiTrackedModel):
     invoice = models.ForeignKey(Invoice, on_delete=models.CASCADE, related_name="items")
     # allow service to be nullable for flexibility from mobile POS
     service = models.ForeignKey(Service, on_delete=models.SET_NULL, null=True, blank=True)
@@ -134,16 +352,29 @@ class InvoiceItem(models.Model):
     price_at_time = models.DecimalField(max_digits=10, decimal_places=2, blank=True, null=True)
     quantity = models.PositiveIntegerField(default=1, blank=True, null=True)
 
+    kpi_fields = ('invoice_id', 'price_at_time', 'quantity')
+
     def save(self, *args, **kwargs):
         if not self.pk:
-            if self.service:
+            service = None
+            if self.service_id is not None:
+                from .catalog import service_catalog
+
+                # The service passed in if any, else the confirmed catalog (no query
+                # inside service_catalog.confirming()); archived services are only
+                # in the database
+                if InvoiceItem.service.is_cached(self):
+                    service = self.service
+                else:
+                    service = service_catalog.confirmed().get(self.service_id) or self.service
+            if service:
                 # capture snapshot of service details if available
                 try:
-                    self.price_at_time = self.service.price
+                    self.price_at_time = service.price
                 except Exception:
                     self.price_at_time = self.price_at_time or Decimal('0')
                 try:
-                    self.service_name_at_time = self.service.name
+                    self.service_name_at_time = service.name
                 except Exception:
                     self.service_name_at_time = self.service_name_at_time or ''
             else:
@@ -159,3 +390,173 @@ class InvoiceItem(models.Model):
             return price * qty
         except Exception:
             return Decimal('0')
+
+
+class DuplicateSuggestion(models.Model):
+    """Possible duplicate patient pair found by the find_duplicate_patients command"""
+    primary = models.ForeignKey(Patient, on_delete=models.CASCADE, related_name='+')
+    duplicate = models.ForeignKey(Patient, on_delete=models.CASCADE, related_name='+')
+    score = models.FloatField()
+    # Comma-separated matching signals, e.g. "phone,name"
+    reasons = models.CharField(max_length=50, blank=True)
+    created_at = models.DateTimeField(default=timezone.now)
+
+    class Meta:
+        ordering = ['-score', 'primary_id']
+
+    def __str__(self):
+        return f"{self.duplicate} → {self.primary} ({self.score:.2f})"
+
+
+class ArchivedInvoice(models.Model):
+    """Cold-storage copy of an invoice that has been archived for a long time.
+
+    Keeps the original invoice id so ``restore_invoice`` can move it back
+    unchanged. Patient name and total are snapshotted for the archive page.
+    """
+    id = models.BigIntegerField(primary_key=True)
+    patient = models.ForeignKey(Patient, on_delete=models.SET_NULL, null=True, blank=True, related_name='+')
+    patient_name = models.CharField(max_length=201, blank=True)
+    date_created = models.DateTimeField()
+    is_paid = models.BooleanField(default=False)
+    created_by = models.ForeignKey(User, null=True, blank=True, on_delete=models.SET_NULL, related_name='+')
+    archived_at = models.DateTimeField(null=True, blank=True)
+    total = models.DecimalField(max_digits=14, decimal_places=2, default=Decimal('0'))
+    moved_at = models.DateTimeField(default=timezone.now)
+
+    class Meta:
+        ordering = ['-date_created']
+
+    def total_amount(self):
+        return self.total
+
+    def __str__(self):
+        return f"Invoice #{self.id} (cold storage)"
+
+
+class ArchivedInvoiceItem(models.Model):
+    id = models.BigIntegerField(primary_key=True)
+    invoice = models.ForeignKey(ArchivedInvoice, on_delete=models.CASCADE, related_name='items')
+    service = models.ForeignKey(Service, on_delete=models.SET_NULL, null=True, blank=True, related_name='+')
+    service_name_at_time = models.CharField(max_length=150, blank=True, null=True)
+    price_at_time = models.DecimalField(max_digits=10, decimal_places=2, blank=True, null=True)
+    quantity = models.PositiveIntegerField(default=1, blank=True, null=True)
+
+
+class ArchivalJob(models.Model):
+    """Background cascade archiving the invoices of an archived patient or service.
+
+    Runs in batches by invoice id (see ``clinic.archival``); ``last_pk`` is
+    the resume point.
+    """
+    KINDS = [
+        ('patient', 'Patient'),
+        ('service', 'Service'),
+    ]
+    PENDING, RUNNING, DONE, FAILED, CANCELLED = 'pending', 'running', 'done', 'failed', 'cancelled'
+    STATUSES = [
+        (PENDING, 'Pending'),
+        (RUNNING, 'Running'),
+        (DONE, 'Done'),
+        (FAILED, 'Failed'),
+        (CANCELLED, 'Cancelled'),
+    ]
+
+    kind = models.CharField(max_length=20, choices=KINDS)
+    target_id = models.PositiveBigIntegerField()
+    target_label = models.CharField(max_length=200, blank=True)
+    status = models.CharField(max_length=20, choices=STATUSES, default=PENDING, db_index=True)
+    last_pk = models.PositiveBigIntegerField(default=0)
+    processed = models.PositiveIntegerField(default=0)
+    total = models.PositiveIntegerField(null=True, blank=True)
+    error = models.TextField(blank=True)
+    created_by = models.ForeignKey(User, null=True, blank=True, on_delete=models.SET_NULL, related_name='+')
+    created_at = models.DateTimeField(default=timezone.now)
+    updated_at = models.DateTimeField(auto_now=True)
+    finished_at = models.DateTimeField(null=True, blank=True)
+
+    class Meta:
+        ordering = ['-created_at']
+
+    def is_active(self):
+        return self.status in (self.PENDING, self.RUNNING)
+
+    def progress_percent(self):
+        if self.status == self.DONE:
+            return 100
+        if not self.total:
+            return 0
+        return min(100, self.processed * 100 // self.total)
+
+    def __str__(self):
+        return f"Archive invoices of {self.kind} {self.target_label or self.target_id} ({self.status})"
+
+
+class KpiCounter(models.Model):
+    """One precomputed dashboard figure, maintained by ``clinic.kpis``.
+
+    Keys are either a named count ("patients", "paid_invoices", ...) or a
+    daily sales bucket ("sales:2025-01-31").
+    """
+    key = models.CharField(max_length=40, unique=True)
+    value = models.DecimalField(max_digits=16, decimal_places=2, default=Decimal('0'))
+
+    def __str__(self):
+        return f"{self.key} = {self.value}"
+
+
+class CatalogVersion(models.Model):
+    """The version of the service catalog that ``clinic.catalog`` caches; one row.
+
+    In the database so a service edit on one worker is seen by the others
+    whatever cache they use.
+    """
+    version = models.CharField(max_length=32)
+
+    def __str__(self):
+        return self.version
+
+
+class ReplicaPin(models.Model):
+    """Until when a user's report reads stay on the primary (see ``clinic.routers``).
+
+    Kept in the database so every worker sees it; API clients have no
+    ``replica_pin`` cookie to carry it between requests.
+    """
+    user = models.OneToOneField(User, on_delete=models.CASCADE, primary_key=True, related_name='+')
+    pinned_until = models.DateTimeField()
+
+    def __str__(self):
+        return f"{self.user_id} until {self.pinned_until}"
+
+
+class SlowQuery(models.Model):
+    """A statement that ran slower than ``SLOW_QUERY_MS``, one row per fingerprint.
+
+    Recorded by ``clinic.slow_queries``. ``sql`` and ``explain`` come from
+    the first occurrence; the counters and ``view``/``location`` follow the
+    latest one.
+    """
+    fingerprint = models.CharField(max_length=40, unique=True)
+    normalized_sql = models.TextField()
+    sql = models.TextField(help_text='First occurrence, with placeholders')
+    params_shape = models.CharField(max_length=200, blank=True)
+    database = models.CharField(max_length=40, default='default')
+    view = models.CharField(max_length=200, blank=True)
+    location = models.CharField(max_length=300, blank=True, help_text='Innermost project frame that ran it')
+    explain = models.TextField(blank=True)
+    occurrences = models.PositiveIntegerField(default=0)
+    total_ms = models.FloatField(default=0)
+    max_ms = models.FloatField(default=0)
+    first_seen = models.DateTimeField(default=timezone.now)
+    last_seen = models.DateTimeField(default=timezone.now)
+
+    class Meta:
+        ordering = ['-total_ms']
+        verbose_name_plural = 'slow queries'
+
+    def mean_ms(self):
+        return self.total_ms / self.occurrences if self.occurrences else 0
+
+    def __str__(self):
+        return self.normalized_sql[:80]
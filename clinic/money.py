@@ -0,0 +1,127 @@
+"""Money as integer centavos.
+
+Report code adds amounts as plain ints. The database hands back centavos
+(``LINE_TOTAL_CENTAVOS`` in ``clinic.models``), and int addition is
+several times cheaper than ``Decimal`` with none of float's rounding
+drift. ``Money`` wraps a centavo total at the edges: templates, JSON and
+exports read it as a ``Decimal``, a float or a ``₱1,234.50`` string.
+
+``str(Money)`` is the plain amount ("1234.50"), so ``floatformat`` and
+other template filters treat it like the Decimal it replaces.
+"""
+from decimal import Decimal, ROUND_HALF_UP
+from functools import total_ordering
+
+CENTAVOS_PER_PESO = 100
+CURRENCY_SYMBOL = '₱'
+
+
+def to_centavos(value):
+    """Centavos in a peso amount (Decimal, int, float or numeric string); None is zero."""
+    if value is None:
+        return 0
+    if isinstance(value, Money):
+        return value.centavos
+    if isinstance(value, int):
+        return value * CENTAVOS_PER_PESO
+    if not isinstance(value, Decimal):
+        # str() first so 19.99 stays 19.99 rather than its binary neighbour
+        value = Decimal(str(value))
+    return int((value * CENTAVOS_PER_PESO).to_integral_value(rounding=ROUND_HALF_UP))
+
+
+def format_centavos(centavos, symbol=CURRENCY_SYMBOL, grouping=True):
+    """'₱1,234.50' for 123450."""
+    sign = '-' if centavos < 0 else ''
+    pesos, cents = divmod(abs(centavos), CENTAVOS_PER_PESO)
+    whole = f"{pesos:,}" if grouping else str(pesos)
+    return f"{sign}{symbol}{whole}.{cents:02d}"
+
+
+@total_ordering
+class Money:
+    """An amount of pesos held as an integer number of centavos."""
+    __slots__ = ('centavos',)
+
+    def __init__(self, centavos=0):
+        self.centavos = int(centavos or 0)
+
+    @classmethod
+    def from_pesos(cls, value):
+        return cls(to_centavos(value))
+
+    def as_decimal(self):
+        return Decimal(self.centavos).scaleb(-2)
+
+    def as_float(self):
+        return self.centavos / CENTAVOS_PER_PESO
+
+    def formatted(self, symbol=CURRENCY_SYMBOL):
+        return format_centavos(self.centavos, symbol)
+
+    def __add__(self, other):
+        if isinstance(other, Money):
+            return Money(self.centavos + other.centavos)
+        if other == 0:
+            # lets sum() start from its default 0
+            return self
+        return NotImplemented
+
+    __radd__ = __add__
+
+    def __sub__(self, other):
+        if isinstance(other, Money):
+            return Money(self.centavos - other.centavos)
+        return NotImplemented
+
+    def __neg__(self):
+        return Money(-self.centavos)
+
+    def __mul__(self, quantity):
+        if isinstance(quantity, int):
+            return Money(self.centavos * quantity)
+        return NotImplemented
+
+    __rmul__ = __mul__
+
+    def _comparable(self, other):
+        """The Decimal to compare ``other`` with, or None for unsupported types."""
+        if isinstance(other, (int, Decimal)):
+            return other
+        if isinstance(other, float):
+            # str() like to_centavos, so Money(1999) == 19.99
+            return Decimal(str(other))
+        return None
+
+    def __eq__(self, other):
+        if isinstance(other, Money):
+            return self.centavos == other.centavos
+        value = self._comparable(other)
+        if value is None:
+            return NotImplemented
+        return self.as_decimal() == value
+
+    def __lt__(self, other):
+        if isinstance(other, Money):
+            return self.centavos < other.centavos
+        value = self._comparable(other)
+        if value is None:
+            return NotImplemented
+        return self.as_decimal() < value
+
+    def __hash__(self):
+        # equal to the Decimal it compares equal to (floats such as 19.99,
+        # which only equal by their str(), hash differently: don't mix them in sets)
+        return hash(self.as_decimal())
+
+    def __bool__(self):
+        return bool(self.centavos)
+
+    def __float__(self):
+        return self.as_float()
+
+    def __str__(self):
+        return format_centavos(self.centavos, symbol='', grouping=False)
+
+    def __repr__(self):
+        return f"Money('{self}')"
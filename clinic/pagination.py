@@ -0,0 +1,94 @@
+"""Paginators that avoid exact COUNT(*) on large tables.
+
+On PostgreSQL an exact count has to visit every matching row. Past
+``APPROXIMATE_COUNT_THRESHOLD`` rows (default 100,000) the planner's
+estimate is used instead: ``pg_class.reltuples`` for an unfiltered table,
+or the row estimate from ``EXPLAIN`` for a filtered queryset (admin
+filters, date-hierarchy drill-downs). Below the threshold, and on SQLite
+and other backends, counts stay exact.
+"""
+import json
+
+from django.conf import settings
+from django.core.paginator import Paginator
+from django.db import connections
+from django.db.models.query import QuerySet
+from django.utils.functional import cached_property
+from rest_framework.pagination import PageNumberPagination
+from rest_framework.response import Response
+
+
+def approximate_count_threshold():
+    return getattr(settings, 'APPROXIMATE_COUNT_THRESHOLD', 100_000)
+
+
+def estimate_count(queryset):
+    """Planner row estimate for ``queryset``, or None when no estimate is available."""
+    if not isinstance(queryset, QuerySet):
+        return None
+    connection = connections[queryset.db]
+    if connection.vendor != 'postgresql':
+        return None
+    query = queryset.query
+    if query.distinct or query.combinator or query.is_sliced:
+        return None
+
+    with connection.cursor() as cursor:
+        if not query.where:
+            cursor.execute(
+                'SELECT reltuples::bigint FROM pg_class WHERE oid = %s::regclass',
+                [queryset.model._meta.db_table],
+            )
+            row = cursor.fetchone()
+            # reltuples is -1 for tables that were never analyzed
+            if row is None or row[0] < 0:
+                return None
+            return int(row[0])
+
+        sql, params = queryset.order_by().values('pk').query.get_compiler(using=queryset.db).as_sql()
+        cursor.execute('EXPLAIN (FORMAT JSON) ' + sql, params)
+        plan = cursor.fetchone()[0]
+        if isinstance(plan, str):
+            plan = json.loads(plan)
+        return int(plan[0]['Plan']['Plan Rows'])
+
+
+class ApproximateCountPaginator(Paginator):
+    """Paginator whose ``count`` is a planner estimate for large result sets.
+
+    ``is_approximate`` tells templates whether to say "about N".
+    """
+    is_approximate = False
+
+    @cached_property
+    def count(self):
+        estimate = estimate_count(self.object_list)
+        if estimate is not None and estimate >= approximate_count_threshold():
+            self.is_approximate = True
+            return estimate
+        return super().count
+
+
+class ApproximateCountPagination(PageNumberPagination):
+    """Opt-in DRF pagination: only paginates when the client sends ``?page=``.
+
+    Clients that don't ask for pages keep getting the plain list they always got.
+    """
+    django_paginator_class = ApproximateCountPaginator
+    page_size = 50
+    page_size_query_param = 'page_size'
+    max_page_size = 200
+
+    def paginate_queryset(self, queryset, request, view=None):
+        if self.page_query_param not in request.query_params:
+            return None
+        return super().paginate_queryset(queryset, request, view)
+
+    def get_paginated_response(self, data):
+        return Response({
+            'count': self.page.paginator.count,
+            'count_is_approximate': self.page.paginator.is_approximate,
+            'next': self.get_next_link(),
+            'previous': self.get_previous_link(),
+            'results': data,
+        })
@@ -0,0 +1,65 @@
+"""Phone number normalization used for patient lookups.
+
+Staff type contact numbers however they like ("0917 123 4567",
+"+639171234567", "09171234567"). These helpers reduce a number to its
+significant digits so every spelling of the same number compares equal.
+"""
+import re
+
+_NON_DIGITS = re.compile(r'\D+')
+
+COUNTRY_CODE = '63'
+# Mobile numbers have 10 significant digits (9XX XXX XXXX); anything this long
+# is treated as a complete number rather than a partial suffix.
+SIGNIFICANT_DIGITS = 10
+# Shortest suffix accepted by suffix lookups, so "1" can't match everyone.
+MIN_SUFFIX_DIGITS = 4
+
+
+def digits_only(value):
+    """Strip everything except digits from ``value``."""
+    if not value:
+        return ''
+    return _NON_DIGITS.sub('', str(value))
+
+
+def normalize_phone(value):
+    """Return the significant digits of a PH number, e.g. '0917 123 4567' -> '9171234567'."""
+    digits = digits_only(value)
+    if digits.startswith('00'):
+        # international dialing prefix (0063...)
+        digits = digits[2:]
+    if digits.startswith(COUNTRY_CODE) and len(digits) > SIGNIFICANT_DIGITS:
+        digits = digits[len(COUNTRY_CODE):]
+    # trunk prefix used for domestic dialing
+    return digits.lstrip('0')
+
+
+def phone_key(value):
+    """Key stored in ``Patient.contact_key``.
+
+    The normalized digits are stored reversed so that a suffix of the number
+    ("last 7 digits" from caller ID) becomes a prefix of the key and can be
+    answered with an index range scan.
+    """
+    return normalize_phone(value)[::-1]
+
+
+def suffix_key(value):
+    """Key prefix matching every number that ends with ``value``."""
+    digits = digits_only(value)
+    if len(digits) >= SIGNIFICANT_DIGITS:
+        digits = normalize_phone(digits)
+    return digits[::-1]
+
+
+def key_upper_bound(key):
+    """Smallest digit string above every key that starts with ``key``; None if ``key`` is all 9s.
+
+    Strings of digits sort the same under every collation, so
+    ``[key, key_upper_bound(key))`` is a safe index range for a prefix.
+    """
+    head = key.rstrip('9')
+    if not head:
+        return None
+    return head[:-1] + str(int(head[-1]) + 1)
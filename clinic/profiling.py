@@ -0,0 +1,193 @@
+"""Opt-in request profiling, reported in ``Server-Timing`` headers.
+
+With ``PROFILING_ENABLED`` on, ``ProfilingMiddleware`` times each request
+and adds a ``Server-Timing`` header, which browser dev tools show in the
+request's Timing tab:
+
+* ``db``: time in SQL on any database, with the query count as ``desc``,
+  measured with ``connection.execute_wrapper``;
+* ``tpl``: time rendering Django templates, including any queries the
+  templates trigger;
+* ``app``: everything else: view code, ReportLab/openpyxl, middleware;
+* ``total``: the whole request.
+
+It can also save a cProfile dump to ``PROFILING_DIR``, for:
+
+* requests sent with an ``X-Profile`` header holding ``PROFILING_TOKEN``,
+  a secret shared with the staff who profile. It is checked before the
+  profiler starts (the middleware runs ahead of authentication), so other
+  clients can't make the server profile their requests. Without a token
+  the header is ignored;
+* a random ``PROFILING_SAMPLE_RATE`` fraction of all requests.
+
+Only one profiler can run at a time on Python 3.12+; a request that finds
+another one running (two concurrent in a threaded server) gets its timings
+but no dump.
+
+The dump's file name comes back in the ``prof`` entry of the header. Open
+it with ``python -m pstats`` or snakeviz.
+"""
+import cProfile
+import functools
+import logging
+import random
+import re
+import time
+import uuid
+from contextlib import ExitStack
+from contextvars import ContextVar
+from pathlib import Path
+
+from django.conf import settings
+from django.db import connections
+from django.template.backends.django import Template as DjangoTemplate
+from django.utils import timezone
+from django.utils.crypto import constant_time_compare
+
+logger = logging.getLogger(__name__)
+
+PROFILE_HEADER = 'HTTP_X_PROFILE'
+
+_timings = ContextVar('profiling_timings', default=None)
+
+
+def enabled():
+    return getattr(settings, 'PROFILING_ENABLED', False)
+
+
+def sample_rate():
+    return getattr(settings, 'PROFILING_SAMPLE_RATE', 0.0)
+
+
+def profiling_token():
+    return getattr(settings, 'PROFILING_TOKEN', '')
+
+
+def is_flagged(request):
+    """True if the request carries ``X-Profile: <PROFILING_TOKEN>``."""
+    token = profiling_token()
+    header = request.META.get(PROFILE_HEADER)
+    return bool(token and header and constant_time_compare(header, token))
+
+
+def profile_dir():
+    return Path(getattr(settings, 'PROFILING_DIR', settings.BASE_DIR / 'profiles'))
+
+
+class Timings:
+    """Counters for one request; times are in milliseconds."""
+    __slots__ = ('queries', 'sql_ms', 'template_sql_ms', 'template_ms', '_template_depth')
+
+    def __init__(self):
+        self.queries = 0
+        self.sql_ms = 0.0
+        self.template_sql_ms = 0.0
+        self.template_ms = 0.0
+        self._template_depth = 0
+
+    def server_timing(self, total_ms):
+        app_ms = total_ms - self.template_ms - (self.sql_ms - self.template_sql_ms)
+        return [
+            f'db;dur={self.sql_ms:.1f};desc="{self.queries} queries"',
+            f'tpl;dur={self.template_ms:.1f}',
+            f'app;dur={max(app_ms, 0):.1f}',
+            f'total;dur={total_ms:.1f}',
+        ]
+
+
+def _time_sql(timings):
+    def wrapper(execute, sql, params, many, context):
+        started = time.perf_counter()
+        try:
+            return execute(sql, params, many, context)
+        finally:
+            elapsed = (time.perf_counter() - started) * 1000
+            timings.queries += 1
+            timings.sql_ms += elapsed
+            if timings._template_depth:
+                timings.template_sql_ms += elapsed
+
+    return wrapper
+
+
+def _time_render(render):
+    @functools.wraps(render)
+    def _wrapped(self, context=None, request=None):
+        timings = _timings.get()
+        # Count only the outermost render; render_to_string inside a template tag is part of it
+        if timings is None or timings._template_depth:
+            return render(self, context, request)
+        timings._template_depth += 1
+        started = time.perf_counter()
+        try:
+            return render(self, context, request)
+        finally:
+            timings.template_ms += (time.perf_counter() - started) * 1000
+            timings._template_depth -= 1
+
+    _wrapped.profiled = True
+    return _wrapped
+
+
+def instrument_templates():
+    """Time Django template rendering; idempotent."""
+    if not getattr(DjangoTemplate.render, 'profiled', False):
+        DjangoTemplate.render = _time_render(DjangoTemplate.render)
+
+
+def _dump_name(request):
+    slug = re.sub(r'[^A-Za-z0-9]+', '-', request.path).strip('-')[:80] or 'root'
+    return f'{timezone.now():%Y%m%d-%H%M%S}-{request.method}-{slug}-{uuid.uuid4().hex[:6]}.prof'
+
+
+class ProfilingMiddleware:
+    """Add Server-Timing to every response and cProfile flagged or sampled requests."""
+
+    def __init__(self, get_response):
+        self.get_response = get_response
+        instrument_templates()
+
+    def __call__(self, request):
+        if not enabled():
+            return self.get_response(request)
+
+        profiler = None
+        if is_flagged(request) or random.random() < sample_rate():
+            profiler = cProfile.Profile()
+
+        timings = Timings()
+        token = _timings.set(timings)
+        started = time.perf_counter()
+        try:
+            with ExitStack() as stack:
+                for alias in connections:
+                    stack.enter_context(connections[alias].execute_wrapper(_time_sql(timings)))
+                if profiler is not None:
+                    try:
+                        profiler.enable()
+                    except ValueError:
+                        # Another profiler is active in this process
+                        logger.warning('Not profiling %s %s: another profiler is running', request.method, request.path)
+                        profiler = None
+                try:
+                    response = self.get_response(request)
+                finally:
+                    if profiler is not None:
+                        profiler.disable()
+        finally:
+            _timings.reset(token)
+        total_ms = (time.perf_counter() - started) * 1000
+
+        entries = timings.server_timing(total_ms)
+        if profiler is not None:
+            entries.append(f'prof;desc="{self._save(profiler, request)}"')
+        response['Server-Timing'] = ', '.join(entries)
+        return response
+
+    def _save(self, profiler, request):
+        directory = profile_dir()
+        directory.mkdir(parents=True, exist_ok=True)
+        name = _dump_name(request)
+        profiler.dump_stats(directory / name)
+        logger.info('Saved profile of %s %s to %s', request.method, request.path, directory / name)
+        return name
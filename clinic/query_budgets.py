@@ -0,0 +1,140 @@
+"""Maximum SQL queries per page, keyed by URL name.
+
+``QueryBudgetTests`` in ``clinic/tests.py`` requests every URL below with
+seeded data at two sizes. A test fails when a page issues more queries
+than its budget, or when its count grows with the data, which is how an
+N+1 loop shows up. Every named URL in the project (``clinic.urls``,
+``clinic.urls_api``, the admin) must appear in ``QUERY_BUDGETS`` or in
+``UNBUDGETED`` with a reason, so new pages can't skip the check.
+
+Counts include the session and user lookups each authenticated request
+makes.
+"""
+
+QUERY_BUDGETS = {
+    # clinic.urls
+    'clinic:login': 2,
+    'clinic:register': 2,
+    'clinic:staff_login': 2,
+    'clinic:dashboard': 2,
+    'clinic:patients_list': 3,
+    'clinic:patient_create': 2,
+    'clinic:patient_detail': 6,
+    'clinic:patient_update': 3,
+    'clinic:services_list': 3,
+    'clinic:service_create': 2,
+    'clinic:service_update': 3,
+    'clinic:invoices_list': 3,
+    'clinic:invoice_create': 3,
+    'clinic:invoice_detail': 4,
+    'clinic:invoice_update': 4,
+    'clinic:invoice_pdf': 4,
+    'clinic:archive': 8,
+    'clinic:staff_approval': 3,
+    'clinic:staff_list': 3,
+    'clinic:staff_pos': 4,
+    'clinic:patient_autocomplete': 3,
+    'clinic:sales_analytics': 7,
+    'clinic:sales_summary_csv': 4,
+    'clinic:sales_summary_pdf': 3,
+    'clinic:sales_summary_xlsx': 3,
+
+    # clinic.urls_api
+    'api_root': 1,
+    'api:api-root': 1,
+    'api:patients-list': 2,
+    'api:patients-detail': 2,
+    'api:patients-lookup': 2,
+    'api:services-list': 2,
+    'api:services-detail': 2,
+    'api:invoices-list': 3,
+    'api:invoices-detail': 3,
+    'api:invoices-receipt-pdf': 3,
+    'api:staff_activity': 7,
+    'api:staff_detail': 8,
+    'async_api:services': 2,
+    'async_api:service_detail': 2,
+    'async_api:invoices': 3,
+    'async_api:invoice_detail': 3,
+    'async_api:receipt_pdf': 3,
+    'async_api:sales_summary': 3,
+
+    # admin
+    'custom_admin:index': 3,
+    'custom_admin:app_list': 2,
+    'custom_admin:clinic_service_changelist': 6,
+    'custom_admin:clinic_service_add': 2,
+    'custom_admin:clinic_service_change': 3,
+    'custom_admin:clinic_patient_changelist': 4,
+    'custom_admin:clinic_patient_add': 2,
+    'custom_admin:clinic_patient_change': 7,
+    'custom_admin:clinic_invoice_changelist': 6,
+    'custom_admin:clinic_invoice_add': 5,
+    'custom_admin:clinic_invoice_change': 9,
+    'custom_admin:clinic_staffprofile_changelist': 5,
+    'custom_admin:clinic_staffprofile_add': 2,
+    'custom_admin:clinic_staffprofile_change': 11,
+    'custom_admin:clinic_duplicatesuggestion_changelist': 6,
+    'custom_admin:clinic_duplicatesuggestion_change': 5,
+    'custom_admin:auth_user_changelist': 5,
+    'custom_admin:auth_user_add': 2,
+    'custom_admin:auth_user_change': 7,
+    'custom_admin:auth_user_history': 4,
+    'custom_admin:clinic_service_history': 4,
+    'custom_admin:clinic_patient_history': 4,
+    'custom_admin:clinic_invoice_history': 5,
+    'custom_admin:clinic_staffprofile_history': 5,
+    'custom_admin:clinic_duplicatesuggestion_history': 6,
+    'custom_admin:clinic_slowquery_changelist': 6,
+    'custom_admin:clinic_slowquery_change': 3,
+    'custom_admin:clinic_slowquery_history': 4,
+
+    # dental_clinic.urls
+    'index': 2,
+    'login': 2,
+    'metrics': 3,
+}
+
+UNBUDGETED = {
+    # Change data on GET; each touches one row
+    'logout': 'logs the user out',
+    'clinic:logout': 'logs the user out',
+    'clinic:patient_delete': 'archives on GET',
+    'clinic:service_delete': 'archives on GET',
+    'clinic:invoice_delete': 'archives on GET',
+    'clinic:restore_patient': 'restores on GET',
+    'clinic:restore_service': 'restores on GET',
+    'clinic:restore_staff': 'restores on GET',
+    'clinic:restore_invoice': 'restores on GET',
+    'clinic:delete_patient_permanent': 'deletes on GET',
+    'clinic:delete_service_permanent': 'deletes on GET',
+    'clinic:delete_staff_permanent': 'deletes on GET',
+    'clinic:delete_invoice_permanent': 'deletes on GET',
+    'clinic:approve_staff': 'approves on GET',
+    'clinic:reject_staff': 'deletes on GET',
+    'clinic:staff_delete': 'archives on GET',
+    # POST-only API actions
+    'api:auth-login': 'POST only',
+    'api:auth-logout': 'POST only',
+    'api:auth-register': 'POST only',
+    'api:patients-request-archive': 'POST only',
+    # Django's own admin pages, not ours to tune
+    'custom_admin:login': 'Django admin',
+    'custom_admin:logout': 'Django admin',
+    'custom_admin:password_change': 'Django admin',
+    'custom_admin:password_change_done': 'Django admin',
+    'custom_admin:autocomplete': 'Django admin',
+    'custom_admin:jsi18n': 'Django admin',
+    'custom_admin:view_on_site': 'Django admin',
+    'custom_admin:auth_user_password_change': 'Django admin',
+    'custom_admin:clinic_duplicatesuggestion_add': 'suggestions are generated, not added',
+    'custom_admin:clinic_slowquery_add': 'slow queries are recorded, not added',
+    # The delete confirmation lists every related row Django would cascade to
+    'custom_admin:clinic_service_delete': 'delete confirmation',
+    'custom_admin:clinic_patient_delete': 'delete confirmation',
+    'custom_admin:clinic_invoice_delete': 'delete confirmation',
+    'custom_admin:clinic_staffprofile_delete': 'delete confirmation',
+    'custom_admin:clinic_duplicatesuggestion_delete': 'delete confirmation',
+    'custom_admin:clinic_slowquery_delete': 'delete confirmation',
+    'custom_admin:auth_user_delete': 'delete confirmation',
+}
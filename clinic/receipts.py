@@ -0,0 +1,57 @@
+"""Invoice receipt PDFs, split into loading and rendering.
+
+``receipt_data`` reads what the receipt shows from an invoice whose
+``patient`` and ``items`` are already loaded. ``render_receipt_pdf`` turns
+that into PDF bytes without touching the database, so the async API can
+hand it to a thread or process pool (see ``clinic.async_api``). This module
+imports no models, so a pool process can unpickle the function without
+setting up Django.
+"""
+import io
+
+
+def receipt_data(invoice):
+    """Plain, picklable values for ``render_receipt_pdf``."""
+    return {
+        'id': invoice.id,
+        'patient': str(invoice.patient),
+        'date': invoice.date_created.strftime('%Y-%m-%d'),
+        'items': [
+            (item.service_name_at_time, item.price_at_time, item.quantity, item.total_price())
+            for item in invoice.items.all()
+        ],
+        'total': invoice.total_amount(),
+    }
+
+
+def render_receipt_pdf(data):
+    from reportlab.lib.pagesizes import letter
+    from reportlab.pdfgen import canvas
+
+    buffer = io.BytesIO()
+    pdf = canvas.Canvas(buffer, pagesize=letter)
+
+    # Add invoice details
+    pdf.setFont("Helvetica-Bold", 16)
+    pdf.drawString(50, 750, f"Invoice #{data['id']}")
+
+    pdf.setFont("Helvetica", 10)
+    pdf.drawString(50, 730, f"Patient: {data['patient']}")
+    pdf.drawString(50, 710, f"Date: {data['date']}")
+
+    # Add items
+    y = 680
+    pdf.drawString(50, y, "Item | Price | Qty | Total")
+    y -= 20
+
+    for name, price, quantity, total in data['items']:
+        pdf.drawString(50, y, f"{name} | {price} | {quantity} | {total}")
+        y -= 15
+
+    # Add total
+    pdf.setFont("Helvetica-Bold", 12)
+    y -= 10
+    pdf.drawString(50, y, f"Total: ₱{data['total']:.2f}")
+
+    pdf.save()
+    return buffer.getvalue()
@@ -0,0 +1,193 @@
+"""Staff activity report.
+
+Statistics for every staff member come from grouped aggregates, and the
+"recent 10" lists from a ROW_NUMBER() window partitioned by staff user, so
+the report costs the same handful of queries whatever the number of staff,
+patients or invoices.
+
+Activity is attributed the same way the admin does it: patients a staff
+member created, and the invoices of those patients.
+"""
+from collections import defaultdict
+
+from django.db.models import Count, F, Q, Sum, Window
+from django.db.models.functions import RowNumber
+
+from .models import Invoice, InvoiceItem, LINE_TOTAL_CENTAVOS, Patient, StaffProfile
+from .money import Money
+
+RECENT_LIMIT = 10
+
+
+def _patient_row(p):
+    return {
+        'id': p.id,
+        'first_name': p.first_name,
+        'last_name': p.last_name,
+        'email': p.email,
+        # Patient has no phone field; the key is kept for existing API clients
+        'phone': p.contact_number,
+        'added_date': p.created_at.isoformat(),
+        'invoices_count': p.invoices_count,
+        'total_spent': p.total_spent,
+    }
+
+
+def _invoice_row(inv):
+    return {
+        'id': inv.id,
+        'patient_id': inv.patient_id,
+        'patient_name': f"{inv.patient.first_name} {inv.patient.last_name}",
+        'amount': inv.amount_total,
+        'date_created': inv.date_created.isoformat(),
+        'is_paid': inv.is_paid,
+        'items_count': inv.items_count,
+    }
+
+
+def _statistics(user_ids):
+    """Per-user totals keyed by user id: three grouped queries."""
+    stats = defaultdict(lambda: {
+        'patients_added': 0,
+        'total_invoices': 0,
+        'total_revenue': 0.0,
+        'paid_invoices': 0,
+        'pending_invoices': 0,
+    })
+    patient_counts = (
+        Patient.objects.filter(created_by__in=user_ids)
+        .values('created_by').annotate(n=Count('id')).order_by()
+    )
+    for row in patient_counts:
+        stats[row['created_by']]['patients_added'] = row['n']
+
+    invoice_counts = (
+        Invoice.objects.filter(patient__created_by__in=user_ids)
+        .values(user=F('patient__created_by'))
+        .annotate(
+            total=Count('id'),
+            paid=Count('id', filter=Q(is_paid=True)),
+            pending=Count('id', filter=Q(is_paid=False)),
+        ).order_by()
+    )
+    for row in invoice_counts:
+        entry = stats[row['user']]
+        entry['total_invoices'] = row['total']
+        entry['paid_invoices'] = row['paid']
+        entry['pending_invoices'] = row['pending']
+
+    revenue = (
+        InvoiceItem.objects.filter(invoice__patient__created_by__in=user_ids, invoice__is_archived=False)
+        .values(user=F('invoice__patient__created_by'))
+        .annotate(total=Sum(LINE_TOTAL_CENTAVOS)).order_by()
+    )
+    for row in revenue:
+        stats[row['user']]['total_revenue'] = Money(row['total']).as_float()
+    return stats
+
+
+def _recent_patients(user_ids, limit=RECENT_LIMIT):
+    rows = (
+        Patient.objects.filter(created_by__in=user_ids)
+        .with_invoice_stats()
+        .annotate(rank=Window(RowNumber(), partition_by=F('created_by'), order_by=F('created_at').desc()))
+        .filter(rank__lte=limit)
+        .order_by('created_by', 'rank')
+    )
+    recent = defaultdict(list)
+    for p in rows:
+        recent[p.created_by_id].append(_patient_row(p))
+    return recent
+
+
+def _recent_invoices(user_ids, limit=RECENT_LIMIT):
+    rows = (
+        Invoice.objects.filter(patient__created_by__in=user_ids)
+        .select_related('patient')
+        .with_totals()
+        .annotate(rank=Window(RowNumber(), partition_by=F('patient__created_by'), order_by=F('date_created').desc()))
+        .filter(rank__lte=limit)
+        .order_by('patient__created_by', 'rank')
+    )
+    recent = defaultdict(list)
+    for inv in rows:
+        recent[inv.patient.created_by_id].append(_invoice_row(inv))
+    return recent
+
+
+def _profile_header(profile):
+    return {
+        'staff_id': profile.id,
+        'username': profile.user.username,
+        'full_name': f"{profile.user.first_name} {profile.user.last_name}".strip() or "(No name)",
+        'position': profile.get_position_display(),
+        'email': profile.user.email,
+        'created_at': profile.created_at.isoformat(),
+    }
+
+
+def staff_activity_report(profiles=None):
+    """Activity entries for every StaffProfile (or the given queryset) in six queries."""
+    if profiles is None:
+        profiles = StaffProfile.objects.all()
+    profiles = list(profiles.select_related('user').order_by('pk'))
+    user_ids = [p.user_id for p in profiles]
+
+    stats = _statistics(user_ids)
+    recent_patients = _recent_patients(user_ids)
+    recent_invoices = _recent_invoices(user_ids)
+
+    return [
+        {
+            **_profile_header(profile),
+            'statistics': stats[profile.user_id],
+            'recent_patients': recent_patients.get(profile.user_id, []),
+            'recent_invoices': recent_invoices.get(profile.user_id, []),
+        }
+        for profile in profiles
+    ]
+
+
+def staff_detail_report(profile):
+    """Full activity for one staff member: every patient and invoice, in six queries."""
+    user_ids = [profile.user_id]
+    stats = _statistics(user_ids)[profile.user_id]
+
+    patients = (
+        Patient.objects.filter(created_by=profile.user_id)
+        .with_invoice_stats()
+        .order_by('-created_at')
+    )
+    invoices = (
+        Invoice.objects.filter(patient__created_by=profile.user_id)
+        .select_related('patient')
+        .with_totals()
+        .prefetch_related('items')
+        .order_by('-date_created')
+    )
+
+    all_invoices = []
+    for inv in invoices:
+        row = _invoice_row(inv)
+        row['items'] = [
+            {
+                'service': item.service_name_at_time,
+                'quantity': item.quantity,
+                'price': item.price_at_time,
+            }
+            for item in inv.items.all()
+        ]
+        all_invoices.append(row)
+
+    return {
+        **_profile_header(profile),
+        'statistics': {
+            'total_patients': stats['patients_added'],
+            'total_invoices': stats['total_invoices'],
+            'total_revenue': stats['total_revenue'],
+            'paid_invoices': stats['paid_invoices'],
+            'pending_invoices': stats['pending_invoices'],
+        },
+        'all_patients': [_patient_row(p) for p in patients],
+        'all_invoices': all_invoices,
+    }
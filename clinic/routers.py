@@ -0,0 +1,119 @@
+"""Send reporting reads to a read replica, when there is one.
+
+Set ``REPLICA_DATABASE_URL`` and ``settings.py`` adds a ``replica`` database.
+Only views wrapped in ``reads_from_replica`` use it: sales analytics, the
+sales exports and the staff/sales report APIs. Everything else, and every
+write, stays on ``default``. Without a replica the router never picks a
+database, so Django uses ``default`` as before.
+
+A replica lags the primary a little. A user who has just written (any
+successful POST/PUT/PATCH/DELETE, see ``ReplicaPinMiddleware``) is pinned
+to the primary for ``REPLICA_PIN_SECONDS`` (default 10), so their next
+report includes their own changes. The pin is a cookie for browsers plus
+a ``ReplicaPin`` row per user for API clients that don't keep cookies.
+The row is in the primary database rather than the cache, so a pin set
+by one worker holds on the others even with a per-process cache.
+
+Locally, point ``REPLICA_DATABASE_URL`` at a second SQLite file (for
+example a copy of ``db.sqlite3``) to see reports read from it.
+"""
+from contextlib import contextmanager
+from contextvars import ContextVar
+from datetime import timedelta
+from functools import wraps
+
+from django.conf import settings
+from django.utils import timezone
+
+REPLICA = 'replica'
+PIN_COOKIE = 'replica_pin'
+
+_use_replica = ContextVar('use_replica', default=False)
+
+
+def replica_configured():
+    return REPLICA in settings.DATABASES
+
+
+def pin_seconds():
+    return getattr(settings, 'REPLICA_PIN_SECONDS', 10)
+
+
+@contextmanager
+def use_replica():
+    """Let reads inside the block go to the replica."""
+    token = _use_replica.set(True)
+    try:
+        yield
+    finally:
+        _use_replica.reset(token)
+
+
+def is_pinned(request):
+    """True if this client or user wrote recently and must read from the primary."""
+    if request.COOKIES.get(PIN_COOKIE):
+        return True
+    user = getattr(request, 'user', None)
+    if user is None or not user.is_authenticated:
+        return False
+    from .models import ReplicaPin
+
+    return ReplicaPin.objects.using('default').filter(user=user, pinned_until__gt=timezone.now()).exists()
+
+
+def pin_to_primary(request, response):
+    seconds = pin_seconds()
+    response.set_cookie(PIN_COOKIE, '1', max_age=seconds, httponly=True, samesite='Lax')
+    user = getattr(request, 'user', None)
+    if user is not None and user.is_authenticated:
+        from .models import ReplicaPin
+
+        until = timezone.now() + timedelta(seconds=seconds)
+        if not ReplicaPin.objects.filter(user=user).update(pinned_until=until):
+            ReplicaPin.objects.update_or_create(user=user, defaults={'pinned_until': until})
+
+
+def reads_from_replica(view_func):
+    """Run a read-only report view against the replica, unless the user just wrote."""
+    @wraps(view_func)
+    def _wrapped(request, *args, **kwargs):
+        if not replica_configured() or is_pinned(request):
+            return view_func(request, *args, **kwargs)
+        with use_replica():
+            return view_func(request, *args, **kwargs)
+
+    return _wrapped
+
+
+class ReplicaPinMiddleware:
+    """Pin a client to the primary after a successful write request."""
+    SAFE_METHODS = ('GET', 'HEAD', 'OPTIONS', 'TRACE')
+
+    def __init__(self, get_response):
+        self.get_response = get_response
+
+    def __call__(self, request):
+        response = self.get_response(request)
+        if (
+            replica_configured()
+            and request.method not in self.SAFE_METHODS
+            and response.status_code < 400
+        ):
+            pin_to_primary(request, response)
+        return response
+
+
+class ReplicaRouter:
+    """Reads go to the replica inside ``use_replica()``; everything else to ``default``."""
+
+    def db_for_read(self, model, **hints):
+        if _use_replica.get() and replica_configured():
+            return REPLICA
+        return None
+
+    def db_for_write(self, model, **hints):
+        return 'default'
+
+    def allow_relation(self, obj1, obj2, **hints):
+        # Both databases hold the same data
+        return True
@@ -0,0 +1,221 @@
+"""In-memory prefix index for the staff POS patient picker.
+
+Each worker process keeps a sorted array of ``(term, patient id)`` entries,
+one per search term (name word or normalized phone digits) of each active
+patient. A prefix query is a binary search followed by a short forward
+scan, and a patient save bisects straight to its own entries, so lookups
+never touch the database once the index is built.
+
+The index is built lazily on first use and kept current by the Patient
+signals in ``clinic.signals``. Writes made by other worker processes are
+not seen by those signals, so the index is also rebuilt once it is older
+than ``PATIENT_INDEX_MAX_AGE`` seconds (default 300). Saves and deletes
+that arrive while a rebuild reads the table are replayed onto the new
+arrays, so they are not lost with the old ones.
+"""
+import math
+import threading
+import time
+from bisect import bisect_left, bisect_right, insort
+
+from django.conf import settings
+
+from .phone import digits_only, normalize_phone
+
+# Upper bound on index entries examined per query when extra words filter candidates out.
+MAX_SCAN = 2000
+
+
+def _prefix_range(entries, prefix):
+    """The slice of sorted ``(term, pk)`` entries whose term starts with ``prefix``."""
+    lo = bisect_left(entries, (prefix,))
+    after = prefix[:-1] + chr(ord(prefix[-1]) + 1)
+    return lo, bisect_left(entries, (after,), lo)
+
+
+def _newest_first(entries, lo, hi):
+    """Patient ids in ``entries[lo:hi]``, term by term, newest patient first within a term."""
+    while lo < hi:
+        end = bisect_right(entries, (entries[lo][0], math.inf), lo, hi)
+        for i in range(end - 1, lo - 1, -1):
+            yield entries[i][1]
+        lo = end
+
+
+def _name_words(first_name, last_name):
+    return f"{first_name or ''} {last_name or ''}".lower().split()
+
+
+def _terms_for(first_name, last_name, contact_number):
+    terms = set(_name_words(first_name, last_name))
+    phone = normalize_phone(contact_number)
+    if phone:
+        terms.add(phone)
+    return sorted(terms)
+
+
+class PatientPrefixIndex:
+    """Sorted-array prefix index over active patients' names and phone numbers."""
+
+    def __init__(self, max_age=None):
+        self._lock = threading.Lock()
+        self._build_lock = threading.Lock()
+        self._max_age = max_age
+        self._built_at = None
+        self._entries = []
+        self._records = {}
+        self._patient_terms = {}
+        # Changes seen while build() reads the rows, replayed after the swap
+        self._pending = None
+
+    @property
+    def max_age(self):
+        if self._max_age is not None:
+            return self._max_age
+        return getattr(settings, 'PATIENT_INDEX_MAX_AGE', 300)
+
+    def is_built(self):
+        return self._built_at is not None
+
+    def invalidate(self):
+        """Drop the index; the next query rebuilds it."""
+        with self._lock:
+            self._built_at = None
+
+    def build(self):
+        """(Re)load every active patient from the database."""
+        with self._build_lock:
+            self._rebuild()
+
+    def _rebuild(self):
+        with self._lock:
+            self._pending = []
+        try:
+            self._load()
+        finally:
+            with self._lock:
+                self._pending = None
+
+    def _load(self):
+        from .models import Patient
+
+        rows = Patient.objects.values_list(
+            'id', 'first_name', 'last_name', 'contact_number'
+        )
+        entries = []
+        records = {}
+        patient_terms = {}
+        for pk, first_name, last_name, contact_number in rows.iterator(chunk_size=5000):
+            terms = _terms_for(first_name, last_name, contact_number)
+            records[pk] = self._record(pk, first_name, last_name, contact_number)
+            patient_terms[pk] = terms
+            entries.extend((term, pk) for term in terms)
+        entries.sort()
+
+        with self._lock:
+            self._entries = entries
+            self._records = records
+            self._patient_terms = patient_terms
+            for change in self._pending:
+                self._apply_locked(*change)
+            self._built_at = time.monotonic()
+
+    def _ensure_built(self):
+        if not self._is_stale():
+            return
+        with self._build_lock:
+            # another thread may have rebuilt while we waited
+            if self._is_stale():
+                self._rebuild()
+
+    def _is_stale(self):
+        built_at = self._built_at
+        return built_at is None or time.monotonic() - built_at > self.max_age
+
+    @staticmethod
+    def _record(pk, first_name, last_name, contact_number):
+        return {
+            'id': pk,
+            'first_name': first_name or '',
+            'last_name': last_name or '',
+            'contact_number': contact_number or '',
+        }
+
+    def _remove_locked(self, pk):
+        entries = self._entries
+        for term in self._patient_terms.pop(pk, ()):
+            i = bisect_left(entries, (term, pk))
+            if i < len(entries) and entries[i] == (term, pk):
+                del entries[i]
+        self._records.pop(pk, None)
+
+    def _apply_locked(self, pk, first_name, last_name, contact_number, archived):
+        self._remove_locked(pk)
+        if archived:
+            return
+        terms = _terms_for(first_name, last_name, contact_number)
+        for term in terms:
+            insort(self._entries, (term, pk))
+        self._patient_terms[pk] = terms
+        self._records[pk] = self._record(pk, first_name, last_name, contact_number)
+
+    def _change(self, *change):
+        with self._lock:
+            if self._pending is not None:
+                self._pending.append(change)
+            if self._built_at is not None:
+                self._apply_locked(*change)
+
+    def update(self, patient):
+        """Apply a saved Patient to the index (archived patients are removed)."""
+        self._change(patient.pk, patient.first_name, patient.last_name, patient.contact_number, patient.is_archived)
+
+    def remove(self, pk):
+        self._change(pk, None, None, None, True)
+
+    def search(self, query, limit=10):
+        """Return up to ``limit`` patient records whose name words or phone start with ``query``.
+
+        Multi-word queries scan on the word with the fewest matching entries
+        and require every other word to prefix one of the patient's name words
+        ("ju dela" finds "Juan Dela Cruz"). Matches come term by term (so
+        "juan" before "juana"), the newest patients first within a term.
+        """
+        words = (query or '').lower().split()
+        if not words or limit <= 0:
+            return []
+        if not any(ch.isalpha() for ch in query):
+            # Phone input: compare on normalized digits ("0917 12" -> "91712")
+            digits = digits_only(query)
+            if query.lstrip().startswith('+') and digits.startswith('63'):
+                digits = digits[2:]
+            words = [digits.lstrip('0')] if digits.strip('0') else []
+            if not words:
+                return []
+
+        self._ensure_built()
+        results = []
+        seen = set()
+        with self._lock:
+            entries, records = self._entries, self._records
+            ranges = {word: _prefix_range(entries, word) for word in words}
+            head = min(ranges, key=lambda word: ranges[word][1] - ranges[word][0])
+            rest = [word for word in words if word != head]
+            for scanned, pk in enumerate(_newest_first(entries, *ranges[head])):
+                if scanned >= MAX_SCAN:
+                    break
+                if pk in seen:
+                    continue
+                seen.add(pk)
+                record = records[pk]
+                if rest:
+                    name_words = _name_words(record['first_name'], record['last_name'])
+                    if not all(any(w.startswith(r) for w in name_words) for r in rest):
+                        continue
+                results.append(record)
+                if len(results) >= limit:
+                    break
+        return [dict(r) for r in results]
+
+
+patient_index = PatientPrefixIndex()
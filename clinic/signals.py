@@ -0,0 +1,61 @@
+from django.contrib.auth.models import User
+from django.db import transaction
+from django.db.backends.signals import connection_created
+from django.db.models.signals import post_save, post_delete
+from django.dispatch import receiver
+from . import kpis
+from .sqlite import configure_connection
+from .models import Invoice, InvoiceItem, Patient, Service
+from .catalog import service_catalog
+from .search import patient_index
+
+KPI_MODELS = (Patient, Service, Invoice, InvoiceItem)
+STAFF_FIELDS = {'is_staff', 'is_active'}
+
+
+@receiver(post_save, sender=Patient)
+def refresh_patient_index(sender, instance, **kwargs):
+    """Keep the POS autocomplete index in step with patient edits and archiving."""
+    transaction.on_commit(lambda: patient_index.update(instance))
+
+
+@receiver(post_delete, sender=Patient)
+def drop_patient_from_index(sender, instance, **kwargs):
+    pk = instance.pk
+    transaction.on_commit(lambda: patient_index.remove(pk))
+
+
+@receiver(post_save, sender=Service)
+@receiver(post_delete, sender=Service)
+def refresh_service_catalog(sender, instance, **kwargs):
+    """New catalog version on every service edit, archive, restore or delete."""
+    service_catalog.changed()
+
+
+def update_kpis_on_save(sender, instance, created, raw=False, **kwargs):
+    """Adjust the dashboard counters in the transaction that saved the row."""
+    if not raw:
+        kpis.record_save(instance, created)
+
+
+def update_kpis_on_delete(sender, instance, **kwargs):
+    kpis.record_delete(instance)
+
+
+# Connected per model: a receiver without a sender would disable Django's
+# fast (signal-free) deletes for every other model.
+for model in KPI_MODELS:
+    post_save.connect(update_kpis_on_save, sender=model)
+    post_delete.connect(update_kpis_on_delete, sender=model)
+
+
+@receiver(post_save, sender=User)
+@receiver(post_delete, sender=User)
+def update_staff_count(sender, instance, update_fields=None, **kwargs):
+    # Logins save last_login only; skip those
+    if update_fields is None or STAFF_FIELDS & set(update_fields):
+        kpis.refresh_staff_count()
+
+
+# WAL, busy timeout and friends for the SQLite fallback database
+connection_created.connect(configure_connection, dispatch_uid='clinic.sqlite.configure_connection')
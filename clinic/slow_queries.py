@@ -0,0 +1,248 @@
+"""Record SQL statements slower than ``SLOW_QUERY_MS`` (default 200; 0 turns it off).
+
+``SlowQueryMiddleware`` wraps every database connection with an
+``execute_wrapper`` for the length of a request. A statement over the
+threshold is logged to ``clinic.slow_queries`` with its normalized SQL,
+the shape of its parameters, the view and the innermost project stack
+frame that ran it. It is saved as a ``SlowQuery`` row, one per
+fingerprint (a hash of the normalized SQL), which counts how often it was
+slow and for how long.
+
+Saving takes an EXPLAIN and up to two writes, so it happens off the
+request: after the response the middleware hands the request's slow
+statements (at most ``SLOW_QUERY_MAX_PER_REQUEST``, default 20) to
+``recorder``, whose background thread saves them. Its queue holds
+``Recorder.MAX_PENDING`` requests; when a struggling database fills it,
+further statements are only logged.
+
+The first time a fingerprint is seen, its plan is captured with
+``EXPLAIN`` (``EXPLAIN QUERY PLAN`` on SQLite) using the original
+parameters. Without ANALYZE, EXPLAIN does not run the statement, so this
+is safe for writes too.
+
+Superusers browse the worst offenders under "Slow queries" in the admin.
+"""
+import hashlib
+import logging
+import os
+import queue
+import re
+import threading
+import time
+import traceback
+from contextlib import ExitStack
+
+from django.conf import settings
+from django.db import DatabaseError, IntegrityError, close_old_connections, connections, transaction
+from django.db.models import F, Value
+from django.db.models.functions import Greatest
+from django.utils import timezone
+
+from .models import SlowQuery
+
+logger = logging.getLogger(__name__)
+
+_STRING = re.compile(r"'(?:[^']|'')*'")
+_NUMBER = re.compile(r'\b\d+(?:\.\d+)?\b')
+_PLACEHOLDER_LIST = re.compile(r'\(\s*\?(?:\s*,\s*\?)*\s*\)')
+_SPACE = re.compile(r'\s+')
+# Modules whose execute wrappers sit between the caller and the database
+WRAPPER_MODULES = {
+    os.path.join('clinic', 'metrics.py'),
+    os.path.join('clinic', 'profiling.py'),
+    os.path.join('clinic', 'slow_queries.py'),
+}
+
+
+def threshold_ms():
+    return getattr(settings, 'SLOW_QUERY_MS', 200)
+
+
+def max_per_request():
+    return getattr(settings, 'SLOW_QUERY_MAX_PER_REQUEST', 20)
+
+
+def normalize(sql):
+    """SQL with literals and parameters replaced by ``?`` and IN lists collapsed.
+
+    Statements that differ only in values, or in how many values an IN list
+    has, normalize to the same text.
+    """
+    sql = _STRING.sub('?', sql)
+    sql = _NUMBER.sub('?', sql)
+    sql = sql.replace('%s', '?')
+    sql = _PLACEHOLDER_LIST.sub('(...)', sql)
+    return _SPACE.sub(' ', sql).strip()
+
+
+def fingerprint(normalized_sql):
+    return hashlib.sha1(normalized_sql.encode()).hexdigest()
+
+
+def params_shape(params, many=False):
+    """Parameter types without their values, e.g. ``(int, str, datetime)``."""
+    if many:
+        first = params[0] if isinstance(params, (list, tuple)) and params else None
+        return f'executemany {params_shape(first)}' if first is not None else 'executemany'
+    if not params:
+        return '()'
+    if isinstance(params, dict):
+        types = (f'{key}: {type(value).__name__}' for key, value in params.items())
+    else:
+        types = (type(value).__name__ for value in params)
+    return f"({', '.join(types)})"[:200]
+
+
+def _location():
+    """The innermost stack frame in project code, skipping installed packages and execute wrappers."""
+    base = str(settings.BASE_DIR)
+    for frame in reversed(traceback.extract_stack()):
+        if not frame.filename.startswith(base) or 'site-packages' in frame.filename:
+            continue
+        path = os.path.relpath(frame.filename, base)
+        if path not in WRAPPER_MODULES:
+            return f'{path}:{frame.lineno} in {frame.name}'[:300]
+    return ''
+
+
+def _view_name(request):
+    match = getattr(request, 'resolver_match', None)
+    return match.view_name if match else request.path
+
+
+def explain(alias, sql, params):
+    connection = connections[alias]
+    prefix = 'EXPLAIN QUERY PLAN' if connection.vendor == 'sqlite' else 'EXPLAIN'
+    try:
+        with transaction.atomic(using=alias), connection.cursor() as cursor:
+            cursor.execute(f'{prefix} {sql}', params)
+            # SQLite returns (id, parent, notused, detail); Postgres one text column
+            return '\n'.join(str(row[-1]) for row in cursor.fetchall())
+    except DatabaseError as exc:
+        return f'EXPLAIN failed: {exc}'
+
+
+def record(alias, sql, params, many, elapsed_ms, view, location):
+    """Add one slow execution to its ``SlowQuery`` row, creating it (with EXPLAIN) the first time."""
+    normalized = normalize(sql)
+    key = fingerprint(normalized)
+    now = timezone.now()
+    seen = dict(
+        occurrences=F('occurrences') + 1,
+        total_ms=F('total_ms') + elapsed_ms,
+        max_ms=Greatest('max_ms', Value(elapsed_ms)),
+        last_seen=now,
+        view=view[:200],
+        location=location,
+    )
+    if SlowQuery.objects.filter(fingerprint=key).update(**seen):
+        return
+    plan = '' if many else explain(alias, sql, params)
+    try:
+        with transaction.atomic():
+            SlowQuery.objects.create(
+                fingerprint=key,
+                normalized_sql=normalized,
+                sql=sql,
+                params_shape=params_shape(params, many),
+                database=alias,
+                view=view[:200],
+                location=location,
+                explain=plan,
+                occurrences=1,
+                total_ms=elapsed_ms,
+                max_ms=elapsed_ms,
+                first_seen=now,
+                last_seen=now,
+            )
+    except IntegrityError:
+        # Another worker saved the same fingerprint first
+        SlowQuery.objects.filter(fingerprint=key).update(**seen)
+
+
+class Recorder:
+    """Saves slow statements on a background thread, a request's worth at a time."""
+    MAX_PENDING = 100
+
+    def __init__(self):
+        self._queue = queue.Queue(self.MAX_PENDING)
+        self._lock = threading.Lock()
+        self._thread = None
+
+    def submit(self, entries):
+        """Queue ``record()`` arguments for saving; drop them if the queue is full."""
+        try:
+            self._queue.put_nowait(entries)
+        except queue.Full:
+            logger.warning('Slow query queue is full; not saving %d statement(s)', len(entries))
+            return
+        with self._lock:
+            if self._thread is None or not self._thread.is_alive():
+                self._thread = threading.Thread(target=self._run, name='slow-query-recorder', daemon=True)
+                self._thread.start()
+
+    def save(self, entries):
+        for entry in entries:
+            try:
+                record(*entry)
+            except DatabaseError:
+                logger.exception('Could not save slow query')
+
+    def join(self):
+        """Wait until everything queued so far is saved."""
+        self._queue.join()
+
+    def _run(self):
+        while True:
+            entries = self._queue.get()
+            try:
+                self.save(entries)
+            except Exception:
+                logger.exception('Could not save slow queries')
+            finally:
+                close_old_connections()
+                self._queue.task_done()
+
+
+recorder = Recorder()
+
+
+class SlowQueryMiddleware:
+    """Log and save the statements of a request that ran longer than ``SLOW_QUERY_MS``."""
+
+    def __init__(self, get_response):
+        self.get_response = get_response
+
+    def __call__(self, request):
+        threshold = threshold_ms()
+        if not threshold:
+            return self.get_response(request)
+
+        slow = []
+        limit = max_per_request()
+
+        def watch(alias):
+            def wrapper(execute, sql, params, many, context):
+                started = time.perf_counter()
+                try:
+                    return execute(sql, params, many, context)
+                finally:
+                    elapsed_ms = (time.perf_counter() - started) * 1000
+                    if elapsed_ms >= threshold:
+                        view, location = _view_name(request), _location()
+                        logger.warning(
+                            'Slow query (%.0f ms) in %s at %s: %s %s',
+                            elapsed_ms, view, location, normalize(sql), params_shape(params, many),
+                        )
+                        if len(slow) < limit:
+                            slow.append((alias, sql, params, many, elapsed_ms, view, location))
+            return wrapper
+
+        try:
+            with ExitStack() as stack:
+                for alias in connections:
+                    stack.enter_context(connections[alias].execute_wrapper(watch(alias)))
+                return self.get_response(request)
+        finally:
+            if slow:
+                recorder.submit(slow)
@@ -0,0 +1,104 @@
+"""Tuning for clinics that run on the SQLite fallback database.
+
+Several gunicorn workers writing to one SQLite file used to fail with
+"database is locked". Three things address that:
+
+* ``configure_connection`` runs on ``connection_created`` (see
+  ``clinic.signals``) and sets the ``SQLITE_PRAGMAS``: a WAL journal so
+  readers never block the writer, a ``busy_timeout`` so a writer waits for
+  the lock instead of failing at once, ``synchronous=NORMAL`` (safe with
+  WAL), a memory map and a larger page cache.
+* ``settings.py`` opens SQLite transactions with ``BEGIN IMMEDIATE``. The
+  write lock is then taken at the start of ``atomic()``, where
+  ``busy_timeout`` can wait for it. A deferred transaction that upgrades
+  to a writer later fails at once, whatever the timeout.
+* ``retry_on_lock`` reruns a write path in a fresh transaction, with
+  backoff, if the lock still can't be had after the busy timeout.
+
+On other database backends all of this does nothing.
+"""
+import functools
+import logging
+import random
+import time
+
+from django.conf import settings
+from django.db import DEFAULT_DB_ALIAS, OperationalError, connections, transaction
+
+logger = logging.getLogger(__name__)
+
+DEFAULT_PRAGMAS = {
+    'journal_mode': 'WAL',
+    'busy_timeout': 5000,          # ms
+    'synchronous': 'NORMAL',
+    'mmap_size': 256 * 1024 * 1024,
+    'cache_size': -20000,          # negative means KiB, so about 20 MB
+}
+
+
+def pragmas():
+    """``DEFAULT_PRAGMAS`` updated with ``SQLITE_PRAGMAS``; a value of None drops that pragma."""
+    merged = {**DEFAULT_PRAGMAS, **getattr(settings, 'SQLITE_PRAGMAS', {})}
+    return {name: value for name, value in merged.items() if value is not None}
+
+
+def lock_retries():
+    return getattr(settings, 'SQLITE_LOCK_RETRIES', 5)
+
+
+def lock_backoff():
+    """Delay before the first retry, in seconds; it doubles on each attempt."""
+    return getattr(settings, 'SQLITE_LOCK_BACKOFF', 0.05)
+
+
+def configure_connection(sender, connection, **kwargs):
+    """``connection_created`` receiver: apply the pragmas to new SQLite connections."""
+    if connection.vendor != 'sqlite':
+        return
+    wanted = pragmas()
+    if connection.is_in_memory_db():
+        # WAL and mmap need a file; the test database is in memory
+        wanted.pop('journal_mode', None)
+        wanted.pop('mmap_size', None)
+    with connection.cursor() as cursor:
+        for name, value in wanted.items():
+            cursor.execute(f'PRAGMA {name} = {value}')
+
+
+def is_lock_error(exc):
+    message = str(exc).lower()
+    return isinstance(exc, OperationalError) and ('locked' in message or 'busy' in message)
+
+
+def retry_on_lock(func=None, *, using=DEFAULT_DB_ALIAS):
+    """Run ``func`` in a transaction, retrying with backoff if SQLite reports a lock.
+
+    The whole call is one transaction, so a retry never leaves half a write
+    behind. Inside an outer ``atomic()`` block there is nothing safe to
+    retry, so the error is raised as usual.
+    """
+    if func is None:
+        return functools.partial(retry_on_lock, using=using)
+
+    @functools.wraps(func)
+    def wrapper(*args, **kwargs):
+        connection = connections[using]
+        attempt = 0
+        while True:
+            try:
+                with transaction.atomic(using=using):
+                    return func(*args, **kwargs)
+            except OperationalError as exc:
+                if (
+                    connection.vendor != 'sqlite'
+                    or connection.in_atomic_block
+                    or not is_lock_error(exc)
+                    or attempt >= lock_retries()
+                ):
+                    raise
+                delay = lock_backoff() * (2 ** attempt)
+                attempt += 1
+                logger.warning('SQLite locked in %s, retry %d in %.2fs', func.__qualname__, attempt, delay)
+                # Jitter keeps workers that collided from retrying in lockstep
+                time.sleep(delay * random.uniform(0.5, 1.5))
+    return wrapper
@@ -0,0 +1,212 @@
+"""Once-per-deploy startup tasks, shared by all worker processes.
+
+``wsgi.py`` used to run ``migrate``, ``collectstatic`` and an admin
+password reset (PBKDF2, about a second of CPU) in every gunicorn worker,
+all at once. ``run_startup_tasks`` does each task only when its input
+has changed since the last run:
+
+* migrate: when the set of migration files on disk, or the database they
+  are applied to, is different;
+* collectstatic: when any static source file is added, removed or
+  modified, or ``STATIC_ROOT`` is missing;
+* admin upsert: when ``ADMIN_USERNAME``/``ADMIN_EMAIL``/``ADMIN_PASSWORD``
+  change. Only an HMAC of them is stored.
+
+Every start also resumes the invoice archival cascades that a killed or
+recycled worker left unfinished (``clinic.archival``), after the tasks so
+the table exists.
+
+What was done is recorded in ``STARTUP_STATE_DIR/.startup-state.json``
+(default: the project directory). A worker that finds everything up to
+date returns after computing the fingerprints and one query for
+unfinished archival jobs, in about 25 ms. Otherwise it takes an exclusive lock on
+``.startup.lock`` in the same directory. The first worker to get the
+lock does the work, and the others wait for it, re-read the state and
+find nothing left to do. A task that fails is not recorded, so the next
+start tries it again.
+
+On platforms without ``fcntl`` (Windows, where only the development
+server runs) there is no lock.
+"""
+import hashlib
+import json
+import logging
+import os
+from contextlib import contextmanager
+from pathlib import Path
+
+from django.conf import settings
+from django.core.management import call_command
+from django.db import DatabaseError
+from django.utils.crypto import salted_hmac
+
+try:
+    import fcntl
+except ImportError:  # Windows
+    fcntl = None
+
+logger = logging.getLogger('startup')
+
+STATE_FILE = '.startup-state.json'
+LOCK_FILE = '.startup.lock'
+
+
+def state_dir():
+    return Path(getattr(settings, 'STARTUP_STATE_DIR', settings.BASE_DIR))
+
+
+def _digest(parts):
+    return hashlib.sha256('\n'.join(parts).encode()).hexdigest()
+
+
+def migrations_fingerprint():
+    """Migration files on disk plus the database they go to; no database access."""
+    from django.db.migrations.loader import MigrationLoader
+
+    loader = MigrationLoader(None, ignore_no_migrations=True)
+    database = settings.DATABASES['default']
+    target = [str(database.get(key, '')) for key in ('ENGINE', 'NAME', 'HOST', 'PORT')]
+    return _digest(target + sorted(f'{app}.{name}' for app, name in loader.disk_migrations))
+
+
+def static_fingerprint():
+    """Name, size and mtime of every file collectstatic would copy."""
+    from django.contrib.staticfiles import finders
+
+    if not settings.STATIC_ROOT or not os.path.isdir(settings.STATIC_ROOT):
+        return None  # never collected here: always run
+    entries = []
+    for finder in finders.get_finders():
+        for path, storage in finder.list(['CVS', '.*', '*~']):
+            stat = os.stat(storage.path(path))
+            entries.append(f'{path}:{stat.st_size}:{stat.st_mtime_ns}')
+    return _digest(sorted(entries))
+
+
+def admin_credentials():
+    names = ('ADMIN_USERNAME', 'ADMIN_EMAIL', 'ADMIN_PASSWORD')
+    values = [os.getenv(name) for name in names]
+    return values if all(values) else None
+
+
+def admin_fingerprint():
+    credentials = admin_credentials()
+    if credentials is None:
+        return 'create_superuser'
+    return salted_hmac('clinic.startup.admin', '\n'.join(credentials)).hexdigest()
+
+
+def expected_state():
+    return {
+        'migrate': migrations_fingerprint(),
+        'collectstatic': static_fingerprint(),
+        'admin': admin_fingerprint(),
+    }
+
+
+def read_state():
+    try:
+        return json.loads((state_dir() / STATE_FILE).read_text())
+    except (OSError, ValueError):
+        return {}
+
+
+def write_state(state):
+    path = state_dir() / STATE_FILE
+    temporary = path.with_suffix('.tmp')
+    temporary.write_text(json.dumps(state, indent=2))
+    os.replace(temporary, path)
+
+
+@contextmanager
+def exclusive_lock():
+    """Block until this process holds the startup lock."""
+    if fcntl is None:
+        yield
+        return
+    directory = state_dir()
+    directory.mkdir(parents=True, exist_ok=True)
+    with open(directory / LOCK_FILE, 'w') as handle:
+        fcntl.flock(handle, fcntl.LOCK_EX)
+        try:
+            yield
+        finally:
+            fcntl.flock(handle, fcntl.LOCK_UN)
+
+
+def upsert_admin():
+    credentials = admin_credentials()
+    if credentials is None:
+        call_command('create_superuser', verbosity=0)
+        return
+    from django.contrib.auth import get_user_model
+
+    username, email, password = credentials
+    User = get_user_model()
+    user, _ = User.objects.get_or_create(username=username, defaults={'email': email})
+    user.is_staff = True
+    user.is_superuser = True
+    user.email = email
+    user.set_password(password)
+    user.save()
+    logger.info('[startup] Admin user created/updated: %s', username)
+
+
+def resume_archival_jobs():
+    """Restart unfinished archival cascades in background threads; returns their ids."""
+    from .archival import resume_in_background
+
+    try:
+        started = resume_in_background()
+    except DatabaseError:
+        logger.exception('[startup] Could not resume archival jobs')
+        return []
+    if started:
+        logger.info('[startup] Resumed %d archival job(s): %s', len(started), started)
+    return started
+
+
+TASKS = [
+    ('migrate', lambda: call_command('migrate', '--noinput', verbosity=0)),
+    ('collectstatic', lambda: call_command('collectstatic', '--noinput', verbosity=0)),
+    ('admin', upsert_admin),
+]
+
+
+def _stale(state, expected):
+    return [name for name, _ in TASKS if expected[name] is None or state.get(name) != expected[name]]
+
+
+def run_startup_tasks():
+    """Run the startup tasks whose inputs changed; returns the names of the tasks run."""
+    expected = expected_state()
+    if not _stale(read_state(), expected):
+        logger.info('[startup] Up to date, nothing to do.')
+        with exclusive_lock():
+            resume_archival_jobs()
+        return []
+
+    with exclusive_lock():
+        # Another worker may have done the work while we waited for the lock
+        # (and created STATIC_ROOT), so look again
+        expected = expected_state()
+        state = read_state()
+        stale = _stale(state, expected)
+        if not stale:
+            logger.info('[startup] Done by another worker.')
+        for name, task in TASKS:
+            if name not in stale:
+                continue
+            logger.info('[startup] Running %s...', name)
+            try:
+                task()
+            except Exception:
+                # Leave it unrecorded so the next start tries again
+                logger.exception('[startup] %s failed', name)
+                continue
+            if name == 'collectstatic':
+                expected[name] = static_fingerprint()
+            state[name] = expected[name]
+            write_state(state)
+        resume_archival_jobs()
+        return stale
@@ -1,3 +1,1427 @@
-from django.test import TestCase
+import io
+import json
+import os
+import shutil
+import sqlite3
+import subprocess
+import sys
+import tempfile
+import threading
+import unittest
+from unittest import mock
+from datetime import timedelta
+from decimal import Decimal
 
-# Create your tests here.
+from django.conf import settings
+from django.core.cache import cache
+from django.core.management import CommandError, call_command
+from django.http import HttpResponse
+from django.test import RequestFactory, SimpleTestCase, TestCase, override_settings
+from django.contrib.auth.models import Permission, User
+from django.db import connection
+from django.db.models import Count, Max, Sum
+from django.db.models.deletion import Collector
+from django.test.utils import CaptureQueriesContext
+from django.urls import URLResolver, get_resolver, reverse
+from django.utils import timezone
+from rest_framework.authtoken.models import Token
+from . import benchmarks, kpis, metrics, startup
+from .admin import custom_admin_site
+from .catalog import ServiceCatalog, service_catalog
+from .archival import _next_batch, cancel_cascades, resumable_jobs, run_job, start_cascade
+from .forms import InvoiceForm
+from .views import select_services
+from .duplicates import DEFAULT_THRESHOLD, PatientRecord, blocking_keys, merge_patients, score_pair, soundex
+from .cold_storage import move_archived_invoices, thaw_invoice
+from .models import LINE_TOTAL_CENTAVOS, ArchivalJob, ArchivedInvoice, DuplicateSuggestion, Patient, Service, Invoice, InvoiceItem, ReplicaPin, SlowQuery, StaffProfile
+from .money import Money, format_centavos, to_centavos
+from .pagination import ApproximateCountPaginator, estimate_count
+from .query_budgets import QUERY_BUDGETS, UNBUDGETED
+from .reports import staff_activity_report
+from .phone import key_upper_bound, normalize_phone, phone_key, suffix_key
+from .search import MAX_SCAN, PatientPrefixIndex, patient_index
+from .slow_queries import Recorder, fingerprint, normalize, recorder
+from .routers import ReplicaPinMiddleware, ReplicaRouter, reads_from_replica, use_replica
+
+
+class StaffListQueryBudgetTests(TestCase):
+    """staff_list must not issue per-staff or per-invoice queries"""
+    QUERY_BUDGET = 6
+
+    def setUp(self):
+        self.admin = User.objects.create_superuser('admin', 'admin@example.com', 'admin-pass-123')
+        self.client.force_login(self.admin)
+        self.service = Service.objects.create(category='CLEANING', name='Cleaning', price=800)
+
+    def _seed_staff(self, count, invoices_each=3):
+        for n in range(count):
+            user = User.objects.create_user(f'staff{User.objects.count()}', is_staff=True)
+            StaffProfile.objects.create(user=user, position='assistant', approved=True)
+            patient = Patient.objects.create(first_name='P', last_name=str(n), created_by=user)
+            for _ in range(invoices_each):
+                invoice = Invoice.objects.create(patient=patient, created_by=user)
+                InvoiceItem.objects.create(invoice=invoice, service=self.service, quantity=2)
+
+    def _get_staff_list(self):
+        with CaptureQueriesContext(connection) as ctx:
+            response = self.client.get(reverse('clinic:staff_list'))
+        self.assertEqual(response.status_code, 200)
+        return response, len(ctx)
+
+    def test_query_count_does_not_grow_with_staff(self):
+        self._seed_staff(1)
+        _, small = self._get_staff_list()
+        self._seed_staff(10, invoices_each=5)
+        response, large = self._get_staff_list()
+
+        self.assertEqual(small, large)
+        self.assertLessEqual(large, self.QUERY_BUDGET)
+        self.assertEqual(len(response.context['staff_data']), 11)
+
+    def test_totals_match_invoice_amounts(self):
+        self._seed_staff(2)
+        archived = Invoice.objects.first()
+        archived.is_archived = True
+        archived.save()
+
+        response, _ = self._get_staff_list()
+
+        expected = sum(inv.total_amount() for inv in Invoice.objects.filter(is_archived=False))
+        self.assertEqual(response.context['total_sales_amount'], expected)
+        self.assertEqual(response.context['total_invoices_count'], 5)
+
+
+@unittest.skipUnless(connection.vendor == 'sqlite', 'SQLite tuning only applies to SQLite')
+class SQLiteConcurrentWriteTests(SimpleTestCase):
+    """Several processes inserting invoices into one SQLite file must not hit "database is locked"."""
+
+    def _manage(self, db_path, *args):
+        env = {**os.environ, 'DATABASE_URL': f'sqlite:///{db_path}', 'DJANGO_DEBUG': 'True'}
+        return subprocess.run(
+            [sys.executable, str(settings.BASE_DIR / 'manage.py'), *args],
+            env=env, capture_output=True, text=True, timeout=300,
+        )
+
+    def test_concurrent_invoice_inserts(self):
+        with tempfile.TemporaryDirectory() as tmp:
+            db_path = os.path.join(tmp, 'db.sqlite3')
+            migrate = self._manage(db_path, 'migrate', '-v0')
+            self.assertEqual(migrate.returncode, 0, migrate.stderr)
+
+            result = self._manage(db_path, 'stress_sqlite_writes', '--workers', '6', '--invoices', '40')
+
+            self.assertEqual(result.returncode, 0, result.stdout + result.stderr)
+            self.assertIn('invoices: 240 ', result.stdout)
+            self.assertIn('errors: 0', result.stdout)
+            with sqlite3.connect(db_path) as db:
+                self.assertEqual(db.execute('PRAGMA journal_mode').fetchone()[0], 'wal')
+
+
+class StartupTasksTests(SimpleTestCase):
+    """Workers starting together run migrate/collectstatic/admin once; later starts skip them."""
+
+    def _start_workers(self, tmp, count):
+        env = {
+            **os.environ,
+            'DATABASE_URL': f'sqlite:///{tmp}/db.sqlite3',
+            'DJANGO_DEBUG': 'True',
+            'STARTUP_STATE_DIR': tmp,
+            'STATIC_ROOT': os.path.join(tmp, 'static'),
+            'ADMIN_USERNAME': 'boss',
+            'ADMIN_EMAIL': 'boss@example.com',
+            'ADMIN_PASSWORD': 'boss-pass-123',
+            'RUN_STARTUP_TASKS': 'True',
+        }
+        workers = [
+            subprocess.Popen(
+                [sys.executable, '-c', 'import dental_clinic.wsgi'],
+                cwd=settings.BASE_DIR, env=env, stderr=subprocess.PIPE, text=True,
+            )
+            for _ in range(count)
+        ]
+        return [worker.communicate(timeout=300)[1] for worker in workers]
+
+    def test_tasks_run_once_across_workers(self):
+        with tempfile.TemporaryDirectory() as tmp:
+            logs = self._start_workers(tmp, 4)
+
+            self.assertEqual(sum('Running migrate' in log for log in logs), 1, logs)
+            self.assertEqual(sum('Running collectstatic' in log for log in logs), 1, logs)
+            self.assertEqual(sum('Running admin' in log for log in logs), 1, logs)
+            self.assertFalse(any('failed' in log for log in logs), logs)
+            with sqlite3.connect(os.path.join(tmp, 'db.sqlite3')) as db:
+                self.assertEqual(
+                    db.execute("SELECT is_superuser FROM auth_user WHERE username = 'boss'").fetchone(), (1,),
+                )
+
+            [log] = self._start_workers(tmp, 1)
+            self.assertIn('Up to date', log)
+            self.assertNotIn('Running', log)
+
+
+class ImportTimeTests(SimpleTestCase):
+    """A cold start must not import the report libraries, and profile_imports enforces its budget."""
+
+    def test_report_libraries_are_lazy(self):
+        out = io.StringIO()
+        call_command('profile_imports', budget_ms=60_000, top=5, stdout=out)
+        self.assertIn('Cold start:', out.getvalue())
+        self.assertIn('dental_clinic.wsgi', out.getvalue())
+
+    def test_over_budget_fails(self):
+        with self.assertRaisesRegex(CommandError, 'over the 1 ms budget'):
+            call_command('profile_imports', budget_ms=1, top=0, stdout=io.StringIO())
+
+
+class ReplicaRoutingTests(TestCase):
+    """Report views read from the replica unless there is none or the user just wrote."""
+    WITH_REPLICA = {**settings.DATABASES, 'replica': {**settings.DATABASES['default']}}
+
+    def setUp(self):
+        cache.clear()
+        self.user = User.objects.create_user('staff', is_staff=True)
+        self.factory = RequestFactory()
+
+        @reads_from_replica
+        def report(request):
+            return HttpResponse(ReplicaRouter().db_for_read(Invoice) or 'default')
+        self.report = report
+
+    def _get(self, **cookies):
+        request = self.factory.get('/report/')
+        request.user = self.user
+        request.COOKIES.update(cookies)
+        return self.report(request).content.decode()
+
+    def test_no_replica_configured_uses_default(self):
+        self.assertEqual(self._get(), 'default')
+        with use_replica():
+            self.assertIsNone(ReplicaRouter().db_for_read(Invoice))
+
+    def test_reports_read_replica_until_user_writes(self):
+        with override_settings(DATABASES=self.WITH_REPLICA):
+            self.assertEqual(self._get(), 'replica')
+            self.assertEqual(ReplicaRouter().db_for_read(Invoice), None)
+
+            request = self.factory.post('/clinic/pos/')
+            request.user = self.user
+            response = ReplicaPinMiddleware(lambda r: HttpResponse(status=302))(request)
+
+            self.assertIn('replica_pin', response.cookies)
+            self.assertEqual(self._get(), 'default')
+            self.assertEqual(self._get(replica_pin='1'), 'default')
+
+    def test_pin_reaches_other_workers_without_cookie(self):
+        """An API client pinned by one worker reads the primary on another with its own cache."""
+        worker = lambda name: override_settings(CACHES={'default': {
+            'BACKEND': 'django.core.cache.backends.locmem.LocMemCache', 'LOCATION': name}})
+        with override_settings(DATABASES=self.WITH_REPLICA):
+            with worker('worker-a'):
+                request = self.factory.post('/api/invoices/')
+                request.user = self.user
+                ReplicaPinMiddleware(lambda r: HttpResponse(status=201))(request)
+            with worker('worker-b'):
+                cache.clear()
+                self.assertEqual(self._get(), 'default')
+                ReplicaPin.objects.update(pinned_until=timezone.now() - timedelta(seconds=1))
+                self.assertEqual(self._get(), 'replica')
+
+
+class BenchmarkCompareTests(SimpleTestCase):
+    def test_flags_slower_p95_and_extra_queries_only(self):
+        baseline = {'small': {
+            'dashboard': {'p95_ms': 10.0, 'queries': 2},
+            'staff_list': {'p95_ms': 100.0, 'queries': 3},
+            'receipt_pdf': {'p95_ms': 2.0, 'queries': 5},
+        }}
+        results = {'small': {
+            'dashboard': {'p95_ms': 11.0, 'queries': 2},      # within tolerance
+            'staff_list': {'p95_ms': 150.0, 'queries': 4},    # slower and chattier
+            'receipt_pdf': {'p95_ms': 4.0, 'queries': 5},     # doubled, but only by 2ms
+            'sales_analytics': {'p95_ms': 500.0, 'queries': 9},  # not in the baseline
+        }}
+
+        regressions = benchmarks.compare(results, baseline, tolerance=0.2)
+
+        self.assertEqual(regressions, [
+            'small/staff_list: p95 100.0ms -> 150.0ms',
+            'small/staff_list: queries 3 -> 4',
+        ])
+
+
+def _url_names(patterns, namespace=''):
+    for pattern in patterns:
+        if isinstance(pattern, URLResolver):
+            prefix = f'{namespace}{pattern.namespace}:' if pattern.namespace else namespace
+            yield from _url_names(pattern.url_patterns, prefix)
+        elif pattern.name:
+            yield namespace + pattern.name
+
+
+class QueryBudgetTests(TestCase):
+    """Every page stays within its budget in clinic.query_budgets, at any data size"""
+    # url name -> (url kwarg, sample object)
+    URL_OBJECTS = {
+        'clinic:patient_detail': ('pk', 'patient'),
+        'clinic:patient_update': ('pk', 'patient'),
+        'clinic:service_update': ('pk', 'service'),
+        'clinic:invoice_detail': ('pk', 'invoice'),
+        'clinic:invoice_update': ('pk', 'invoice'),
+        'clinic:invoice_pdf': ('pk', 'invoice'),
+        'api:patients-detail': ('pk', 'patient'),
+        'api:services-detail': ('pk', 'service'),
+        'api:invoices-detail': ('pk', 'invoice'),
+        'api:invoices-receipt-pdf': ('pk', 'invoice'),
+        'api:staff_detail': ('staff_id', 'user'),
+        'async_api:service_detail': ('pk', 'service'),
+        'async_api:invoice_detail': ('pk', 'invoice'),
+        'async_api:receipt_pdf': ('pk', 'invoice'),
+    }
+    URL_KWARGS = {'custom_admin:app_list': {'app_label': 'clinic'}}
+    QUERY_STRINGS = {
+        'clinic:patient_autocomplete': '?q=Ma',
+        'api:patients-lookup': '?phone=0912&match=suffix',
+    }
+
+    def setUp(self):
+        cache.clear()
+        admin = User.objects.create_superuser('budget-admin', 'budget@example.com', None)
+        # An approved profile lets the superuser through staff_required too
+        StaffProfile.objects.create(user=admin, position='dentist', approved=True)
+        self.client.defaults['HTTP_AUTHORIZATION'] = f'Token {Token.objects.create(user=admin).key}'
+        self.client.force_login(admin)
+
+    def _seed(self, seed, size):
+        call_command(
+            'generate_clinic_data', seed=seed, staff=size, patients=size * 4, invoices=size * 12,
+            archived_fraction=0.25, stdout=io.StringIO(),
+        )
+        Patient.objects.filter(pk__in=list(
+            Patient.objects.order_by('-pk').values_list('pk', flat=True)[:size // 2]
+        )).update(is_archived=True)
+        for n in range(size):
+            user = User.objects.create_user(f'pending{seed}-{n}', is_staff=True)
+            StaffProfile.objects.create(user=user, position='assistant', approved=False)
+        patients = list(Patient.all_objects.order_by('pk')[:size * 2])
+        for primary, duplicate in zip(patients[::2], patients[1::2]):
+            DuplicateSuggestion.objects.create(primary=primary, duplicate=duplicate, score=0.9, reasons='name')
+        for n in range(size):
+            SlowQuery.objects.create(
+                fingerprint=f'{seed}-{n}', normalized_sql='SELECT ?', sql='SELECT %s', explain='SCAN t',
+                occurrences=n + 1, total_ms=250.0 * (n + 1), max_ms=250.0,
+            )
+
+    def _samples(self):
+        # The busiest rows, so per-row queries would show up as growth
+        staff = StaffProfile.objects.with_activity_counts().order_by('-invoices_created').first()
+        return {
+            'patient': Patient.objects.with_invoice_stats().order_by('-invoices_count', '-pk').first(),
+            'invoice': Invoice.objects.annotate(n=Count('items')).order_by('-n', '-pk').first(),
+            'service': Service.objects.order_by('-pk').first(),
+            'staffprofile': staff,
+            'user': staff.user,
+            'duplicatesuggestion': DuplicateSuggestion.objects.order_by('-pk').first(),
+            'slowquery': SlowQuery.objects.first(),
+        }
+
+    def _url(self, name, samples):
+        kwargs = self.URL_KWARGS.get(name)
+        if name in self.URL_OBJECTS:
+            kwarg, sample = self.URL_OBJECTS[name]
+            kwargs = {kwarg: samples[sample].pk}
+        elif name.startswith('custom_admin:') and name.rsplit('_', 1)[1] in ('change', 'history'):
+            model = name.split(':')[1].rsplit('_', 1)[0].split('_', 1)[1]
+            kwargs = {'object_id': samples[model].pk}
+        return reverse(name, kwargs=kwargs) + self.QUERY_STRINGS.get(name, '')
+
+    def _query_counts(self):
+        samples = self._samples()
+        counts = {}
+        for name in QUERY_BUDGETS:
+            url = self._url(name, samples)
+            self.client.get(url)  # warm up first-use caches
+            with CaptureQueriesContext(connection) as queries:
+                response = self.client.get(url)
+            self.assertLess(response.status_code, 400, name)
+            counts[name] = len(queries)
+        return counts
+
+    def test_pages_stay_within_budget_as_data_grows(self):
+        self._seed(1, 3)
+        small = self._query_counts()
+        self._seed(2, 12)
+        large = self._query_counts()
+
+        for name, budget in QUERY_BUDGETS.items():
+            with self.subTest(name):
+                self.assertEqual(large[name], small[name], 'query count grows with data')
+                self.assertLessEqual(large[name], budget)
+
+    def test_every_url_is_budgeted_or_exempt(self):
+        names = set(_url_names(get_resolver().url_patterns))
+        self.assertEqual(names - set(QUERY_BUDGETS) - set(UNBUDGETED), set())
+        self.assertEqual((set(QUERY_BUDGETS) | set(UNBUDGETED)) - names, set())
+
+
+class ProfilingMiddlewareTests(TestCase):
+    def setUp(self):
+        self.admin = User.objects.create_superuser('admin', 'admin@example.com', 'admin-pass-123')
+        self.profile_dir = tempfile.mkdtemp()
+        self.addCleanup(shutil.rmtree, self.profile_dir)
+
+    def _timing(self, response):
+        return dict(
+            entry.split(';', 1) for entry in response['Server-Timing'].split(', ')
+        )
+
+    def test_off_by_default(self):
+        self.client.force_login(self.admin)
+        response = self.client.get(reverse('clinic:dashboard'))
+        self.assertNotIn('Server-Timing', response)
+
+    def test_reports_sql_template_and_total_time(self):
+        self.client.force_login(self.admin)
+        with self.settings(PROFILING_ENABLED=True, PROFILING_DIR=self.profile_dir):
+            with CaptureQueriesContext(connection) as queries:
+                response = self.client.get(reverse('clinic:dashboard'))
+
+        timing = self._timing(response)
+        self.assertEqual(set(timing), {'db', 'tpl', 'app', 'total'})
+        self.assertIn(f'desc="{len(queries)} queries"', timing['db'])
+        self.assertGreater(float(timing['tpl'].split('=')[1]), 0)
+        self.assertEqual(os.listdir(self.profile_dir), [])
+
+    def test_profile_header_needs_the_token(self):
+        with self.settings(PROFILING_ENABLED=True, PROFILING_DIR=self.profile_dir):
+            with mock.patch('clinic.profiling.cProfile.Profile') as profile:
+                response = self.client.get(reverse('clinic:login'), HTTP_X_PROFILE='1')
+                self.assertNotIn('prof', self._timing(response))
+                with self.settings(PROFILING_TOKEN='s3cret'):
+                    response = self.client.get(reverse('clinic:login'), HTTP_X_PROFILE='1')
+                    self.assertNotIn('prof', self._timing(response))
+            # Rejected before a profiler was even created
+            profile.assert_not_called()
+
+            self.client.force_login(self.admin)
+            with self.settings(PROFILING_TOKEN='s3cret'):
+                response = self.client.get(reverse('clinic:dashboard'), HTTP_X_PROFILE='s3cret')
+
+        name = self._timing(response)['prof'].split('"')[1]
+        self.assertEqual(os.listdir(self.profile_dir), [name])
+        self.assertTrue(name.endswith('.prof'))
+
+    def test_busy_profiler_skips_the_dump(self):
+        with self.settings(PROFILING_ENABLED=True, PROFILING_DIR=self.profile_dir, PROFILING_TOKEN='s3cret'):
+            with mock.patch('clinic.profiling.cProfile.Profile') as profile:
+                profile.return_value.enable.side_effect = ValueError('Another profiling tool is already active')
+                response = self.client.get(reverse('clinic:login'), HTTP_X_PROFILE='s3cret')
+
+        self.assertEqual(response.status_code, 200)
+        self.assertEqual(set(self._timing(response)), {'db', 'tpl', 'app', 'total'})
+        profile.return_value.disable.assert_not_called()
+        self.assertEqual(os.listdir(self.profile_dir), [])
+
+
+class MetricsTests(TestCase):
+    def setUp(self):
+        self.admin = User.objects.create_superuser('admin', 'admin@example.com', 'admin-pass-123')
+
+    def _scrape(self, **extra):
+        return self.client.get(reverse('metrics'), **extra)
+
+    def test_records_requests_renders_and_cache_lookups(self):
+        self.client.force_login(self.admin)
+        self.client.get(reverse('clinic:dashboard'))
+        self.client.get(reverse('clinic:sales_summary_csv'))
+
+        body = self._scrape().content.decode()
+
+        self.assertIn(
+            'clinic_http_request_duration_seconds_count{view="clinic:dashboard",method="GET",status="200"}', body
+        )
+        self.assertIn('clinic_render_duration_seconds_count{format="csv"}', body)
+        self.assertIn('clinic_db_query_duration_seconds_bucket{database="default",le="+Inf"}', body)
+        self.assertIn('clinic_cache_requests_total{cache="kpis",result="miss"}', body)
+        self.assertIn('clinic_archival_jobs{status="pending"} 0', body)
+
+    @override_settings(METRICS_TOKEN='scrape-me')
+    def test_staff_or_token_only(self):
+        self.assertEqual(self._scrape().status_code, 403)
+        self.assertEqual(self._scrape(HTTP_AUTHORIZATION='Bearer wrong').status_code, 403)
+        self.assertEqual(self._scrape(HTTP_AUTHORIZATION='Bearer scrape-me').status_code, 200)
+
+    def test_adds_up_snapshots_of_all_workers(self):
+        directory = tempfile.mkdtemp()
+        self.addCleanup(shutil.rmtree, directory)
+        metrics.CACHE_REQUESTS.inc(cache='test', result='hit')
+        with override_settings(METRICS_DIR=directory):
+            own = metrics.collect()['clinic_cache_requests'][('test', 'hit')]
+            other_worker = {'clinic_cache_requests': [[['test', 'hit'], 5]]}
+            with open(os.path.join(directory, 'metrics-1.json'), 'w') as fh:
+                json.dump(other_worker, fh)
+
+            merged = metrics.collect()['clinic_cache_requests'][('test', 'hit')]
+
+        self.assertEqual(merged, own + 5)
+        self.assertIn(f'metrics-{os.getpid()}.json', os.listdir(directory))
+
+
+class SlowQueryLogTests(TestCase):
+    def setUp(self):
+        self.admin = User.objects.create_superuser('admin', 'admin@example.com', 'admin-pass-123')
+        self.client.force_login(self.admin)
+
+    def test_normalize_ignores_values_and_in_list_length(self):
+        a = normalize("SELECT * FROM t WHERE id IN (%s, %s, %s) AND name = 'Ana' LIMIT 21")
+        b = normalize("SELECT *\n  FROM t WHERE id IN (%s) AND name = 'Bea' LIMIT 5")
+        self.assertEqual(a, 'SELECT * FROM t WHERE id IN (...) AND name = ? LIMIT ?')
+        self.assertEqual(fingerprint(a), fingerprint(b))
+
+    @override_settings(SLOW_QUERY_MS=0.0001)
+    # Save in this thread, inside the test's transaction
+    @mock.patch.object(recorder, 'submit', recorder.save)
+    def test_records_each_fingerprint_once_with_its_plan(self):
+        patient = Patient.objects.create(first_name='Ana', last_name='Cruz')
+        with self.assertLogs('clinic.slow_queries', 'WARNING'):
+            self.client.get(reverse('clinic:patient_detail', args=[patient.pk]))
+
+        entry = SlowQuery.objects.get(normalized_sql__contains='FROM "clinic_patient" WHERE "clinic_patient"."id" = ?')
+        self.assertEqual(entry.occurrences, 1)
+        self.assertEqual(entry.view, 'clinic:patient_detail')
+        self.assertIn('clinic/views.py', entry.location)
+        self.assertEqual(entry.params_shape, '(int)')
+        self.assertIn('SEARCH', entry.explain)
+
+        with self.assertLogs('clinic.slow_queries', 'WARNING'):
+            self.client.get(reverse('clinic:patient_detail', args=[patient.pk]))
+        entry.refresh_from_db()
+        self.assertEqual(entry.occurrences, 2)
+
+    @override_settings(SLOW_QUERY_MS=0.0001, SLOW_QUERY_MAX_PER_REQUEST=2)
+    def test_request_hands_at_most_the_cap_to_the_recorder(self):
+        with mock.patch.object(recorder, 'submit') as submit, self.assertLogs('clinic.slow_queries', 'WARNING') as logs:
+            self.client.get(reverse('clinic:dashboard'))
+        submit.assert_called_once()
+        self.assertEqual(len(submit.call_args.args[0]), 2)
+        self.assertGreater(len(logs.records), 2)
+        self.assertFalse(SlowQuery.objects.exists())
+
+    def test_admin_page_is_superuser_only(self):
+        url = reverse('admin:clinic_slowquery_changelist')
+        self.assertEqual(self.client.get(url).status_code, 200)
+
+        staff = User.objects.create_user('staff', is_staff=True)
+        staff.user_permissions.add(*Permission.objects.filter(codename__endswith='slowquery'))
+        self.client.force_login(staff)
+        self.assertEqual(self.client.get(url).status_code, 403)
+
+
+class SlowQueryRecorderTests(SimpleTestCase):
+    def test_saves_on_a_background_thread(self):
+        threads = []
+        background = Recorder()
+        with mock.patch('clinic.slow_queries.record', side_effect=lambda *entry: threads.append(threading.current_thread().name)):
+            background.submit([('default', 'SELECT 1', (), False, 250.0, 'v', '')] * 2)
+            background.join()
+        self.assertEqual(threads, ['slow-query-recorder'] * 2)
+
+    def test_drops_requests_when_the_queue_is_full(self):
+        class Small(Recorder):
+            MAX_PENDING = 1
+
+        background = Small()
+        entry = ('default', 'SELECT 1', (), False, 250.0, 'v', '')
+        with mock.patch('clinic.slow_queries.threading.Thread'):
+            background.submit([entry])
+            with self.assertLogs('clinic.slow_queries', 'WARNING') as logs:
+                background.submit([entry])
+        self.assertIn('queue is full', logs.output[0])
+
+
+class AsyncApiTests(TestCase):
+    """The /api/async/ views answer like the DRF views they mirror."""
+
+    def setUp(self):
+        user = User.objects.create_user('mobile', password='mobile-pass-123')
+        self.headers = {'Authorization': f'Token {Token.objects.create(user=user).key}'}
+        self.client.defaults['HTTP_AUTHORIZATION'] = self.headers['Authorization']
+        service = Service.objects.create(category='CLEANING', name='Cleaning', price=800)
+        patient = Patient.objects.create(first_name='Ana', last_name='Cruz')
+        for paid in (True, True, False):
+            invoice = Invoice.objects.create(patient=patient, is_paid=paid)
+            InvoiceItem.objects.create(
+                invoice=invoice, service=service, quantity=2,
+                price_at_time=service.price, service_name_at_time=service.name,
+            )
+        self.invoice = invoice
+
+    def test_same_json_as_the_sync_api(self):
+        pairs = [
+            (reverse('api:services-list'), reverse('async_api:services')),
+            (reverse('api:invoices-list'), reverse('async_api:invoices')),
+            (reverse('api:invoices-detail', args=[self.invoice.pk]), reverse('async_api:invoice_detail', args=[self.invoice.pk])),
+        ]
+        for sync_url, async_url in pairs:
+            self.assertEqual(self.client.get(async_url).content, self.client.get(sync_url).content, async_url)
+
+        page = self.client.get(reverse('async_api:invoices') + '?page=1&page_size=2').json()
+        self.assertEqual((page['count'], len(page['results'])), (3, 2))
+        self.assertTrue(page['next'].endswith('/api/async/invoices/?page=2&page_size=2'))
+
+    def test_receipt_and_sales_summary(self):
+        response = self.client.get(reverse('async_api:receipt_pdf', args=[self.invoice.pk]))
+        self.assertEqual(response['Content-Type'], 'application/pdf')
+        self.assertTrue(response.content.startswith(b'%PDF'))
+
+        summary = self.client.get(reverse('async_api:sales_summary')).json()
+        self.assertEqual(
+            (summary['total_invoices'], summary['paid_invoices'], summary['unpaid_invoices'], summary['total_sales']),
+            (3, 2, 1, '4800.00'),
+        )
+        self.assertEqual(self.client.get(reverse('async_api:sales_summary') + '?start=May').status_code, 400)
+
+    def test_authentication(self):
+        url = reverse('async_api:services')
+        self.assertEqual(self.client.get(url, HTTP_AUTHORIZATION='').status_code, 401)
+        response = self.client.get(url, HTTP_AUTHORIZATION='Token wrong')
+        self.assertEqual((response.status_code, response.json()), (401, {'detail': 'Invalid token.'}))
+        self.assertEqual(self.client.post(url).status_code, 405)
+
+    async def test_runs_on_the_event_loop(self):
+        response = await self.async_client.get(reverse('async_api:invoices'), headers=self.headers)
+        self.assertEqual(len(response.json()), 3)
+
+
+class PosCheckoutTests(TestCase):
+    """POS checkout snapshots prices in bulk, keeps the KPIs right and ignores catalog size."""
+
+    def setUp(self):
+        staff = User.objects.create_user('pos', is_staff=True)
+        StaffProfile.objects.create(user=staff, position='dentist', approved=True)
+        self.client.force_login(staff)
+        self.patient = Patient.objects.create(first_name='Ana', last_name='Cruz')
+        self.cleaning = Service.objects.create(category='CLEANING', name='Cleaning', price=800)
+        self.filling = Service.objects.create(category='FILLING', name='Filling', price=1500)
+        kpis.reconcile()
+
+    def _checkout(self, quantities):
+        data = {f'service_{pk}': qty for pk, qty in quantities.items()}
+        data['patient_id'] = self.patient.pk
+        return self.client.post(reverse('clinic:staff_pos'), data)
+
+    def test_items_and_counters(self):
+        archived = Service.objects.create(category='CLEANING', name='Old', price=1, is_archived=True, active=False)
+        response = self._checkout({self.cleaning.pk: 2, self.filling.pk: 1, archived.pk: 5, 999999: 1})
+        invoice = Invoice.objects.get()
+        self.assertRedirects(response, reverse('clinic:invoice_detail', args=[invoice.pk]), fetch_redirect_response=False)
+
+        items = list(invoice.items.order_by('pk').values_list('service_name_at_time', 'price_at_time', 'quantity'))
+        self.assertEqual(items, [('Cleaning', 800, 2), ('Filling', 1500, 1)])
+        self.assertEqual(invoice.total_amount(), 3100)
+        self.assertEqual(kpis.reconcile(dry_run=True), [])
+
+    def test_queries_do_not_grow_with_the_catalog(self):
+        lines = {self.cleaning.pk: 1, self.filling.pk: 3}
+        self._checkout(lines)  # creates today's sales counter
+        with CaptureQueriesContext(connection) as small:
+            self._checkout(lines)
+        Service.objects.bulk_create(Service(category='CLEANING', name=f'Extra {n}', price=10) for n in range(200))
+        with CaptureQueriesContext(connection) as large:
+            self._checkout(lines)
+        self.assertEqual(len(large), len(small))
+
+
+class ServiceCatalogTests(TestCase):
+    """The POS and services API read the cached catalog, which follows service edits."""
+
+    def setUp(self):
+        staff = User.objects.create_user('pos', is_staff=True)
+        StaffProfile.objects.create(user=staff, position='dentist', approved=True)
+        self.client.force_login(staff)
+        self.token = Token.objects.create(user=staff).key
+        self.patient = Patient.objects.create(first_name='Ana', last_name='Cruz')
+        self.cleaning = Service.objects.create(category='CLEANING', name='Cleaning', price=800)
+        self.filling = Service.objects.create(category='FILLING', name='Filling', price=1500)
+
+    def _service_queries(self, func, table='clinic_service'):
+        with CaptureQueriesContext(connection) as queries:
+            response = func()
+        return response, [q['sql'] for q in queries if f'"{table}"' in q['sql']]
+
+    def _checkout(self, quantities):
+        data = {f'service_{pk}': qty for pk, qty in quantities.items()}
+        data['patient_id'] = self.patient.pk
+        return self.client.post(reverse('clinic:staff_pos'), data)
+
+    def test_pos_does_not_query_the_catalog(self):
+        self.client.get(reverse('clinic:staff_pos'))  # loads it
+        response, queries = self._service_queries(lambda: self.client.get(reverse('clinic:staff_pos')))
+        self.assertContains(response, 'Filling')
+        self.assertEqual(queries, [])
+        _, queries = self._service_queries(lambda: self._checkout({self.cleaning.pk: 2}))
+        self.assertEqual(queries, [])
+        # Checkout confirms the version once
+        _, versions = self._service_queries(lambda: self._checkout({self.cleaning.pk: 1}), 'clinic_catalogversion')
+        self.assertEqual(len(versions), 1)
+        item = InvoiceItem.objects.first()
+        self.assertEqual((item.service_name_at_time, item.price_at_time), ('Cleaning', 800))
+
+    def test_edit_reaches_a_process_with_its_own_cache(self):
+        """Two catalogs with separate caches stand for two workers."""
+        worker = lambda name: override_settings(CACHES={'default': {
+            'BACKEND': 'django.core.cache.backends.locmem.LocMemCache', 'LOCATION': name}})
+        first, second = ServiceCatalog(max_age=3600), ServiceCatalog(max_age=3600)
+        with worker('worker-a'):
+            self.assertEqual(first.get(self.cleaning.pk).price, 800)
+        with worker('worker-b'):
+            self.assertEqual(second.get(self.cleaning.pk).price, 800)
+            self.assertEqual(second.confirmed().get(self.cleaning.pk).price, 800)
+
+        with worker('worker-a'):
+            Service.objects.filter(pk=self.cleaning.pk).update(price=950, name='Deep cleaning')
+            first.changed()
+            self.assertEqual(first.get(self.cleaning.pk).price, 950)
+        with worker('worker-b'):
+            # Pages may show the old price until max_age; invoices never do
+            self.assertEqual(second.get(self.cleaning.pk).price, 800)
+            with second.confirming() as catalog:
+                self.assertEqual(catalog.get(self.cleaning.pk).price, 950)
+            self.assertEqual(second.get(self.cleaning.pk).name, 'Deep cleaning')
+
+    def test_pos_does_not_sell_a_service_deactivated_elsewhere(self):
+        self.client.get(reverse('clinic:staff_pos'))
+        # Another worker deactivates it; this one's copy is still fresh
+        Service.objects.filter(pk=self.filling.pk).update(active=False)
+        ServiceCatalog().changed()
+        self._checkout({self.cleaning.pk: 1, self.filling.pk: 1})
+        self.assertEqual(list(InvoiceItem.objects.values_list('service_name_at_time', flat=True)), ['Cleaning'])
+
+    def test_item_snapshot_ignores_a_stale_copy(self):
+        invoice = Invoice.objects.create(patient=self.patient)
+        add_cleaning = lambda: InvoiceItem.objects.create(invoice=invoice, service_id=self.cleaning.pk)
+        self.assertEqual(add_cleaning().price_at_time, 800)
+        Service.objects.filter(pk=self.cleaning.pk).update(price=900)
+        ServiceCatalog().changed()
+        self.assertEqual(add_cleaning().price_at_time, 900)
+
+    def test_edits_and_archiving_reach_the_catalog(self):
+        self.client.get(reverse('clinic:staff_pos'))
+        self.cleaning.price = 900
+        self.cleaning.name = 'Prophylaxis'
+        self.cleaning.save()
+        self.filling.is_archived = True
+        self.filling.save()
+
+        response = self.client.get(reverse('clinic:staff_pos'))
+        self.assertContains(response, 'Prophylaxis')
+        self.assertNotContains(response, 'Filling')
+        self._checkout({self.cleaning.pk: 1, self.filling.pk: 1})
+        self.assertEqual(
+            list(InvoiceItem.objects.values_list('service_name_at_time', 'price_at_time')), [('Prophylaxis', 900)],
+        )
+        api = self.client.get(reverse('api:services-list'), HTTP_AUTHORIZATION=f'Token {self.token}')
+        self.assertEqual([row['name'] for row in api.json()], ['Prophylaxis'])
+
+    def test_item_snapshot_uses_the_catalog(self):
+        kpis.reconcile()
+        invoice = Invoice.objects.create(patient=self.patient)
+        InvoiceItem.objects.create(invoice=invoice, service_id=self.filling.pk)
+        _, queries = self._service_queries(
+            lambda: InvoiceItem.objects.create(invoice=invoice, service_id=self.filling.pk, quantity=2)
+        )
+        self.assertEqual(queries, [])
+        self.assertEqual(invoice.total_amount(), 4500)
+        self.assertEqual(kpis.reconcile(dry_run=True), [])
+
+
+class PhoneLookupTests(TestCase):
+    """contact_key normalization, by_phone and the lookup/search API."""
+
+    def setUp(self):
+        user = User.objects.create_user('api')
+        self.client.defaults['HTTP_AUTHORIZATION'] = f'Token {Token.objects.create(user=user).key}'
+        self.juan = Patient.objects.create(first_name='Juan', last_name='Cruz', contact_number='0917 123 4567')
+        self.ana = Patient.objects.create(first_name='Ana', last_name='Reyes', contact_number='+63 918 765 4567')
+
+    def test_normalize_phone(self):
+        for raw in ('0917 123 4567', '09171234567', '+639171234567', '0063-917-123-4567', '639171234567'):
+            self.assertEqual(normalize_phone(raw), '9171234567', raw)
+        self.assertEqual(normalize_phone(''), '')
+        self.assertEqual(normalize_phone(None), '')
+        self.assertEqual(normalize_phone('12-34'), '1234')  # short input is kept as typed
+        self.assertEqual(phone_key('0917 123 4567'), '7654321719')
+        self.assertEqual(suffix_key('45 67'), '7654')
+        self.assertEqual(suffix_key('+63 917 123 4567'), '7654321719')
+
+    def test_key_upper_bound(self):
+        self.assertEqual(key_upper_bound('7654'), '7655')
+        self.assertEqual(key_upper_bound('7659'), '766')
+        self.assertIsNone(key_upper_bound('999'))
+
+    def test_by_phone_exact_and_suffix(self):
+        self.assertEqual(list(Patient.objects.by_phone('+639171234567')), [self.juan])
+        self.assertEqual(list(Patient.objects.by_phone('4567')), [])
+        self.assertEqual(set(Patient.objects.by_phone('4567', suffix=True)), {self.juan, self.ana})
+        self.assertEqual(list(Patient.objects.by_phone('765 4567', suffix=True)), [self.ana])
+        self.assertEqual(list(Patient.objects.by_phone('', suffix=True)), [])
+        nines = Patient.objects.create(first_name='Nine', contact_number='0917 999 9999')
+        self.assertEqual(list(Patient.objects.by_phone('9999', suffix=True)), [nines])
+
+    def test_lookup_endpoint(self):
+        url = reverse('api:patients-lookup')
+        response = self.client.get(url, {'phone': '4567', 'match': 'suffix'})
+        self.assertEqual(response.json()['count'], 2)
+        response = self.client.get(url, {'phone': '09171234567'})
+        self.assertEqual([row['id'] for row in response.json()['results']], [self.juan.pk])
+        self.assertEqual(self.client.get(url, {'phone': '4567', 'match': 'fuzzy'}).status_code, 400)
+        self.assertEqual(self.client.get(url, {'phone': '567', 'match': 'suffix'}).status_code, 400)
+
+    def test_search_matches_any_part_of_the_number(self):
+        url = reverse('api:patients-list')
+        for search, expected in (('0917', [self.juan.pk]), ('91', [self.juan.pk, self.ana.pk]),
+                                 ('123', [self.juan.pk]), ('+63 917 123 4567', [self.juan.pk])):
+            ids = sorted(row['id'] for row in self.client.get(url, {'search': search}).json())
+            self.assertEqual(ids, sorted(expected), search)
+
+    def test_backfill_contact_keys(self):
+        Patient.all_objects.update(contact_key='')
+        out = io.StringIO()
+        call_command('backfill_contact_keys', batch_size=1, stdout=out)
+        self.assertIn('Updated contact keys: 2', out.getvalue())
+        self.juan.refresh_from_db()
+        self.assertEqual(self.juan.contact_key, '7654321719')
+        call_command('backfill_contact_keys', stdout=out)
+        self.assertIn('Updated contact keys: 0', out.getvalue())
+
+
+class PatientPrefixIndexTests(TestCase):
+    """The POS autocomplete index follows patient saves, archiving and deletes."""
+
+    def setUp(self):
+        self.addCleanup(patient_index.invalidate)
+        self.patient = Patient.objects.create(first_name='Juan', last_name='Dela Cruz', contact_number='0917 123 4567')
+        patient_index.build()
+
+    def _ids(self, query):
+        return [record['id'] for record in patient_index.search(query)]
+
+    def test_search_by_name_words_and_phone(self):
+        self.assertEqual(self._ids('ju dela'), [self.patient.pk])
+        self.assertEqual(self._ids('0917 12'), [self.patient.pk])
+        self.assertEqual(self._ids('+63 917'), [self.patient.pk])
+        self.assertEqual(self._ids('ju santos'), [])
+
+    def test_follows_saves_archiving_and_deletes(self):
+        with self.captureOnCommitCallbacks(execute=True):
+            other = Patient.objects.create(first_name='Juana', last_name='Santos')
+        self.assertEqual(set(self._ids('juan')), {self.patient.pk, other.pk})
+
+        with self.captureOnCommitCallbacks(execute=True):
+            self.patient.first_name = 'Pedro'
+            self.patient.save()
+        self.assertEqual(self._ids('juan'), [other.pk])
+        self.assertEqual(self._ids('pedro'), [self.patient.pk])
+
+        with self.captureOnCommitCallbacks(execute=True):
+            self.patient.is_archived = True
+            self.patient.save()
+        self.assertEqual(self._ids('pedro'), [])
+
+        with self.captureOnCommitCallbacks(execute=True):
+            other.delete()
+        self.assertEqual(self._ids('juan'), [])
+
+    def test_scans_the_most_selective_word_newest_first(self):
+        oldest = Patient.objects.create(first_name='Maria', last_name='Santos')
+        Patient.objects.bulk_create(
+            Patient(first_name='Maria', last_name='Reyes') for _ in range(MAX_SCAN + 1)
+        )
+        newest = Patient.objects.create(first_name='Maria', last_name='Santos')
+        patient_index.build()
+
+        self.assertEqual(self._ids('maria santos'), [newest.pk, oldest.pk])
+        self.assertEqual(self._ids('sant mar'), [newest.pk, oldest.pk])
+        self.assertEqual(self._ids('maria')[0], newest.pk)
+        # Whole terms before longer ones
+        juana = Patient.objects.create(first_name='Juana', last_name='Reyes')
+        patient_index.update(juana)
+        self.assertEqual(self._ids('juan'), [self.patient.pk, juana.pk])
+
+    def test_changes_during_a_rebuild_are_kept(self):
+        archived = Patient.objects.create(first_name='Pedro', last_name='Reyes')
+        late = Patient(pk=archived.pk + 100, first_name='Lorna', last_name='Diaz')
+        record = PatientPrefixIndex._record
+        late_applied = []
+
+        def saved_meanwhile(*args):
+            # Another request commits while the rows are being read
+            if not late_applied:
+                late_applied.append(True)
+                archived.is_archived = True
+                patient_index.update(archived)
+                patient_index.update(late)
+            return record(*args)
+
+        with mock.patch.object(PatientPrefixIndex, '_record', staticmethod(saved_meanwhile)):
+            patient_index.build()
+        self.assertTrue(late_applied)
+        self.assertEqual(self._ids('pedro'), [])
+        self.assertEqual(self._ids('lorna'), [late.pk])
+
+    def test_edits_among_many_equal_names_keep_the_index_sorted(self):
+        unknown = Patient.objects.bulk_create(
+            Patient(first_name='Unknown', last_name='Patient') for _ in range(50)
+        )
+        patient_index.build()
+        middle, archived = unknown[25], unknown[10]
+        middle.first_name = 'Known'
+        patient_index.update(middle)
+        archived.is_archived = True
+        patient_index.update(archived)
+        patient_index.update(unknown[30])  # saved unchanged
+
+        entries = patient_index._entries
+        self.assertEqual(entries, sorted(entries))
+        self.assertEqual(len(entries), len(set(entries)))
+        unknown_ids = {pk for term, pk in entries if term == 'unknown'}
+        self.assertEqual(unknown_ids, {p.pk for p in unknown} - {middle.pk, archived.pk})
+        self.assertEqual(self._ids('known'), [middle.pk])
+
+
+class DuplicatePatientTests(TestCase):
+    """Blocking keys, pair scoring, the detection command and merging."""
+
+    def _record(self, pk, first, last, phone='', email=''):
+        return PatientRecord(pk, first, last, phone, email, None)
+
+    def test_soundex_and_blocking_keys(self):
+        self.assertEqual(soundex('Robert'), 'R163')
+        self.assertEqual(soundex('Rupert'), 'R163')
+        self.assertEqual(soundex('Ashcraft'), 'A261')
+        self.assertEqual(soundex('123'), '')
+        record = self._record(1, 'Juan', 'Cruz', phone='7654321719', email='juan@example.com')
+        self.assertEqual(
+            blocking_keys(record), ['phone:7654321719', 'email:juan@example.com', f'name:{soundex("Cruz")}{soundex("Juan")}'],
+        )
+        # placeholder names from the POS don't block on name
+        self.assertEqual(blocking_keys(self._record(2, 'Unknown', 'Patient')), [])
+
+    def test_score_pair(self):
+        juan = self._record(1, 'Juan', 'Cruz', phone='7654321719')
+        self.assertEqual(score_pair(juan, self._record(2, 'Juan', 'Cruz', phone='7654321719')), (1.0, ['phone', 'name']))
+        # family members share a phone, not a first name
+        score, reasons = score_pair(juan, self._record(3, 'Maria', 'Cruz', phone='7654321719'))
+        self.assertLess(score, DEFAULT_THRESHOLD)
+        self.assertEqual(reasons, ['phone'])
+        score, _ = score_pair(juan, self._record(4, 'Juan', 'Cruz', phone='1111111119'))
+        self.assertLess(score, DEFAULT_THRESHOLD)
+
+    def test_command_is_idempotent_and_merge_moves_invoices(self):
+        older = Patient.objects.create(first_name='Juan', last_name='Cruz', contact_number='09171234567')
+        newer = Patient.objects.create(first_name='Juan', last_name='Cruz', contact_number='+639171234567',
+                                       address='Makati')
+        Patient.objects.create(first_name='Maria', last_name='Santos', contact_number='09181112222')
+        invoice = Invoice.objects.create(patient=newer)
+
+        call_command('find_duplicate_patients', stdout=io.StringIO())
+        first_run = list(DuplicateSuggestion.objects.values_list('primary', 'duplicate', 'score', 'reasons'))
+        self.assertEqual(first_run, [(older.pk, newer.pk, 1.0, 'phone,name')])
+        call_command('find_duplicate_patients', stdout=io.StringIO())
+        self.assertEqual(list(DuplicateSuggestion.objects.values_list('primary', 'duplicate', 'score', 'reasons')), first_run)
+
+        merge_patients(older, newer)
+        invoice.refresh_from_db()
+        older.refresh_from_db()
+        newer.refresh_from_db()
+        self.assertEqual(invoice.patient, older)
+        self.assertEqual(older.address, 'Makati')
+        self.assertTrue(newer.is_archived)
+        self.assertFalse(DuplicateSuggestion.objects.exists())
+
+
+class StaffActivityReportTests(TestCase):
+    """The grouped staff activity report agrees with a row-by-row computation."""
+
+    def setUp(self):
+        self.service = Service.objects.create(category='CLEANING', name='Cleaning', price=Decimal('800.50'))
+        self.profiles = []
+        for n, patient_count in enumerate((12, 2, 0)):
+            user = User.objects.create_user(f'staff{n}', is_staff=True)
+            self.profiles.append(StaffProfile.objects.create(user=user, position='dentist', approved=True))
+            for p in range(patient_count):
+                patient = Patient.objects.create(
+                    first_name=f'P{p}', last_name=f'S{n}', created_by=user,
+                    created_at=timezone.now() - timedelta(days=p),
+                )
+                for i in range(p % 3):
+                    invoice = Invoice.objects.create(patient=patient, is_paid=bool(i % 2))
+                    InvoiceItem.objects.create(invoice=invoice, service=self.service, quantity=i + 1)
+        archived = Invoice.objects.filter(patient__created_by=self.profiles[0].user).first()
+        archived.is_archived = True
+        archived.save()
+
+    def _naive(self, profile):
+        patients = Patient.objects.filter(created_by=profile.user)
+        invoices = Invoice.objects.filter(patient__in=patients)
+        return {
+            'patients_added': patients.count(),
+            'total_invoices': invoices.count(),
+            'total_revenue': float(sum(invoice.total_amount() for invoice in invoices)),
+            'paid_invoices': invoices.filter(is_paid=True).count(),
+            'pending_invoices': invoices.filter(is_paid=False).count(),
+        }
+
+    def test_matches_naive_totals(self):
+        with self.assertNumQueries(6):
+            report = staff_activity_report()
+        self.assertEqual([entry['staff_id'] for entry in report], [p.pk for p in self.profiles])
+        for profile, entry in zip(self.profiles, report):
+            self.assertEqual(entry['statistics'], self._naive(profile), profile.user.username)
+            patients = Patient.objects.filter(created_by=profile.user).order_by('-created_at')[:10]
+            self.assertEqual([row['id'] for row in entry['recent_patients']], [p.pk for p in patients])
+            invoices = Invoice.objects.filter(patient__created_by=profile.user).order_by('-date_created')[:10]
+            self.assertEqual(
+                [(row['id'], row['amount']) for row in entry['recent_invoices']],
+                [(invoice.pk, invoice.total_amount()) for invoice in invoices],
+            )
+
+
+class AdminColumnTests(TestCase):
+    """Changelist columns computed in SQL agree with the per-row model methods."""
+
+    def setUp(self):
+        self.admin = User.objects.create_superuser('admin', 'admin@example.com', 'admin-pass-123')
+        self.request = RequestFactory().get('/admin/')
+        self.request.user = self.admin
+        cleaning = Service.objects.create(category='CLEANING', name='Cleaning', price=Decimal('800.25'))
+        filling = Service.objects.create(category='FILLING', name='Filling', price=1500)
+        staff = User.objects.create_user('staff', is_staff=True)
+        StaffProfile.objects.create(user=staff, position='dentist', approved=True)
+        for n in range(3):
+            patient = Patient.objects.create(first_name=f'P{n}', last_name='Cruz', created_by=staff)
+            for i in range(n):
+                invoice = Invoice.objects.create(patient=patient)
+                InvoiceItem.objects.create(invoice=invoice, service=cleaning, quantity=i + 1)
+                InvoiceItem.objects.create(invoice=invoice, service=filling, quantity=1)
+        Invoice.objects.create(patient=None)  # POS invoice without a patient
+        archived = Invoice.objects.filter(patient__first_name='P2').first()
+        archived.is_archived = True
+        archived.save()
+
+    def _rows(self, model):
+        model_admin = custom_admin_site._registry[model]
+        return model_admin, list(model_admin.get_queryset(self.request))
+
+    def test_invoice_totals(self):
+        model_admin, invoices = self._rows(Invoice)
+        self.assertEqual(len(invoices), Invoice.all_objects.count())
+        for invoice in invoices:
+            self.assertEqual(invoice.amount_total, invoice.total_amount(), invoice.pk)
+            self.assertIn(f'{float(invoice.total_amount()):,.2f}', model_admin.total_amount_display(invoice))
+        self.assertEqual(model_admin.patient_name(Invoice.objects.get(patient=None)), '-')
+
+    def test_patient_and_staff_columns(self):
+        model_admin, patients = self._rows(Patient)
+        for patient in patients:
+            invoices = Invoice.objects.filter(patient=patient)
+            self.assertEqual(patient.invoices_count, invoices.count(), patient)
+            self.assertEqual(patient.total_spent, sum((i.total_amount() for i in invoices), Decimal('0')), patient)
+            self.assertIn(f'{float(patient.total_spent):,.2f}', model_admin.total_spent(patient))
+
+        _, profiles = self._rows(StaffProfile)
+        self.assertEqual([(p.patients_added, p.invoices_created) for p in profiles], [(3, Invoice.objects.count() - 1)])
+
+    def test_changelists_render(self):
+        self.client.force_login(self.admin)
+        for model in (Invoice, Patient, StaffProfile):
+            url = reverse(f'custom_admin:clinic_{model._meta.model_name}_changelist')
+            self.assertEqual(self.client.get(url).status_code, 200, url)
+
+
+class ApproximateCountTests(TestCase):
+    """Planner estimates replace COUNT(*) only for large PostgreSQL results."""
+
+    def setUp(self):
+        user = User.objects.create_user('api')
+        self.client.defaults['HTTP_AUTHORIZATION'] = f'Token {Token.objects.create(user=user).key}'
+        patient = Patient.objects.create(first_name='Ana', last_name='Cruz')
+        for _ in range(3):
+            Invoice.objects.create(patient=patient)
+
+    @override_settings(APPROXIMATE_COUNT_THRESHOLD=0)
+    def test_sqlite_counts_stay_exact(self):
+        self.assertIsNone(estimate_count(Invoice.objects.all()))
+        self.assertIsNone(estimate_count([1, 2, 3]))
+        paginator = ApproximateCountPaginator(Invoice.objects.order_by('pk'), 2)
+        self.assertEqual(paginator.count, 3)
+        self.assertFalse(paginator.is_approximate)
+
+        body = self.client.get(reverse('api:invoices-list'), {'page': 1, 'page_size': 2}).json()
+        self.assertEqual((body['count'], body['count_is_approximate'], len(body['results'])), (3, False, 2))
+        # Without ?page= clients keep getting the plain list
+        self.assertEqual(len(self.client.get(reverse('api:invoices-list')).json()), 3)
+
+    def test_estimate_used_above_the_threshold(self):
+        queryset = Invoice.objects.order_by('pk')
+        with mock.patch('clinic.pagination.estimate_count', return_value=250_000):
+            paginator = ApproximateCountPaginator(queryset, 2)
+            self.assertEqual((paginator.count, paginator.is_approximate), (250_000, True))
+        with mock.patch('clinic.pagination.estimate_count', return_value=99):
+            paginator = ApproximateCountPaginator(queryset, 2)
+            self.assertEqual((paginator.count, paginator.is_approximate), (3, False))
+
+
+class KpiCounterTests(TestCase):
+    """Signal-maintained counters agree with a recount after every kind of write."""
+
+    def setUp(self):
+        kpis.reconcile()
+
+    def assertNoDrift(self, step):
+        self.assertEqual(kpis.reconcile(dry_run=True), [], step)
+
+    def test_saves_deletes_and_archiving(self):
+        patient = Patient.objects.create(first_name='Ana', last_name='Cruz')
+        service = Service.objects.create(category='CLEANING', name='Cleaning', price=800)
+        invoice = Invoice.objects.create(patient=patient)
+        item = InvoiceItem.objects.create(invoice=invoice, service=service, quantity=2)
+        self.assertNoDrift('create')
+
+        item.quantity = 3
+        item.price_at_time = Decimal('750.50')
+        item.save()
+        invoice.is_paid = True
+        invoice.save()
+        self.assertNoDrift('edit')
+
+        other = Invoice.objects.create(patient=patient)
+        item.invoice = other
+        item.save()
+        self.assertNoDrift('move item')
+
+        for row in (other, patient, service):
+            row.is_archived = True
+            row.save()
+            self.assertNoDrift(f'archive {row._meta.model_name}')
+        other.is_archived = False
+        other.save()
+        self.assertNoDrift('restore invoice')
+
+        item.delete()
+        self.assertNoDrift('delete item')
+        kpis.archive_invoices(Invoice.objects.filter(pk=invoice.pk))
+        self.assertNoDrift('bulk archive')
+        Invoice.all_objects.filter(pk=invoice.pk).get().delete()
+        Service.all_objects.get(pk=service.pk).delete()
+        Patient.all_objects.get(pk=patient.pk).delete()
+        self.assertNoDrift('delete')
+
+    def test_untracked_models_keep_fast_deletes(self):
+        collector = Collector(using='default')
+        self.assertTrue(collector.can_fast_delete(DuplicateSuggestion.objects.all()))
+        self.assertTrue(collector.can_fast_delete(SlowQuery.objects.all()))
+        self.assertFalse(collector.can_fast_delete(InvoiceItem.objects.all()))
+
+
+class ColdStorageTests(TestCase):
+    """Long-archived invoices move to cold storage and come back unchanged."""
+
+    def setUp(self):
+        self.admin = User.objects.create_superuser('admin', 'admin@example.com', 'admin-pass-123')
+        self.client.force_login(self.admin)
+        self.patient = Patient.objects.create(first_name='Ana', last_name='Cruz')
+        service = Service.objects.create(category='CLEANING', name='Cleaning', price=800)
+        kpis.reconcile()
+        # Ids past the 32-bit range, as BigAutoField tables eventually reach
+        self.invoice = Invoice.objects.create(id=2**31 + 5, patient=self.patient, is_paid=True)
+        # an explicit id skips save()'s price snapshot, so pass it
+        InvoiceItem.objects.create(
+            id=2**31 + 7, invoice=self.invoice, service=service, quantity=2,
+            price_at_time=service.price, service_name_at_time=service.name,
+        )
+        service.price = 900
+        service.save()  # restoring must keep the price the invoice was billed at
+        self.invoice.is_archived = True
+        self.invoice.save()
+        Invoice.all_objects.filter(pk=self.invoice.pk).update(archived_at=timezone.now() - timedelta(days=200))
+
+    def test_generated_data_leaves_cold_ids_free(self):
+        call_command('move_archived_invoices', stdout=io.StringIO())
+        # The newest hot rows sit just below the frozen ones
+        hot = Invoice.objects.create(id=self.invoice.pk - 1, patient=self.patient)
+        InvoiceItem.objects.create(id=2**31 + 6, invoice=hot, price_at_time=100, service_name_at_time='X-ray')
+        call_command('generate_clinic_data', staff=1, patients=2, invoices=3, stdout=io.StringIO())
+        self.assertGreater(Invoice.objects.aggregate(top=Max('pk'))['top'], self.invoice.pk)
+        self.assertGreater(InvoiceItem.objects.aggregate(top=Max('pk'))['top'], 2**31 + 7)
+
+        thawed = thaw_invoice(self.invoice.pk)
+        self.assertEqual(thawed.total_amount(), 1600)
+
+    def test_move_list_and_restore(self):
+        out = io.StringIO()
+        call_command('move_archived_invoices', batch_size=1, stdout=out)
+        self.assertIn('Invoices moved to cold storage: 1', out.getvalue())
+        self.assertFalse(Invoice.all_objects.filter(pk=self.invoice.pk).exists())
+        self.assertFalse(InvoiceItem.objects.filter(invoice_id=self.invoice.pk).exists())
+        cold = ArchivedInvoice.objects.get(pk=self.invoice.pk)
+        self.assertEqual((cold.patient_name, cold.total), ('Ana Cruz', 1600))
+        self.assertEqual(list(cold.items.values_list('id', 'price_at_time')), [(2**31 + 7, 800)])
+
+        self.assertContains(self.client.get(reverse('clinic:archive')), f'#{self.invoice.pk}')
+
+        self.client.post(reverse('clinic:restore_invoice', args=[self.invoice.pk]))
+        self.assertFalse(ArchivedInvoice.objects.exists())
+        restored = Invoice.objects.get(pk=self.invoice.pk)
+        self.assertEqual(restored.date_created, self.invoice.date_created)
+        self.assertTrue(restored.is_paid)
+        self.assertEqual(list(restored.items.values_list('id', 'price_at_time', 'quantity')), [(2**31 + 7, 800, 2)])
+        self.assertEqual(kpis.reconcile(dry_run=True), [])
+
+    def test_thaw_and_permanent_delete(self):
+        list(move_archived_invoices(timedelta(days=90)))
+        thawed = thaw_invoice(self.invoice.pk)
+        self.assertTrue(thawed.is_archived)
+        self.assertEqual(thawed.total_amount(), 1600)
+
+        list(move_archived_invoices(timedelta(days=0)))
+        self.client.post(reverse('clinic:delete_invoice_permanent', args=[self.invoice.pk]))
+        self.assertFalse(ArchivedInvoice.objects.exists())
+        self.assertFalse(InvoiceItem.objects.exists())
+
+
+class ActiveManagerTests(TestCase):
+    """Default managers hide archived rows; the archive, admin and detail pages still reach them."""
+
+    def setUp(self):
+        self.admin = User.objects.create_superuser('admin', 'admin@example.com', 'admin-pass-123')
+        self.client.force_login(self.admin)
+        self.patient = Patient.objects.create(first_name='Archived', last_name='Patient', is_archived=True)
+        self.service = Service.objects.create(category='CLEANING', name='Old cleaning', is_archived=True)
+        self.invoice = Invoice.objects.create(patient=self.patient, is_archived=True)
+        InvoiceItem.objects.create(invoice=self.invoice, service=self.service)
+        user = User.objects.create_user('gone', is_staff=True, is_active=False)
+        self.profile = StaffProfile.objects.create(user=user, position='dentist', is_archived=True)
+        self.live = Patient.objects.create(first_name='Live', last_name='Patient')
+
+    def test_default_managers_hide_archived_rows(self):
+        for model, row in ((Patient, self.patient), (Service, self.service),
+                           (Invoice, self.invoice), (StaffProfile, self.profile)):
+            self.assertFalse(model.objects.filter(pk=row.pk).exists(), model)
+            self.assertTrue(model.all_objects.filter(pk=row.pk).exists(), model)
+        self.assertEqual(list(Patient.objects.all()), [self.live])
+        self.assertEqual(list(self.patient.invoices.all()), [])
+
+    def test_archive_detail_and_admin_pages_reach_archived_rows(self):
+        page = self.client.get(reverse('clinic:archive'))
+        for text in ('Archived', 'Old cleaning', 'gone', f'#{self.invoice.pk}'):
+            self.assertContains(page, text)
+        self.assertEqual(self.client.get(reverse('clinic:patient_detail', args=[self.patient.pk])).status_code, 200)
+        self.assertEqual(self.client.get(reverse('clinic:invoice_detail', args=[self.invoice.pk])).status_code, 200)
+        for model, row in ((Patient, self.patient), (Service, self.service),
+                           (Invoice, self.invoice), (StaffProfile, self.profile)):
+            name = model._meta.model_name
+            changelist = self.client.get(reverse(f'custom_admin:clinic_{name}_changelist'))
+            self.assertEqual(changelist.context['cl'].result_count, model.all_objects.count(), name)
+            change = self.client.get(reverse(f'custom_admin:clinic_{name}_change', args=[row.pk]))
+            self.assertEqual(change.status_code, 200, name)
+
+    def test_restore_and_permanent_delete_views(self):
+        for name, row in (('patient', self.patient), ('service', self.service),
+                          ('invoice', self.invoice), ('staff', self.profile)):
+            self.client.post(reverse(f'clinic:restore_{name}', args=[row.pk]))
+            row.refresh_from_db()
+            self.assertFalse(row.is_archived, name)
+        self.assertTrue(User.objects.get(username='gone').is_active)
+
+        self.patient.is_archived = True
+        self.patient.save()
+        self.client.post(reverse('clinic:delete_patient_permanent', args=[self.patient.pk]))
+        self.assertFalse(Patient.all_objects.filter(pk=self.patient.pk).exists())
+
+    def test_invoices_of_archived_patients_and_services_can_be_edited(self):
+        # Restored invoice; its patient and its line's service stay archived
+        self.invoice.is_archived = False
+        self.invoice.save()
+        item = self.invoice.items.get()
+
+        form = InvoiceForm({'patient': self.patient.pk, 'is_paid': 'on'}, instance=self.invoice)
+        self.assertTrue(form.is_valid(), form.errors)
+        self.assertFalse(InvoiceForm({'patient': self.patient.pk}).is_valid())
+
+        url = reverse('custom_admin:clinic_invoice_change', args=[self.invoice.pk])
+        response = self.client.post(url, {
+            'patient': self.patient.pk,
+            'is_paid': 'on',
+            'items-TOTAL_FORMS': '1', 'items-INITIAL_FORMS': '1',
+            'items-MIN_NUM_FORMS': '0', 'items-MAX_NUM_FORMS': '1000',
+            'items-0-id': item.pk, 'items-0-invoice': self.invoice.pk,
+            'items-0-service': self.service.pk, 'items-0-quantity': '3',
+        })
+        self.assertEqual(response.status_code, 302, getattr(response, 'context', None) and response.context['errors'])
+        item.refresh_from_db()
+        self.assertEqual(item.quantity, 3)
+        self.assertTrue(Invoice.objects.get(pk=self.invoice.pk).is_paid)
+        # New lines are offered active services only
+        inline = self.client.get(reverse('custom_admin:clinic_invoice_add'))
+        self.assertNotContains(inline, 'Old cleaning')
+
+    def test_archived_default_services_are_not_recreated(self):
+        call_command('seed_services', stdout=io.StringIO())
+        Service.objects.filter(category__in=['CHECKUP', 'MEDICAL_CERTIFICATE']).update(is_archived=True)
+        service_catalog.changed()
+        out = io.StringIO()
+        call_command('seed_services', stdout=out)
+        self.assertIn('Left archived', out.getvalue())
+
+        request = RequestFactory().get('/')
+        request.user, request.session = self.admin, {}
+        with mock.patch('clinic.views.render'):  # the page itself isn't under test
+            select_services(request, self.live.pk)
+        for category in ('CHECKUP', 'MEDICAL_CERTIFICATE'):
+            self.assertEqual(Service.all_objects.filter(category=category).count(), 1, category)
+            self.assertFalse(Service.objects.filter(category=category).exists(), category)
+
+    def test_dumpdata_needs_all_for_archived_rows(self):
+        def dumped(*args):
+            out = io.StringIO()
+            call_command('dumpdata', 'clinic.patient', *args, stdout=out)
+            return {row['pk'] for row in json.loads(out.getvalue())}
+
+        self.assertEqual(dumped(), {self.live.pk})
+        self.assertEqual(dumped('--all'), {self.live.pk, self.patient.pk})
+
+
+@override_settings(ARCHIVAL_BATCH_SIZE=2)
+class ArchivalJobTests(TestCase):
+    """Cascades archive invoices in committed batches, resume from last_pk and can be cancelled."""
+
+    def setUp(self):
+        kpis.reconcile()
+        # A patient id past 2**31 must fit in target_id
+        self.patient = Patient.objects.create(id=2**31 + 1, first_name='Ana', last_name='Cruz')
+        service = Service.objects.create(category='CLEANING', name='Cleaning', price=800)
+        self.invoices = []
+        for _ in range(5):
+            invoice = Invoice.objects.create(patient=self.patient)
+            InvoiceItem.objects.create(invoice=invoice, service=service)
+            self.invoices.append(invoice)
+        self.other = Invoice.objects.create(patient=Patient.objects.create(first_name='Other'))
+        self.patient.is_archived = True
+        self.patient.save()
+
+    def test_runs_in_batches(self):
+        job = start_cascade('patient', self.patient)
+        archive_invoices = kpis.archive_invoices
+        batches = []
+
+        def archive(queryset):
+            batches.append(queryset.count())
+            return archive_invoices(queryset)
+
+        with mock.patch('clinic.kpis.archive_invoices', side_effect=archive):
+            job = run_job(job.pk)
+        self.assertEqual(batches, [2, 2, 1])
+        self.assertEqual((job.status, job.processed, job.total, job.target_id), (ArchivalJob.DONE, 5, 5, 2**31 + 1))
+        self.assertEqual(job.last_pk, self.invoices[-1].pk)
+        self.assertFalse(Invoice.objects.filter(patient=self.patient).exists())
+        self.assertTrue(Invoice.objects.filter(pk=self.other.pk).exists())
+        self.assertEqual(kpis.reconcile(dry_run=True), [])
+
+    def test_resumes_a_stalled_job_from_last_pk(self):
+        job = start_cascade('patient', self.patient)
+        self.assertTrue(_next_batch(job.pk))  # then the worker dies
+        job.refresh_from_db()
+        self.assertEqual((job.status, job.last_pk, job.processed), (ArchivalJob.RUNNING, self.invoices[1].pk, 2))
+        self.assertEqual(list(resumable_jobs()), [])  # still within its heartbeat
+
+        ArchivalJob.objects.filter(pk=job.pk).update(updated_at=timezone.now() - timedelta(hours=1))
+        out = io.StringIO()
+        call_command('run_archival_jobs', stdout=out)
+        self.assertIn('Jobs run: 1 of 1', out.getvalue())
+        job.refresh_from_db()
+        self.assertEqual((job.status, job.processed), (ArchivalJob.DONE, 5))
+        self.assertFalse(Invoice.objects.filter(patient=self.patient).exists())
+        self.assertEqual(kpis.reconcile(dry_run=True), [])
+
+    def test_worker_start_resumes_unfinished_jobs(self):
+        stalled = start_cascade('patient', self.patient)
+        self.assertTrue(_next_batch(stalled.pk))  # then the worker is recycled
+        ArchivalJob.objects.filter(pk=stalled.pk).update(updated_at=timezone.now() - timedelta(hours=1))
+        pending = start_cascade('service', Service.objects.get())  # killed before on_commit ran it
+        state_dir = tempfile.mkdtemp()
+        self.addCleanup(shutil.rmtree, state_dir)
+
+        with override_settings(STARTUP_STATE_DIR=state_dir), \
+                mock.patch.object(startup, 'expected_state', return_value={}), \
+                mock.patch.object(startup, '_stale', return_value=[]), \
+                mock.patch('clinic.archival.run_in_background') as run_in_background:
+            self.assertEqual(startup.run_startup_tasks(), [])
+            startup.run_startup_tasks()  # the next worker finds them claimed
+        self.assertEqual([c.args[0] for c in run_in_background.call_args_list], [stalled.pk, pending.pk])
+
+        for job_id in (stalled.pk, pending.pk):
+            self.assertEqual(run_job(job_id).status, ArchivalJob.DONE)
+        self.assertFalse(Invoice.objects.filter(patient=self.patient).exists())
+        self.assertEqual(list(resumable_jobs()), [])
+
+    def test_restore_cancels_the_cascade(self):
+        job = start_cascade('patient', self.patient)
+        self.assertTrue(_next_batch(job.pk))
+        admin = User.objects.create_superuser('admin', 'admin@example.com', 'admin-pass-123')
+        self.client.force_login(admin)
+        self.client.post(reverse('clinic:restore_patient', args=[self.patient.pk]))
+
+        job.refresh_from_db()
+        self.assertEqual(job.status, ArchivalJob.CANCELLED)
+        self.assertEqual(run_job(job.pk).processed, 2)
+        # What was archived stays archived; the rest is untouched
+        self.assertEqual(Invoice.objects.filter(patient=self.patient).count(), 3)
+        self.assertEqual(cancel_cascades('patient', self.patient), 0)
+
+
+class MoneyTests(SimpleTestCase):
+    def test_to_centavos_rounds_half_up(self):
+        self.assertEqual(to_centavos(Decimal('12.345')), 1235)
+        self.assertEqual(to_centavos(Decimal('12.344')), 1234)
+        self.assertEqual(to_centavos(Decimal('-0.005')), -1)
+        self.assertEqual(to_centavos('0.005'), 1)
+
+    def test_to_centavos_inputs(self):
+        self.assertEqual(to_centavos(None), 0)
+        self.assertEqual(to_centavos(5), 500)
+        # 19.99 * 100 is 1998.9999... as a float
+        self.assertEqual(to_centavos(19.99), 1999)
+        self.assertEqual(to_centavos(Money(42)), 42)
+        self.assertEqual(Money.from_pesos('1234.5').centavos, 123450)
+
+    def test_comparisons_treat_floats_alike(self):
+        amount = Money(1999)
+        self.assertEqual(amount, 19.99)
+        self.assertEqual(amount, Decimal('19.99'))
+        self.assertEqual(Money(1000), 10)
+        self.assertNotEqual(amount, 20.0)
+        self.assertLess(amount, 20.0)
+        self.assertLessEqual(amount, 19.99)
+        self.assertGreaterEqual(amount, 19.99)
+        self.assertGreater(amount, Money(1998))
+        self.assertNotEqual(amount, '19.99')
+        with self.assertRaises(TypeError):
+            amount < '20'
+        self.assertEqual(hash(Money(1000)), hash(Decimal('10.00')))
+
+    def test_format_centavos(self):
+        self.assertEqual(format_centavos(123450), '\u20b11,234.50')
+        self.assertEqual(format_centavos(-5), '-\u20b10.05')
+        self.assertEqual(format_centavos(123450, symbol='', grouping=False), '1234.50')
+        self.assertEqual(Money(700).formatted(), '\u20b17.00')
+
+
+class LineTotalCentavosTests(TestCase):
+    def test_totals_past_32_bits(self):
+        patient = Patient.objects.create(first_name='Big', last_name='Spender')
+        service = Service.objects.create(category='Surgery', name='Implants', price=Decimal('9999999.99'))
+        invoice = Invoice.objects.create(patient=patient)
+        InvoiceItem.objects.create(invoice=invoice, service=service, quantity=300)
+        total = InvoiceItem.objects.filter(invoice=invoice).aggregate(total=Sum(LINE_TOTAL_CENTAVOS))['total']
+        self.assertEqual(total, 999999999 * 300)
+        self.assertGreater(total, 2 ** 31)
@@ -56,6 +56,7 @@ urlpatterns = [
     # Staff POS (mobile)
     path('staff/login/', StaffLoginView.as_view(), name='staff_login'),
     path('staff/pos/', views.staff_pos, name='staff_pos'),
+    path('staff/pos/patients/', views.patient_autocomplete, name='patient_autocomplete'),
     
     # Sales Analytics
     path('sales/analytics/', views.sales_analytics, name='sales_analytics'),
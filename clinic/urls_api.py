@@ -2,6 +2,7 @@
 from django.urls import path, include
 from rest_framework.routers import DefaultRouter
 from .api_views import AuthViewSet, PatientViewSet, ServiceViewSet, InvoiceViewSet
+from . import views
 
 # Create router for ViewSets
 router = DefaultRouter()
@@ -14,4 +15,6 @@ app_name = 'api'
 
 urlpatterns = [
     path('', include(router.urls)),
+    path('staff/activity/', views.api_staff_activity, name='staff_activity'),
+    path('staff/<int:staff_id>/activity/', views.api_staff_detail, name='staff_detail'),
 ]
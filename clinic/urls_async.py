@@ -0,0 +1,14 @@
+# Async API URLs for ASGI deployments (see clinic/async_api.py)
+from django.urls import path
+from . import async_api
+
+app_name = 'async_api'
+
+urlpatterns = [
+    path('services/', async_api.services_list, name='services'),
+    path('services/<int:pk>/', async_api.service_detail, name='service_detail'),
+    path('invoices/', async_api.invoices_list, name='invoices'),
+    path('invoices/<int:pk>/', async_api.invoice_detail, name='invoice_detail'),
+    path('invoices/<int:pk>/receipt_pdf/', async_api.receipt_pdf, name='receipt_pdf'),
+    path('sales/summary/', async_api.sales_summary, name='sales_summary'),
+]
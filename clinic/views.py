@@ -1,26 +1,29 @@
 from django.shortcuts import render, redirect, get_object_or_404
-from django.http import HttpResponse
+from django.http import Http404, HttpResponse, JsonResponse
+from django.core.paginator import Paginator
 import io
 import csv
-from reportlab.pdfgen import canvas
-from reportlab.lib.pagesizes import A4
 from django.conf import settings
 from django.contrib.staticfiles import finders
-from reportlab.lib import colors
-from reportlab.lib.units import mm
-try:
-    import openpyxl
-    from openpyxl.utils import get_column_letter
-except Exception:
-    openpyxl = None
 from django.contrib.auth.decorators import user_passes_test
 from django.contrib.auth import login as auth_login, logout as auth_logout
 from django.contrib.auth.models import User
 from django.urls import reverse
 from django.utils import timezone
 from datetime import timedelta
-from .models import Patient, Service, Invoice, InvoiceItem, StaffProfile
+from django.db.models import Count, OuterRef, Q, Subquery, Sum, Value
+from django.db.models.functions import Coalesce
+from .models import Patient, Service, Invoice, InvoiceItem, StaffProfile, ArchivedInvoice, ArchivalJob, LINE_TOTAL_CENTAVOS
+from .money import Money, format_centavos
 from .forms import PatientForm, ServiceForm, InvoiceForm
+from .search import patient_index
+from .catalog import service_catalog
+from . import kpis
+from .cold_storage import thaw_invoice
+from .metrics import observe_render
+from .archival import cancel_cascades, start_cascade
+from .routers import reads_from_replica
+from .sqlite import retry_on_lock
 
 def superuser_required(view_func):
     return user_passes_test(lambda u: u.is_authenticated and u.is_superuser, login_url='login')(view_func)
@@ -48,29 +51,24 @@ def logout_view(request):
 # 2. Dashboard
 @superuser_required
 def dashboard(request):
-    context = {
-        'total_patients': Patient.objects.filter(is_archived=False).count(),
-        'total_services': Service.objects.filter(is_archived=False).count(),
-        'total_invoices': Invoice.objects.filter(is_archived=False).count(),
-        'total_staff': User.objects.filter(is_staff=True, is_active=True).count(),
-    }
+    context = dict(kpis.dashboard_kpis())
     return render(request, 'clinic/dashboard.html', context)
 
 # 3. Patients Module
 @superuser_required
 def patients_list(request):
-    patients = Patient.objects.filter(is_archived=False)
+    patients = Patient.objects.all()
     return render(request, 'clinic/patient_list.html', {'patients': patients, 'back_url': reverse('clinic:dashboard')})
 
 @superuser_required
 def patient_detail(request, pk):
-    patient = get_object_or_404(Patient, pk=pk)
+    patient = get_object_or_404(Patient.all_objects, pk=pk)
 
     # Gather invoices and service usage for this patient
-    invoices = Invoice.objects.filter(patient=patient).order_by('-date_created')
+    invoices = Invoice.objects.filter(patient=patient).with_totals().order_by('-date_created')
 
     # Summarize services from invoice items
-    service_items = InvoiceItem.objects.filter(invoice__patient=patient)
+    service_items = InvoiceItem.objects.filter(invoice__patient=patient, invoice__is_archived=False)
     services_summary = {}
     for si in service_items:
         name = si.service_name_at_time
@@ -120,14 +118,14 @@ def patient_delete(request, pk):
     # Soft-delete the patient and archive related invoices
     patient.is_archived = True
     patient.save()
-    # Archive all invoices for this patient (idempotent)
-    Invoice.objects.filter(patient=patient).update(is_archived=True)
+    # Archive this patient's invoices in the background, batch by batch
+    start_cascade('patient', patient, request.user)
     return redirect('clinic:patients_list')
 
 # 4. Services Module
 @superuser_required
 def services_list(request):
-    services = Service.objects.filter(is_archived=False)
+    services = Service.objects.all()
     return render(request, 'clinic/service_list.html', {'services': services, 'back_url': reverse('clinic:dashboard')})
 
 @superuser_required
@@ -159,19 +157,21 @@ def service_delete(request, pk):
     # Soft-delete the service and archive any invoices that include this service
     service.is_archived = True
     service.save()
-    # Archive invoices that reference this service via InvoiceItem
-    Invoice.objects.filter(items__service=service).update(is_archived=True)
+    # Archive invoices that reference this service via InvoiceItem, in the background
+    start_cascade('service', service, request.user)
     return redirect('clinic:services_list')
 
 # 5. Invoices Module
 @superuser_required
 def invoices_list(request):
-    invoices = Invoice.objects.filter(is_archived=False)
+    invoices = Invoice.objects.select_related('patient').with_totals()
     return render(request, 'clinic/invoice_list.html', {'invoices': invoices})
 
 @superuser_required
 def invoice_detail(request, pk):
-    invoice = get_object_or_404(Invoice, pk=pk)
+    invoice = get_object_or_404(
+        Invoice.all_objects.select_related('patient', 'created_by').prefetch_related('items'), pk=pk
+    )
     return render(request, 'clinic/invoice_detail.html', {'invoice': invoice})
 
 @superuser_required
@@ -208,9 +208,15 @@ def invoice_delete(request, pk):
 
 
 @superuser_required
+@observe_render('pdf')
 def invoice_pdf(request, pk):
     """Generate a PDF for a single invoice (download)."""
-    invoice = get_object_or_404(Invoice, pk=pk)
+    # ReportLab and openpyxl are imported in the views that use them, not
+    # at module load, so workers that never render a report don't pay for them
+    from reportlab.lib.pagesizes import A4
+    from reportlab.pdfgen import canvas
+
+    invoice = get_object_or_404(Invoice.all_objects.select_related('patient'), pk=pk)
     buffer = io.BytesIO()
     p = canvas.Canvas(buffer, pagesize=A4)
     width, height = A4
@@ -262,11 +268,13 @@ def invoice_pdf(request, pk):
 
 
 @superuser_required
+@reads_from_replica
+@observe_render('csv')
 def sales_summary_csv(request):
     """Export invoices (not archived) as CSV with optional date-range filter and a summary row.
     Query params: ?start=YYYY-MM-DD&end=YYYY-MM-DD
     """
-    invoices = Invoice.objects.filter(is_archived=False).order_by('date_created')
+    invoices = Invoice.objects.select_related('patient', 'created_by').with_centavos().order_by('date_created')
     # date range filter
     start = request.GET.get('start')
     end = request.GET.get('end')
@@ -282,7 +290,7 @@ def sales_summary_csv(request):
         # ignore parse errors and return full set
         pass
 
-    total_sales = 0
+    total_sales = 0  # centavos
     total_count = invoices.count()
 
     buffer = io.StringIO()
@@ -290,14 +298,13 @@ def sales_summary_csv(request):
     # header
     writer.writerow(['Invoice ID', 'Patient', 'Date', 'Is Paid', 'Created By', 'Total Amount'])
     for inv in invoices:
-        amount = sum(float(it.price_at_time) * it.quantity for it in inv.items.all())
-        total_sales += amount
-        writer.writerow([inv.pk, f"{inv.patient.first_name} {inv.patient.last_name}", inv.date_created.strftime('%Y-%m-%d %H:%M'), 'Yes' if inv.is_paid else 'No', (inv.created_by.get_full_name() if inv.created_by else ''), f"{amount:.2f}"])
+        total_sales += inv.amount_centavos
+        writer.writerow([inv.pk, f"{inv.patient.first_name} {inv.patient.last_name}", inv.date_created.strftime('%Y-%m-%d %H:%M'), 'Yes' if inv.is_paid else 'No', (inv.created_by.get_full_name() if inv.created_by else ''), Money(inv.amount_centavos)])
 
     # summary row
     writer.writerow([])
     writer.writerow(['TOTAL_INVOICES', total_count])
-    writer.writerow(['TOTAL_SALES', f"{total_sales:.2f}"])
+    writer.writerow(['TOTAL_SALES', Money(total_sales)])
 
     resp = HttpResponse(buffer.getvalue(), content_type='text/csv')
     filename = 'sales_summary'
@@ -308,11 +315,18 @@ def sales_summary_csv(request):
 
 
 @superuser_required
+@reads_from_replica
+@observe_render('pdf')
 def sales_summary_pdf(request):
     """Generate a PDF summarizing sales (list + totals) with optional date-range filter.
     Query params: ?start=YYYY-MM-DD&end=YYYY-MM-DD
     """
-    invoices = Invoice.objects.filter(is_archived=False).order_by('date_created')
+    from reportlab.lib import colors
+    from reportlab.lib.pagesizes import A4
+    from reportlab.lib.units import mm
+    from reportlab.pdfgen import canvas
+
+    invoices = Invoice.objects.select_related('patient', 'created_by').with_centavos().order_by('date_created')
     # date range filter
     start = request.GET.get('start')
     end = request.GET.get('end')
@@ -395,7 +409,7 @@ def sales_summary_pdf(request):
     y -= 8
 
     p.setFont('Helvetica', 9)
-    total_sales = 0
+    total_sales = 0  # centavos
     for inv in invoices:
         if y < margin_y + 30:
             p.showPage()
@@ -411,15 +425,14 @@ def sales_summary_pdf(request):
             p.drawRightString(col_total + 30 * mm, y, 'Total')
             y -= 12
 
-        amount = sum(float(it.price_at_time) * it.quantity for it in inv.items.all())
-        total_sales += amount
+        total_sales += inv.amount_centavos
         # draw row
         p.setFillColor(colors.black)
         p.drawString(col_invoice, y, str(inv.pk))
         patient_name = f"{inv.patient.first_name} {inv.patient.last_name}"
         p.drawString(col_patient, y, patient_name[:40])
         p.drawString(col_date, y, inv.date_created.strftime('%Y-%m-%d'))
-        p.drawRightString(col_total + 30 * mm, y, f"₱{amount:,.2f}")
+        p.drawRightString(col_total + 30 * mm, y, format_centavos(inv.amount_centavos))
         y -= 12
 
     # footer totals
@@ -429,7 +442,7 @@ def sales_summary_pdf(request):
     y -= 12
     p.setFont('Helvetica-Bold', 11)
     p.drawString(table_x, y, f"Total Invoices: {invoices.count()}")
-    p.drawRightString(table_x + usable_width, y, f"Total Sales: ₱{total_sales:,.2f}")
+    p.drawRightString(table_x + usable_width, y, f"Total Sales: {format_centavos(total_sales)}")
 
     p.showPage()
     p.save()
@@ -444,11 +457,16 @@ def sales_summary_pdf(request):
 
 
 @superuser_required
+@reads_from_replica
+@observe_render('xlsx')
 def sales_summary_xlsx(request):
     """Export all invoices (not archived) as an Excel .xlsx file."""
-    if openpyxl is None:
+    try:
+        import openpyxl
+        from openpyxl.utils import get_column_letter
+    except ImportError:
         return HttpResponse('openpyxl is not installed. Install with `pip install openpyxl`', status=500)
-    invoices = Invoice.objects.filter(is_archived=False).order_by('date_created')
+    invoices = Invoice.objects.select_related('patient', 'created_by').with_centavos().order_by('date_created')
     # date range filter
     start = request.GET.get('start')
     end = request.GET.get('end')
@@ -469,16 +487,15 @@ def sales_summary_xlsx(request):
     headers = ['Invoice ID', 'Patient', 'Date', 'Is Paid', 'Created By', 'Total Amount']
     ws.append(headers)
 
-    total_sales = 0
+    total_sales = 0  # centavos
     for inv in invoices:
-        amount = sum(float(it.price_at_time) * it.quantity for it in inv.items.all())
-        total_sales += amount
-        ws.append([inv.pk, f"{inv.patient.first_name} {inv.patient.last_name}", inv.date_created.strftime('%Y-%m-%d %H:%M'), 'Yes' if inv.is_paid else 'No', (inv.created_by.get_full_name() if inv.created_by else ''), float(f"{amount:.2f}")])
+        total_sales += inv.amount_centavos
+        ws.append([inv.pk, f"{inv.patient.first_name} {inv.patient.last_name}", inv.date_created.strftime('%Y-%m-%d %H:%M'), 'Yes' if inv.is_paid else 'No', (inv.created_by.get_full_name() if inv.created_by else ''), Money(inv.amount_centavos).as_float()])
 
     # summary rows
     ws.append([])
     ws.append(['TOTAL_INVOICES', invoices.count()])
-    ws.append(['TOTAL_SALES', float(f"{total_sales:.2f}")])
+    ws.append(['TOTAL_SALES', Money(total_sales).as_float()])
 
     # auto-size columns
     for i, col in enumerate(ws.columns, 1):
@@ -505,14 +522,23 @@ def sales_summary_xlsx(request):
 # 6. Archive Module
 @superuser_required
 def archive(request):
-    archived_patients = Patient.objects.filter(is_archived=True)
-    archived_services = Service.objects.filter(is_archived=True)
-    archived_invoices = Invoice.objects.filter(is_archived=True)
-    archived_staff = StaffProfile.objects.filter(is_archived=True)
+    archived_patients = Patient.all_objects.filter(is_archived=True)
+    archived_services = Service.all_objects.filter(is_archived=True)
+    archived_invoices = Invoice.all_objects.filter(is_archived=True).select_related('patient').with_totals()
+    # Long-archived invoices live in cold storage; page through them
+    cold_invoices = Paginator(ArchivedInvoice.objects.select_related('patient'), 50).get_page(request.GET.get('cold_page'))
+    archived_staff = StaffProfile.all_objects.filter(is_archived=True)
+    # Cascades still running, plus those that finished in the last day
+    archival_jobs = ArchivalJob.objects.filter(
+        Q(status__in=[ArchivalJob.PENDING, ArchivalJob.RUNNING, ArchivalJob.FAILED])
+        | Q(finished_at__gte=timezone.now() - timedelta(days=1))
+    )[:20]
     return render(request, 'clinic/archive.html', {
+        'archival_jobs': archival_jobs,
         'archived_patients': archived_patients,
         'archived_services': archived_services,
         'archived_invoices': archived_invoices,
+        'cold_invoices': cold_invoices,
         'archived_staff': archived_staff,
         'back_url': reverse('clinic:dashboard')
     })
@@ -520,21 +546,25 @@ def archive(request):
 # Restore functions
 @superuser_required
 def restore_patient(request, pk):
-    patient = get_object_or_404(Patient, pk=pk, is_archived=True)
+    patient = get_object_or_404(Patient.all_objects, pk=pk, is_archived=True)
     patient.is_archived = False
     patient.save()
+    cancel_cascades('patient', patient)
     return redirect('clinic:archive')
 
 @superuser_required
 def restore_service(request, pk):
-    service = get_object_or_404(Service, pk=pk, is_archived=True)
+    service = get_object_or_404(Service.all_objects, pk=pk, is_archived=True)
     service.is_archived = False
     service.save()
+    cancel_cascades('service', service)
     return redirect('clinic:archive')
 
 @superuser_required
 def restore_invoice(request, pk):
-    invoice = get_object_or_404(Invoice, pk=pk, is_archived=True)
+    if ArchivedInvoice.objects.filter(pk=pk).exists():
+        thaw_invoice(pk)
+    invoice = get_object_or_404(Invoice.all_objects, pk=pk, is_archived=True)
     invoice.is_archived = False
     invoice.save()
     return redirect('clinic:archive')
@@ -542,19 +572,21 @@ def restore_invoice(request, pk):
 # Permanent delete functions
 @superuser_required
 def delete_patient_permanent(request, pk):
-    patient = get_object_or_404(Patient, pk=pk, is_archived=True)
+    patient = get_object_or_404(Patient.all_objects, pk=pk, is_archived=True)
     patient.delete()
     return redirect('clinic:archive')
 
 @superuser_required
 def delete_service_permanent(request, pk):
-    service = get_object_or_404(Service, pk=pk, is_archived=True)
+    service = get_object_or_404(Service.all_objects, pk=pk, is_archived=True)
     service.delete()
     return redirect('clinic:archive')
 
 @superuser_required
 def delete_invoice_permanent(request, pk):
-    invoice = get_object_or_404(Invoice, pk=pk, is_archived=True)
+    if ArchivedInvoice.objects.filter(pk=pk).delete()[0]:
+        return redirect('clinic:archive')
+    invoice = get_object_or_404(Invoice.all_objects, pk=pk, is_archived=True)
     invoice.delete()
     return redirect('clinic:archive')
 
@@ -618,7 +650,7 @@ def staff_delete(request, pk):
 @superuser_required
 def restore_staff(request, pk):
     # pk is StaffProfile id
-    profile = get_object_or_404(StaffProfile, pk=pk, is_archived=True)
+    profile = get_object_or_404(StaffProfile.all_objects, pk=pk, is_archived=True)
     profile.is_archived = False
     profile.save()
     # reactivate user
@@ -631,7 +663,7 @@ def restore_staff(request, pk):
 @superuser_required
 def delete_staff_permanent(request, pk):
     # pk is StaffProfile id
-    profile = get_object_or_404(StaffProfile, pk=pk, is_archived=True)
+    profile = get_object_or_404(StaffProfile.all_objects, pk=pk, is_archived=True)
     user = profile.user
     profile.delete()
     if user:
@@ -642,33 +674,50 @@ def delete_staff_permanent(request, pk):
 @superuser_required
 def staff_list(request):
     """Display all active staff (excluding superusers) with their activity and sales metrics"""
-    # Filter only staff users, excluding superusers
-    staff_list = User.objects.filter(is_staff=True, is_active=True, is_superuser=False)
+    # One query: counts, sales (in centavos) and last activity are correlated
+    # subqueries. Joining invoices and grouping made the sales subquery run
+    # once per invoice row instead of once per staff member.
+    invoices = Invoice.objects.filter(created_by=OuterRef('pk')).order_by().values('created_by')
+    sales = (
+        InvoiceItem.objects.filter(invoice__created_by=OuterRef('pk'), invoice__is_archived=False)
+        .order_by().values('invoice__created_by')
+        .annotate(total=Sum(LINE_TOTAL_CENTAVOS)).values('total')
+    )
+    last_invoice = (
+        Invoice.all_objects.filter(created_by=OuterRef('pk'))
+        .order_by('-date_created').values('date_created')[:1]
+    )
+    staff_list = (
+        User.objects.filter(is_staff=True, is_active=True, is_superuser=False)
+        .select_related('staff_profile')
+        .annotate(
+            total_invoices=Coalesce(Subquery(invoices.annotate(n=Count('id')).values('n')), Value(0)),
+            sales_centavos=Coalesce(Subquery(sales), Value(0)),
+            last_activity=Subquery(last_invoice),
+        )
+        .order_by('username')
+    )
     
     staff_data = []
     total_invoices_count = 0
-    total_sales_amount = 0
+    total_sales_centavos = 0
     
     for staff in staff_list:
-        total_invoices = Invoice.objects.filter(created_by=staff, is_archived=False).count()
-        total_sales = sum(inv.total_amount() for inv in Invoice.objects.filter(created_by=staff, is_archived=False))
-        last_activity = Invoice.objects.filter(created_by=staff).values_list('date_created', flat=True).order_by('-date_created').first()
-        
-        total_invoices_count += total_invoices
-        total_sales_amount += total_sales
+        total_invoices_count += staff.total_invoices
+        total_sales_centavos += staff.sales_centavos
         
         staff_data.append({
             'user': staff,
-            'total_invoices': total_invoices,
-            'total_sales': total_sales or 0,
-            'last_activity': last_activity,
+            'total_invoices': staff.total_invoices,
+            'total_sales': Money(staff.sales_centavos),
+            'last_activity': staff.last_activity,
             'profile': getattr(staff, 'staff_profile', None)
         })
     
     return render(request, 'clinic/staff_list.html', {
         'staff_data': staff_data,
         'total_invoices_count': total_invoices_count,
-        'total_sales_amount': total_sales_amount,
+        'total_sales_amount': Money(total_sales_centavos),
         'back_url': reverse('clinic:dashboard')
     })
 
@@ -678,117 +727,155 @@ def staff_required(view_func):
     return user_passes_test(lambda u: u.is_authenticated and u.is_staff and u.is_active and getattr(getattr(u, 'staff_profile', None), 'approved', False), login_url='clinic:staff_login')(view_func)
 
 
+def _pos_quantities(data):
+    """Positive quantities of the submitted ``service_<id>`` inputs, by service id."""
+    quantities = {}
+    for name, value in data.items():
+        if not name.startswith('service_'):
+            continue
+        try:
+            service_id, qty = int(name[len('service_'):]), int(value)
+        except ValueError:
+            continue
+        if qty > 0:
+            quantities[service_id] = qty
+    return quantities
+
+
+@retry_on_lock
+def _pos_checkout(request):
+    """Create the POS invoice (and a new patient if needed) in one retried transaction.
+
+    Prices and names come from the cached catalog, and the items are
+    inserted together, so checkout costs the same however big the catalog is.
+    """
+    # Determine patient: existing or new
+    patient_id = request.POST.get('patient_id')
+    if patient_id:
+        patient = get_object_or_404(Patient, pk=patient_id)
+    else:
+        # Create new patient from minimal fields
+        first_name = request.POST.get('first_name')
+        last_name = request.POST.get('last_name')
+        contact_number = request.POST.get('contact_number')
+        email = request.POST.get('email')
+        address = request.POST.get('address')
+        patient = Patient.objects.create(
+            first_name=first_name or 'Unknown',
+            last_name=last_name or 'Patient',
+            contact_number=contact_number or '',
+            email=email or '',
+            address=address or '',
+            created_by=request.user
+        )
+
+    # Create invoice
+    invoice = Invoice.objects.create(patient=patient, created_by=request.user)
+
+    # Inputs are named service_<id>; snapshot price and name from the confirmed
+    # catalog, so a service deactivated on another worker is not sold
+    quantities = _pos_quantities(request.POST)
+    with service_catalog.confirming() as catalog:
+        services = filter(None, map(catalog.get_active, sorted(quantities)))
+        kpis.create_invoice_items(invoice, [
+            InvoiceItem(
+                invoice=invoice,
+                service_id=svc.id,
+                quantity=quantities[svc.id],
+                price_at_time=svc.price,
+                service_name_at_time=svc.name,
+            )
+            for svc in services
+        ])
+    return invoice
+
+
 @staff_required
 def staff_pos(request):
     """Simple mobile-friendly POS for approved staff: add/select patient, pick services, generate invoice."""
-    services = Service.objects.filter(active=True, is_archived=False)
     if request.method == 'POST':
-        # Determine patient: existing or new
-        patient_id = request.POST.get('patient_id')
-        if patient_id:
-            patient = get_object_or_404(Patient, pk=patient_id)
-        else:
-            # Create new patient from minimal fields
-            first_name = request.POST.get('first_name')
-            last_name = request.POST.get('last_name')
-            contact_number = request.POST.get('contact_number')
-            email = request.POST.get('email')
-            address = request.POST.get('address')
-            patient = Patient.objects.create(
-                first_name=first_name or 'Unknown',
-                last_name=last_name or 'Patient',
-                contact_number=contact_number or '',
-                email=email or '',
-                address=address or '',
-                created_by=request.user
-            )
-
-        # Create invoice
-        invoice = Invoice.objects.create(patient=patient, created_by=request.user)
-
-        # Collect service quantities from POST. Inputs are named service_<id>
-        for svc in services:
-            qty_raw = request.POST.get(f'service_{svc.id}')
-            try:
-                qty = int(qty_raw) if qty_raw else 0
-            except ValueError:
-                qty = 0
-            if qty and qty > 0:
-                InvoiceItem.objects.create(invoice=invoice, service=svc, quantity=qty)
-
+        invoice = _pos_checkout(request)
         return redirect('clinic:invoice_detail', pk=invoice.pk)
 
     # GET: show POS interface
-    return render(request, 'clinic/staff_pos.html', {'services': services})
+    return render(request, 'clinic/staff_pos.html', {'services': service_catalog.active()})
+
+
+@staff_required
+def patient_autocomplete(request):
+    """JSON patient matches for the POS picker, served from the in-memory prefix index."""
+    query = request.GET.get('q', '').strip()
+    try:
+        limit = min(int(request.GET.get('limit', 10)), 50)
+    except ValueError:
+        limit = 10
+    return JsonResponse({'results': patient_index.search(query, limit=limit)})
 
 # 9. Sales Analytics Module
 @superuser_required
+@reads_from_replica
 def sales_analytics(request):
     """Display sales analytics: daily, weekly, monthly, yearly"""
     today = timezone.now().date()
-    
-    # Daily sales
-    daily_start = timezone.make_aware(timezone.datetime.combine(today, timezone.datetime.min.time()))
-    daily_invoices = Invoice.objects.filter(date_created__gte=daily_start, is_archived=False)
-    daily_sales = sum(inv.total_amount() for inv in daily_invoices)
-    daily_count = daily_invoices.count()
-    
-    # Weekly sales (last 7 days)
-    weekly_start = today - timedelta(days=7)
-    weekly_start = timezone.make_aware(timezone.datetime.combine(weekly_start, timezone.datetime.min.time()))
-    weekly_invoices = Invoice.objects.filter(date_created__gte=weekly_start, is_archived=False)
-    weekly_sales = sum(inv.total_amount() for inv in weekly_invoices)
-    weekly_count = weekly_invoices.count()
-    
-    # Monthly sales (current month)
-    monthly_start = today.replace(day=1)
-    monthly_start = timezone.make_aware(timezone.datetime.combine(monthly_start, timezone.datetime.min.time()))
-    monthly_invoices = Invoice.objects.filter(date_created__gte=monthly_start, is_archived=False)
-    monthly_sales = sum(inv.total_amount() for inv in monthly_invoices)
-    monthly_count = monthly_invoices.count()
-    
-    # Yearly sales (current year)
-    yearly_start = today.replace(month=1, day=1)
-    yearly_start = timezone.make_aware(timezone.datetime.combine(yearly_start, timezone.datetime.min.time()))
-    yearly_invoices = Invoice.objects.filter(date_created__gte=yearly_start, is_archived=False)
-    yearly_sales = sum(inv.total_amount() for inv in yearly_invoices)
-    yearly_count = yearly_invoices.count()
-    
+
+    def start_of(day):
+        return timezone.make_aware(timezone.datetime.combine(day, timezone.datetime.min.time()))
+
+    windows = {
+        'daily': start_of(today),
+        'weekly': start_of(today - timedelta(days=7)),    # last 7 days
+        'monthly': start_of(today.replace(day=1)),
+        'yearly': start_of(today.replace(month=1, day=1)),
+    }
+    # Every figure is summed in SQL as integer centavos (clinic.money)
+    items = InvoiceItem.objects.filter(invoice__is_archived=False)
+    sales = items.aggregate(**{
+        name: Sum(LINE_TOTAL_CENTAVOS, filter=Q(invoice__date_created__gte=start))
+        for name, start in windows.items()
+    })
+    counts = Invoice.objects.aggregate(**{
+        name: Count('id', filter=Q(date_created__gte=start)) for name, start in windows.items()
+    })
+
     # Staff-wise sales breakdown
+    staff_totals = {
+        row['invoice__created_by']: row
+        for row in items.filter(invoice__created_by__isnull=False)
+        .values('invoice__created_by')
+        .annotate(
+            total=Sum(LINE_TOTAL_CENTAVOS),
+            **{
+                name: Sum(LINE_TOTAL_CENTAVOS, filter=Q(invoice__date_created__gte=start))
+                for name, start in windows.items()
+            },
+        )
+        .order_by()
+    }
+    staff_invoices = dict(
+        Invoice.objects.filter(created_by__isnull=False)
+        .values('created_by').annotate(n=Count('id')).order_by()
+        .values_list('created_by', 'n')
+    )
+    yearly_sales = sales['yearly'] or 0
     staff_sales = []
     for staff in User.objects.filter(is_staff=True, is_active=True):
-        staff_invoices = Invoice.objects.filter(created_by=staff, is_archived=False)
-        yearly_staff_sales = sum(inv.total_amount() for inv in staff_invoices.filter(date_created__gte=yearly_start))
-        
-        # Calculate percentage
-        if yearly_sales > 0:
-            percentage = (yearly_staff_sales / yearly_sales) * 100
-        else:
-            percentage = 0
-        
+        row = staff_totals.get(staff.pk, {})
+        yearly_staff_sales = row.get('yearly') or 0
         staff_sales.append({
             'staff': staff,
-            'total_sales': sum(inv.total_amount() for inv in staff_invoices),
-            'total_invoices': staff_invoices.count(),
-            'daily': sum(inv.total_amount() for inv in staff_invoices.filter(date_created__gte=daily_start)),
-            'weekly': sum(inv.total_amount() for inv in staff_invoices.filter(date_created__gte=weekly_start)),
-            'monthly': sum(inv.total_amount() for inv in staff_invoices.filter(date_created__gte=monthly_start)),
-            'yearly': yearly_staff_sales,
-            'yearly_percentage': percentage,
+            'total_sales': Money(row.get('total')),
+            'total_invoices': staff_invoices.get(staff.pk, 0),
+            'daily': Money(row.get('daily')),
+            'weekly': Money(row.get('weekly')),
+            'monthly': Money(row.get('monthly')),
+            'yearly': Money(yearly_staff_sales),
+            'yearly_percentage': yearly_staff_sales * 100 / yearly_sales if yearly_sales else 0,
         })
-    
-    context = {
-        'daily_sales': daily_sales,
-        'daily_count': daily_count,
-        'weekly_sales': weekly_sales,
-        'weekly_count': weekly_count,
-        'monthly_sales': monthly_sales,
-        'monthly_count': monthly_count,
-        'yearly_sales': yearly_sales,
-        'yearly_count': yearly_count,
-        'staff_sales': staff_sales,
-        'back_url': reverse('clinic:dashboard')
-    }
+
+    context = {'staff_sales': staff_sales, 'back_url': reverse('clinic:dashboard')}
+    for name in windows:
+        context[f'{name}_sales'] = Money(sales[name])
+        context[f'{name}_count'] = counts[name]
     return render(request, 'clinic/sales_analytics.html', context)
 
 # 10. Navigation / Back Button is handled via 'back_url' context in templates
@@ -801,8 +888,12 @@ from django.contrib.auth.decorators import user_passes_test
 from django.contrib.auth.models import User, Group
 from django.http import HttpResponse, JsonResponse
 from django.template.loader import render_to_string
-from .models import Service, Patient, Invoice, InvoiceItem
+from .models import Service, Patient, Invoice, InvoiceItem, LINE_TOTAL_CENTAVOS
+from .money import Money
+from .routers import reads_from_replica
+from .sqlite import retry_on_lock
 from .forms import StaffRegistrationForm, PatientForm
+import importlib.util
 import json
 
 # DRF imports for API
@@ -812,17 +903,11 @@ from rest_framework import status, permissions
 from rest_framework.authentication import SessionAuthentication, TokenAuthentication
 from rest_framework.authtoken.models import Token
 from .serializers import ServiceSerializer, PatientSerializer, InvoiceSerializer
+from .reports import staff_activity_report, staff_detail_report
 from django.contrib.auth import authenticate, login as auth_login, logout as auth_logout
 
-try:
-    from reportlab.lib.pagesizes import letter, A4
-    from reportlab.lib.styles import getSampleStyleSheet, ParagraphStyle
-    from reportlab.lib.units import inch
-    from reportlab.platypus import SimpleDocTemplate, Table, TableStyle, Paragraph, Spacer
-    from reportlab.lib import colors
-    HAS_REPORTLAB = True
-except ImportError:
-    HAS_REPORTLAB = False
+# Checked without importing it; the PDF views import the platypus stack themselves
+HAS_REPORTLAB = importlib.util.find_spec('reportlab') is not None
 
 
 def landing_view(request):
@@ -837,9 +922,9 @@ def superuser_required(view_func):
 def super_admin_dashboard(request):
     """Dashboard visible to superusers only."""
     total_patients = Patient.objects.count()
-    total_invoices = Invoice.objects.filter(is_archived=False).count()
+    total_invoices = Invoice.objects.count()
     total_staff = User.objects.filter(is_staff=True).count()
-    recent_invoices = Invoice.objects.filter(is_archived=False).order_by('-date_created')[:10]
+    recent_invoices = Invoice.objects.order_by('-date_created')[:10]
     return render(request, 'clinic/super_admin_dashboard.html', {
         'total_patients': total_patients,
         'total_invoices': total_invoices,
@@ -871,16 +956,14 @@ def sales_view(request):
     month_start = today_start.replace(day=1)
     year_start = today_start.replace(month=1, day=1)
 
-    daily_total = Invoice.objects.filter(is_archived=False, date_created__gte=today_start).aggregate(total=Sum('items__price_at_time'))['total'] or 0
-    weekly_total = Invoice.objects.filter(is_archived=False, date_created__gte=week_start).aggregate(total=Sum('items__price_at_time'))['total'] or 0
-    monthly_total = Invoice.objects.filter(is_archived=False, date_created__gte=month_start).aggregate(total=Sum('items__price_at_time'))['total'] or 0
-    yearly_total = Invoice.objects.filter(is_archived=False, date_created__gte=year_start).aggregate(total=Sum('items__price_at_time'))['total'] or 0
+    windows = {'daily': today_start, 'weekly': week_start, 'monthly': month_start, 'yearly': year_start}
+    totals = InvoiceItem.objects.filter(invoice__is_archived=False).aggregate(**{
+        name: Sum(LINE_TOTAL_CENTAVOS, filter=Q(invoice__date_created__gte=start))
+        for name, start in windows.items()
+    })
 
     return render(request, 'clinic/sales_admin.html', {
-        'daily_total': float(daily_total),
-        'weekly_total': float(weekly_total),
-        'monthly_total': float(monthly_total),
-        'yearly_total': float(yearly_total),
+        f'{name}_total': Money(total).as_float() for name, total in totals.items()
     })
 
 
@@ -924,7 +1007,7 @@ def new_registrations(request):
 
 @superuser_required
 def invoice_list(request):
-    invoices = Invoice.objects.filter(is_archived=False).order_by('-date_created')
+    invoices = Invoice.objects.order_by('-date_created')
     return render(request, 'clinic/invoice_list.html', {'invoices': invoices})
 
 
@@ -947,7 +1030,7 @@ def edit_invoice(request, invoice_id):
 
 @superuser_required
 def archived_invoices_list(request):
-    invoices = Invoice.objects.filter(is_archived=True).order_by('-date_created')
+    invoices = Invoice.all_objects.filter(is_archived=True).order_by('-date_created')
     return render(request, 'clinic/archived_invoices_list.html', {'invoices': invoices})
 
 
@@ -984,21 +1067,21 @@ def archive_staff(request, user_id):
 def select_services(request, patient_id):
     """Select services for a new patient and create invoice"""
     patient = Patient.objects.get(id=patient_id)
-    services = Service.objects.filter(active=True)
 
     # Ensure Medical Certificate service exists in DB so it's visible in frontend
-    try:
-        mc_defaults = {
-            'name': 'Medical Certificate',
-            'price': Service.DEFAULT_PRICES.get('MEDICAL_CERTIFICATE', 300),
-            'active': True,
-        }
-        Service.objects.get_or_create(category='MEDICAL_CERTIFICATE', defaults=mc_defaults)
-        # refresh queryset
-        services = Service.objects.filter(active=True)
-    except Exception:
-        # If something goes wrong creating the record, continue without failing the view
-        pass
+    if not any(s.category == 'MEDICAL_CERTIFICATE' for s in service_catalog.active()):
+        try:
+            mc_defaults = {
+                'name': 'Medical Certificate',
+                'price': Service.DEFAULT_PRICES.get('MEDICAL_CERTIFICATE', 300),
+                'active': True,
+            }
+            # all_objects: an archived certificate service stays archived, not duplicated
+            Service.all_objects.get_or_create(category='MEDICAL_CERTIFICATE', defaults=mc_defaults)
+        except Exception:
+            # If something goes wrong creating the record, continue without failing the view
+            pass
+    services = service_catalog.active()
     
     if request.method == 'POST':
         service_ids = request.POST.getlist('service_id')
@@ -1006,15 +1089,18 @@ def select_services(request, patient_id):
         
         if service_ids:
             invoice = Invoice.objects.create(patient=patient, created_by=request.user if request.user.is_authenticated else None)
-            for s_id, qty in zip(service_ids, quantities):
-                service = Service.objects.get(id=s_id)
-                InvoiceItem.objects.create(
-                    invoice=invoice,
-                    service=service,
-                    quantity=int(qty) if qty else 1,
-                    price_at_time=service.price,
-                    service_name_at_time=service.name
-                )
+            with service_catalog.confirming() as catalog:
+                for s_id, qty in zip(service_ids, quantities):
+                    service = catalog.get(s_id)
+                    if service is None:
+                        raise Http404('No Service matches the given query.')
+                    InvoiceItem.objects.create(
+                        invoice=invoice,
+                        service_id=service.id,
+                        quantity=int(qty) if qty else 1,
+                        price_at_time=service.price,
+                        service_name_at_time=service.name
+                    )
             return redirect('clinic:invoice_detail', pk=invoice.id)
     
     return render(request, 'clinic/select_services.html', {'patient': patient, 'services': services})
@@ -1089,6 +1175,25 @@ def add_patient(request):
     return render(request, 'clinic/add_patient.html', {'form': form})
 
 
+@retry_on_lock
+def _create_invoice_from_form(request, patient_id, service_ids, quantities):
+    patient = Patient.objects.get(id=patient_id)
+    invoice = Invoice.objects.create(patient=patient, created_by=request.user if request.user.is_authenticated else None)
+    with service_catalog.confirming() as catalog:
+        for s_id, qty in zip(service_ids, quantities):
+            service = catalog.get(s_id)
+            if service is None:
+                raise Http404('No Service matches the given query.')
+            InvoiceItem.objects.create(
+                invoice=invoice,
+                service_id=service.id,
+                quantity=int(qty),
+                price_at_time=service.price,
+                service_name_at_time=service.name
+            )
+    return invoice
+
+
 @frontend_login_required
 def create_invoice(request):
     patients = Patient.objects.all()
@@ -1097,24 +1202,14 @@ def create_invoice(request):
         patient_id = request.POST.get('patient')
         service_ids = request.POST.getlist('service_id')
         quantities = request.POST.getlist('quantity')
-        patient = Patient.objects.get(id=patient_id)
-        invoice = Invoice.objects.create(patient=patient, created_by=request.user if request.user.is_authenticated else None)
-        for s_id, qty in zip(service_ids, quantities):
-            service = Service.objects.get(id=s_id)
-            InvoiceItem.objects.create(
-                invoice=invoice,
-                service=service,
-                quantity=int(qty),
-                price_at_time=service.price,
-                service_name_at_time=service.name
-            )
+        invoice = _create_invoice_from_form(request, patient_id, service_ids, quantities)
         return redirect('clinic:invoice_detail', pk=invoice.id)
     return render(request, 'clinic/create_invoice.html', {'patients': patients, 'services': services})
 
 
 @frontend_login_required
 def invoice_detail(request, pk):
-    invoice = Invoice.objects.get(id=pk)
+    invoice = Invoice.all_objects.select_related('patient', 'created_by').prefetch_related('items').get(id=pk)
     # Show invoice detail UI
     return render(request, 'clinic/invoice_detail.html', {'invoice': invoice})
 
@@ -1122,7 +1217,7 @@ def invoice_detail(request, pk):
 @frontend_login_required
 def download_invoice_pdf(request, pk):
     """Download invoice as PDF"""
-    invoice = Invoice.objects.get(id=pk)
+    invoice = Invoice.all_objects.get(id=pk)
     
     if not HAS_REPORTLAB:
         # Fallback: return HTML that browser can print to PDF
@@ -1131,6 +1226,11 @@ def download_invoice_pdf(request, pk):
     
     # Generate PDF using ReportLab
     from io import BytesIO
+    from reportlab.lib import colors
+    from reportlab.lib.pagesizes import letter
+    from reportlab.lib.styles import getSampleStyleSheet, ParagraphStyle
+    from reportlab.lib.units import inch
+    from reportlab.platypus import SimpleDocTemplate, Table, TableStyle, Paragraph, Spacer
     
     buffer = BytesIO()
     doc = SimpleDocTemplate(buffer, pagesize=letter)
@@ -1212,7 +1312,7 @@ def download_invoice_pdf(request, pk):
 @api_view(['GET'])
 @permission_classes([permissions.AllowAny])
 def api_services_list(request):
-    services = Service.objects.filter(active=True)
+    services = service_catalog.active()
     serializer = ServiceSerializer(services, many=True)
     return Response({'services': serializer.data})
 
@@ -1231,6 +1331,7 @@ def api_add_patient(request):
 @api_view(['POST'])
 @authentication_classes([TokenAuthentication, SessionAuthentication])
 @permission_classes([permissions.IsAuthenticated])
+@retry_on_lock
 def api_create_invoice(request):
     """Expected JSON: {"patient_id": int, "items": [{"service_id": int, "quantity": int}, ...]}"""
     patient_id = request.data.get('patient_id')
@@ -1245,23 +1346,23 @@ def api_create_invoice(request):
 
     invoice = Invoice.objects.create(patient=patient, created_by=request.user if request.user and request.user.is_authenticated else None)
     created_items = []
-    for it in items:
-        service_id = it.get('service_id')
-        qty = int(it.get('quantity') or 1)
-        try:
-            service = Service.objects.get(id=service_id)
-        except Service.DoesNotExist:
-            invoice.delete()
-            return Response({'error': f'Service {service_id} not found'}, status=status.HTTP_404_NOT_FOUND)
-
-        ii = InvoiceItem.objects.create(
-            invoice=invoice,
-            service=service,
-            quantity=qty,
-            price_at_time=service.price,
-            service_name_at_time=service.name,
-        )
-        created_items.append({'service_id': service.id, 'quantity': ii.quantity, 'price': float(ii.price_at_time)})
+    with service_catalog.confirming() as catalog:
+        for it in items:
+            service_id = it.get('service_id')
+            qty = int(it.get('quantity') or 1)
+            service = catalog.get(service_id)
+            if service is None:
+                invoice.delete()
+                return Response({'error': f'Service {service_id} not found'}, status=status.HTTP_404_NOT_FOUND)
+
+            ii = InvoiceItem.objects.create(
+                invoice=invoice,
+                service_id=service.id,
+                quantity=qty,
+                price_at_time=service.price,
+                service_name_at_time=service.name,
+            )
+            created_items.append({'service_id': service.id, 'quantity': ii.quantity, 'price': float(ii.price_at_time)})
 
     total = float(invoice.total_amount())
     return Response({'invoice_id': invoice.id, 'total': total, 'items': created_items}, status=status.HTTP_201_CREATED)
@@ -1271,7 +1372,7 @@ def api_create_invoice(request):
 @permission_classes([permissions.AllowAny])
 def api_invoice_detail(request, pk):
     try:
-        invoice = Invoice.objects.get(id=pk)
+        invoice = Invoice.all_objects.select_related('patient').prefetch_related('items').get(id=pk)
     except Invoice.DoesNotExist:
         return Response({'error': 'Invoice not found'}, status=status.HTTP_404_NOT_FOUND)
 
@@ -1282,7 +1383,7 @@ def api_invoice_detail(request, pk):
     for it in invoice.items.all():
         items.append({
             'id': it.id,
-            'service_id': it.service.id,
+            'service_id': it.service_id,
             'service_name': it.service_name_at_time,
             'price': float(it.price_at_time),
             'quantity': it.quantity,
@@ -1434,73 +1535,10 @@ def api_logout(request):
 @api_view(['GET'])
 @authentication_classes([TokenAuthentication, SessionAuthentication])
 @permission_classes([permissions.IsAuthenticated])
+@reads_from_replica
 def api_staff_activity(request):
     """Retrieve all staff activity - patients added, invoices created, revenue"""
-    from .models import StaffProfile
-    from django.db.models import Sum
-    
-    staff_profiles = StaffProfile.objects.select_related('user').all()
-    
-    activity_data = []
-    for profile in staff_profiles:
-        # Get patients added by this staff member
-        patients = Patient.objects.filter(created_by=profile.user).order_by('-created_at')
-        
-        # Get invoices for those patients
-        patient_ids = patients.values_list('id', flat=True)
-        invoices = Invoice.objects.filter(patient_id__in=patient_ids).order_by('-date_created')
-        
-        # Calculate totals
-        total_revenue = invoices.aggregate(Sum('items__price_at_time'))['items__price_at_time__sum'] or 0
-        paid_invoices = invoices.filter(is_paid=True).count()
-        pending_invoices = invoices.filter(is_paid=False).count()
-        
-        # Recent patients
-        recent_patients = [
-            {
-                'id': p.id,
-                'first_name': p.first_name,
-                'last_name': p.last_name,
-                'email': p.email,
-                'phone': p.phone,
-                'added_date': p.created_at.isoformat(),
-                'invoices_count': p.invoices.count(),
-                'total_spent': sum(inv.total_amount() for inv in p.invoices.all())
-            }
-            for p in patients[:10]
-        ]
-        
-        # Recent invoices
-        recent_invoices = [
-            {
-                'id': inv.id,
-                'patient_name': f"{inv.patient.first_name} {inv.patient.last_name}",
-                'amount': inv.total_amount(),
-                'date_created': inv.date_created.isoformat(),
-                'is_paid': inv.is_paid,
-                'items_count': inv.items.count()
-            }
-            for inv in invoices[:10]
-        ]
-        
-        activity_data.append({
-            'staff_id': profile.id,
-            'username': profile.user.username,
-            'full_name': f"{profile.user.first_name} {profile.user.last_name}".strip() or "(No name)",
-            'position': profile.get_position_display(),
-            'email': profile.user.email,
-            'created_at': profile.created_at.isoformat(),
-            'statistics': {
-                'patients_added': patients.count(),
-                'total_invoices': invoices.count(),
-                'total_revenue': float(total_revenue),
-                'paid_invoices': paid_invoices,
-                'pending_invoices': pending_invoices
-            },
-            'recent_patients': recent_patients,
-            'recent_invoices': recent_invoices
-        })
-    
+    activity_data = staff_activity_report()
     return Response({
         'count': len(activity_data),
         'staff': activity_data
@@ -1510,82 +1548,17 @@ def api_staff_activity(request):
 @api_view(['GET'])
 @authentication_classes([TokenAuthentication, SessionAuthentication])
 @permission_classes([permissions.IsAuthenticated])
+@reads_from_replica
 def api_staff_detail(request, staff_id):
     """Retrieve detailed activity for a specific staff member"""
     from .models import StaffProfile
-    from django.db.models import Sum
     
     try:
-        profile = StaffProfile.objects.select_related('user').get(id=staff_id)
+        profile = StaffProfile.all_objects.select_related('user').get(id=staff_id)
     except StaffProfile.DoesNotExist:
         return Response({'error': 'Staff not found'}, status=status.HTTP_404_NOT_FOUND)
     
-    # Get patients added by this staff member
-    patients = Patient.objects.filter(created_by=profile.user).order_by('-created_at')
-    
-    # Get invoices for those patients
-    patient_ids = patients.values_list('id', flat=True)
-    invoices = Invoice.objects.filter(patient_id__in=patient_ids).order_by('-date_created')
-    
-    # Calculate totals
-    total_revenue = invoices.aggregate(Sum('items__price_at_time'))['items__price_at_time__sum'] or 0
-    paid_invoices = invoices.filter(is_paid=True).count()
-    pending_invoices = invoices.filter(is_paid=False).count()
-    
-    # All patients (with pagination option)
-    all_patients = [
-        {
-            'id': p.id,
-            'first_name': p.first_name,
-            'last_name': p.last_name,
-            'email': p.email,
-            'phone': p.phone,
-            'added_date': p.created_at.isoformat(),
-            'invoices_count': p.invoices.count(),
-            'total_spent': sum(inv.total_amount() for inv in p.invoices.all())
-        }
-        for p in patients
-    ]
-    
-    # All invoices (with pagination option)
-    all_invoices = [
-        {
-            'id': inv.id,
-            'patient_id': inv.patient_id,
-            'patient_name': f"{inv.patient.first_name} {inv.patient.last_name}",
-            'amount': inv.total_amount(),
-            'date_created': inv.date_created.isoformat(),
-            'is_paid': inv.is_paid,
-            'items_count': inv.items.count(),
-            'items': [
-                {
-                    'service': item.service.name,
-                    'quantity': item.quantity,
-                    'price': item.price_at_time
-                }
-                for item in inv.items.all()
-            ]
-        }
-        for inv in invoices
-    ]
-    
-    return Response({
-        'staff_id': profile.id,
-        'username': profile.user.username,
-        'full_name': f"{profile.user.first_name} {profile.user.last_name}".strip() or "(No name)",
-        'position': profile.get_position_display(),
-        'email': profile.user.email,
-        'created_at': profile.created_at.isoformat(),
-        'statistics': {
-            'total_patients': patients.count(),
-            'total_invoices': invoices.count(),
-            'total_revenue': float(total_revenue),
-            'paid_invoices': paid_invoices,
-            'pending_invoices': pending_invoices
-        },
-        'all_patients': all_patients,
-        'all_invoices': all_invoices
-    }, status=status.HTTP_200_OK)
+    return Response(staff_detail_report(profile), status=status.HTTP_200_OK)
 
 
 @api_view(['GET'])
@@ -1593,7 +1566,7 @@ def api_staff_detail(request, staff_id):
 def api_invoice_pdf(request, pk):
     """Download invoice as PDF (public access for now)"""
     try:
-        invoice = Invoice.objects.get(id=pk)
+        invoice = Invoice.all_objects.get(id=pk)
     except Invoice.DoesNotExist:
         return Response({'error': 'Invoice not found'}, status=status.HTTP_404_NOT_FOUND)
 
@@ -1604,6 +1577,11 @@ def api_invoice_pdf(request, pk):
 
     # Generate PDF using ReportLab
     from io import BytesIO
+    from reportlab.lib import colors
+    from reportlab.lib.pagesizes import letter
+    from reportlab.lib.styles import getSampleStyleSheet, ParagraphStyle
+    from reportlab.lib.units import inch
+    from reportlab.platypus import SimpleDocTemplate, Table, TableStyle, Paragraph, Spacer
 
     buffer = BytesIO()
     doc = SimpleDocTemplate(buffer, pagesize=letter)
@@ -1680,57 +1658,46 @@ def api_invoice_pdf(request, pk):
 @api_view(['GET'])
 @authentication_classes([TokenAuthentication, SessionAuthentication])
 @permission_classes([permissions.IsAuthenticated])
+@reads_from_replica
 def api_sales_summary(request):
     """Return sales totals for Day, Week, Month, Year"""
     try:
         from django.utils import timezone
         from datetime import timedelta
         from django.db.models import Sum
-        from decimal import Decimal
+        from django.db.models.functions import TruncDate
 
         now = timezone.now()
         today = now.date()
-
-        # Helper to convert Decimal to float
-        def to_float(value):
-            if value is None:
-                return 0.0
-            if isinstance(value, Decimal):
-                return float(value)
-            return float(value)
-
-        # Today
-        today_invoices = Invoice.objects.filter(date_created__date=today)
-        today_result = today_invoices.aggregate(Sum('items__price_at_time'))
-        today_total = to_float(today_result.get('items__price_at_time__sum'))
-
-        # This week (last 7 days)
-        week_start = now - timedelta(days=7)
-        week_invoices = Invoice.objects.filter(date_created__gte=week_start)
-        week_result = week_invoices.aggregate(Sum('items__price_at_time'))
-        week_total = to_float(week_result.get('items__price_at_time__sum'))
-
-        # This month
-        month_invoices = Invoice.objects.filter(date_created__year=now.year, date_created__month=now.month)
-        month_result = month_invoices.aggregate(Sum('items__price_at_time'))
-        month_total = to_float(month_result.get('items__price_at_time__sum'))
-
-        # This year
-        year_invoices = Invoice.objects.filter(date_created__year=now.year)
-        year_result = year_invoices.aggregate(Sum('items__price_at_time'))
-        year_total = to_float(year_result.get('items__price_at_time__sum'))
-
-        # Daily data for chart (last 30 days)
+        items = InvoiceItem.objects.filter(invoice__is_archived=False)
+
+        # Totals are summed as integer centavos and only become floats in the JSON
+        totals = items.aggregate(
+            today=Sum(LINE_TOTAL_CENTAVOS, filter=Q(invoice__date_created__date=today)),
+            # This week (last 7 days)
+            week=Sum(LINE_TOTAL_CENTAVOS, filter=Q(invoice__date_created__gte=now - timedelta(days=7))),
+            month=Sum(LINE_TOTAL_CENTAVOS, filter=Q(invoice__date_created__year=now.year, invoice__date_created__month=now.month)),
+            year=Sum(LINE_TOTAL_CENTAVOS, filter=Q(invoice__date_created__year=now.year)),
+        )
+        today_total = Money(totals['today']).as_float()
+        week_total = Money(totals['week']).as_float()
+        month_total = Money(totals['month']).as_float()
+        year_total = Money(totals['year']).as_float()
+
+        # Daily data for chart (last 30 days), one grouped query
+        first_day = today - timedelta(days=29)
+        by_day = dict(
+            items.filter(invoice__date_created__date__gte=first_day)
+            .annotate(day=TruncDate('invoice__date_created'))
+            .values('day').annotate(total=Sum(LINE_TOTAL_CENTAVOS)).order_by()
+            .values_list('day', 'total')
+        )
         daily_data = []
         for i in range(29, -1, -1):
-            day = now - timedelta(days=i)
-            day_date = day.date()
-            day_invoices = Invoice.objects.filter(date_created__date=day_date)
-            day_result = day_invoices.aggregate(Sum('items__price_at_time'))
-            day_total = to_float(day_result.get('items__price_at_time__sum'))
+            day_date = today - timedelta(days=i)
             daily_data.append({
                 'date': day_date.isoformat(),
-                'total': day_total,
+                'total': Money(by_day.get(day_date)).as_float(),
             })
 
         return Response({
@@ -3,14 +3,33 @@ ASGI config for dental_clinic project.
 
 It exposes the ASGI callable as a module-level variable named ``application``.
 
+The async API (clinic/async_api.py, under /api/async/) only pays off when
+served from here, for example with uvicorn workers under gunicorn:
+
+    gunicorn dental_clinic.asgi:application -k uvicorn.workers.UvicornWorker
+
+Everything else keeps working as sync views. ``manage.py run_load_test``
+compares a sync worker with an ASGI worker.
+
 For more information on this file, see
 https://docs.djangoproject.com/en/5.2/howto/deployment/asgi/
 """
 
+import logging
 import os
 
 from django.core.asgi import get_asgi_application
 
 os.environ.setdefault("DJANGO_SETTINGS_MODULE", "dental_clinic.settings")
+# Read by settings.py: no persistent database connections under ASGI
+os.environ["DJANGO_ASGI"] = "True"
 
 application = get_asgi_application()
+
+# Migrate, collectstatic and the admin upsert, once per deploy (clinic/startup.py)
+if os.getenv('RUN_STARTUP_TASKS', 'True').lower() in ('1', 'true', 'yes'):
+    try:
+        from clinic.startup import run_startup_tasks
+        run_startup_tasks()
+    except Exception:
+        logging.getLogger('startup').exception('[startup] Unexpected error during startup tasks')
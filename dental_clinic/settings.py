@@ -4,6 +4,7 @@ Generated by 'django-admin startproject' using Django 5.2.8.
 """
 
 from pathlib import Path
+import importlib.util
 import os
 from dotenv import load_dotenv
 try:
@@ -47,10 +48,18 @@ INSTALLED_APPS = [
     'corsheaders',
     'rest_framework',
     'rest_framework.authtoken',
-    'django_extensions',
 ]
 
+# Developer tools (shell_plus, runserver_plus, ...) only when debugging and
+# installed; production workers don't import them.
+if DEBUG and importlib.util.find_spec('django_extensions'):
+    INSTALLED_APPS.append('django_extensions')
+
 MIDDLEWARE = [
+    # Outermost, so its timings cover the other middleware too
+    'clinic.profiling.ProfilingMiddleware',
+    'clinic.metrics.MetricsMiddleware',
+    'clinic.slow_queries.SlowQueryMiddleware',
     'corsheaders.middleware.CorsMiddleware',
     "django.middleware.security.SecurityMiddleware",
     'whitenoise.middleware.WhiteNoiseMiddleware',
@@ -60,6 +69,7 @@ MIDDLEWARE = [
     "django.contrib.auth.middleware.AuthenticationMiddleware",
     "django.contrib.messages.middleware.MessageMiddleware",
     "django.middleware.clickjacking.XFrameOptionsMiddleware",
+    'clinic.routers.ReplicaPinMiddleware',
 ]
 
 ROOT_URLCONF = "dental_clinic.urls"
@@ -129,6 +139,73 @@ else:
         }
     }
 
+# Optional read replica for reports and exports (see clinic/routers.py).
+# Two SQLite files work for local testing: sqlite:////path/to/replica.sqlite3
+REPLICA_DATABASE_URL = os.getenv('REPLICA_DATABASE_URL')
+if REPLICA_DATABASE_URL:
+    if dj_database_url is None:
+        raise ImproperlyConfigured(
+            'REPLICA_DATABASE_URL is set but the Python package "dj-database-url" is not installed in this environment.'
+        )
+    DATABASES['replica'] = dj_database_url.parse(REPLICA_DATABASE_URL, conn_max_age=600)
+    # Tests read the replica through the default test database
+    DATABASES['replica']['TEST'] = {'MIRROR': 'default'}
+DATABASE_ROUTERS = ['clinic.routers.ReplicaRouter']
+REPLICA_PIN_SECONDS = int(os.getenv('REPLICA_PIN_SECONDS', '10'))
+
+# Under ASGI (dental_clinic/asgi.py sets DJANGO_ASGI) every request runs its
+# queries in a thread of its own, so a persistent connection would be left
+# behind by each request. Connect per request instead.
+if os.getenv('DJANGO_ASGI') == 'True':
+    for database in DATABASES.values():
+        database['CONN_MAX_AGE'] = 0
+
+# Request profiling (clinic/profiling.py): Server-Timing headers on every
+# response, plus cProfile dumps for requests sent with
+# "X-Profile: <PROFILING_TOKEN>" and for a sampled fraction of all requests.
+# Leave PROFILING_TOKEN unset to ignore the header.
+PROFILING_ENABLED = os.getenv('PROFILING_ENABLED', 'False') == 'True'
+PROFILING_TOKEN = os.getenv('PROFILING_TOKEN', '')
+PROFILING_SAMPLE_RATE = float(os.getenv('PROFILING_SAMPLE_RATE', '0'))
+PROFILING_DIR = Path(os.getenv('PROFILING_DIR', BASE_DIR / 'profiles'))
+
+# Prometheus metrics at /metrics (clinic/metrics.py). With several gunicorn
+# workers, point METRICS_DIR at a directory they share so a scrape covers all
+# of them; empty it on deploy.
+METRICS_ENABLED = os.getenv('METRICS_ENABLED', 'True') == 'True'
+METRICS_DIR = os.getenv('METRICS_DIR')
+METRICS_TOKEN = os.getenv('METRICS_TOKEN', '')
+
+# Statements slower than this many ms are logged and saved with their EXPLAIN
+# plan (clinic/slow_queries.py, "Slow queries" in the admin); 0 turns it off.
+SLOW_QUERY_MS = float(os.getenv('SLOW_QUERY_MS', '200'))
+# At most this many of a request's slow statements are saved (all are logged)
+SLOW_QUERY_MAX_PER_REQUEST = int(os.getenv('SLOW_QUERY_MAX_PER_REQUEST', '20'))
+
+# Async API (clinic/async_api.py): receipt PDFs are drawn in a pool of this
+# many threads, or processes with ASYNC_RENDER_POOL=process, off the event loop.
+ASYNC_RENDER_WORKERS = int(os.getenv('ASYNC_RENDER_WORKERS', '4'))
+ASYNC_RENDER_POOL = os.getenv('ASYNC_RENDER_POOL', 'thread')
+
+# Each worker caches the service catalog (clinic/catalog.py). Invoices always
+# check the catalog version in the database first; pages and read APIs check
+# it once their copy is this many seconds old.
+SERVICE_CATALOG_MAX_AGE = int(os.getenv('SERVICE_CATALOG_MAX_AGE', '60'))
+
+# Cold start budget for `manage.py profile_imports`: importing the WSGI app and
+# all views in a fresh process must take no longer than this many ms.
+IMPORT_TIME_BUDGET_MS = float(os.getenv('IMPORT_TIME_BUDGET_MS', '1000'))
+
+# Where clinic/startup.py records which deploy tasks are done, and its lock
+STARTUP_STATE_DIR = Path(os.getenv('STARTUP_STATE_DIR', BASE_DIR))
+
+# SQLite: take the write lock at BEGIN, where the busy timeout can wait for it,
+# instead of failing when a read transaction upgrades. Pragmas are applied in
+# clinic/sqlite.py; override them with SQLITE_PRAGMAS.
+for database in DATABASES.values():
+    if database['ENGINE'] == 'django.db.backends.sqlite3':
+        database.setdefault('OPTIONS', {}).setdefault('transaction_mode', 'IMMEDIATE')
+
 # Password validation
 AUTH_PASSWORD_VALIDATORS = [
     {"NAME": "django.contrib.auth.password_validation.UserAttributeSimilarityValidator"},
@@ -146,7 +223,7 @@ USE_TZ = True
 # Static files
 # Use leading slash so `static` template tag generates absolute paths (e.g. /static/...) for templates
 STATIC_URL = "/static/"
-STATIC_ROOT = BASE_DIR / "staticfiles"
+STATIC_ROOT = Path(os.getenv("STATIC_ROOT", BASE_DIR / "staticfiles"))
 
 # WhiteNoise configuration for static files
 STATICFILES_STORAGE = 'whitenoise.storage.CompressedManifestStaticFilesStorage'
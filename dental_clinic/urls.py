@@ -19,6 +19,7 @@ from django.contrib import admin
 from django.urls import path, include
 from clinic import views as clinic_views
 from clinic.admin import custom_admin_site
+from clinic.metrics import metrics_view
 from rest_framework.decorators import api_view, permission_classes
 from rest_framework import permissions, status
 from rest_framework.response import Response
@@ -42,7 +43,9 @@ def api_root(request):
 
 urlpatterns = [
     path('admin/', custom_admin_site.urls),
+    path('metrics', metrics_view, name='metrics'),
     path('api/', api_root, name='api_root'),
+    path('api/async/', include('clinic.urls_async')),
     path('api/', include('clinic.urls_api')),
     path('accounts/login/', clinic_views.login_view, name='login'),
     path('accounts/logout/', clinic_views.logout_view, name='logout'),